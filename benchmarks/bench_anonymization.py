@@ -0,0 +1,130 @@
+"""
+Benchmarks of the anonymization hot paths, in asv style: classes with
+setup/teardown methods and time_* methods, with optional params.
+They can be run with asv or with benchmarks/run.py.
+
+The files attribute of a benchmark is the number of DICOM files processed by
+one call of its time_* methods, used to report a throughput.
+"""
+import os
+import shutil
+import tempfile
+
+from deidentification.anonymizer import Anonymizer, anonymize, check_anonymize
+from deidentification.archive import pack, unpack
+
+from . import synthetic
+
+# Sizes of the synthetic datasets, scaled by BENCHMARK_SCALE (default 1)
+SCALE = float(os.environ.get('BENCHMARK_SCALE', '1'))
+SERIES_SLICES = max(1, int(64 * SCALE))
+ENHANCED_FRAMES = max(1, int(128 * SCALE))
+CSA_SIZE = 16 * 1024
+PRIVATE_ELEMENTS = 4000
+
+
+class _TempFolderBenchmark():
+
+    def setup(self, *params):
+        self.folder = tempfile.mkdtemp(prefix='deid_bench_')
+
+    def teardown(self, *params):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def output(self, name='out'):
+        output = os.path.join(self.folder, name)
+        if os.path.exists(output):
+            if os.path.isdir(output):
+                shutil.rmtree(output)
+            else:
+                os.remove(output)
+        return output
+
+
+class RunAno(_TempFolderBenchmark):
+
+    """Anonymizer.run_ano on one file of each kind."""
+
+    params = ['mr', 'siemens_csa', 'private_heavy', 'enhanced_mr']
+    param_names = ['dataset']
+    files = 1
+
+    def setup(self, dataset):
+        super().setup()
+        if dataset == 'mr':
+            self.dicom_path = synthetic.mr_series(os.path.join(self.folder, 'in'), slices=1)[0]
+        elif dataset == 'siemens_csa':
+            self.dicom_path = synthetic.mr_series(os.path.join(self.folder, 'in'), slices=1,
+                                                  siemens_csa_size=CSA_SIZE)[0]
+        elif dataset == 'private_heavy':
+            self.dicom_path = synthetic.mr_series(os.path.join(self.folder, 'in'), slices=1,
+                                                  siemens_csa_size=CSA_SIZE,
+                                                  private_elements=PRIVATE_ELEMENTS)[0]
+        else:
+            self.dicom_path = synthetic.enhanced_mr(os.path.join(self.folder, 'in', 'IM0001'),
+                                                    frames=ENHANCED_FRAMES)
+        self.dicom_out = os.path.join(self.folder, 'IM_ano')
+
+    def time_run_ano(self, dataset):
+        Anonymizer(self.dicom_path, self.dicom_out).run_ano()
+
+
+class Anonymize(_TempFolderBenchmark):
+
+    """anonymize on a single-frame MR series, as a folder or an archive."""
+
+    params = ['folder', 'zip', 'tar.gz']
+    param_names = ['input']
+    files = SERIES_SLICES
+
+    def setup(self, input):
+        super().setup()
+        series = os.path.join(self.folder, 'series')
+        synthetic.mr_series(series, slices=SERIES_SLICES, siemens_csa_size=CSA_SIZE)
+        if input == 'folder':
+            self.dicom_in = series
+        else:
+            self.dicom_in = synthetic.archive(os.path.join(self.folder, f'series.{input}'), series)
+
+    def time_anonymize(self, input):
+        anonymize(self.dicom_in, self.output())
+
+
+class CheckAnonymize(_TempFolderBenchmark):
+
+    """check_anonymize on a deidentified single-frame MR series."""
+
+    files = SERIES_SLICES
+
+    def setup(self):
+        super().setup()
+        series = os.path.join(self.folder, 'series')
+        synthetic.mr_series(series, slices=SERIES_SLICES, siemens_csa_size=CSA_SIZE)
+        self.dicom_in = os.path.join(self.folder, 'series_ano')
+        anonymize(series, self.dicom_in)
+
+    def time_check_anonymize(self):
+        check_anonymize(self.dicom_in)
+
+
+class Archive(_TempFolderBenchmark):
+
+    """archive.pack and archive.unpack of a single-frame MR series."""
+
+    params = ['zip', 'tar', 'tar.gz']
+    param_names = ['format']
+    files = SERIES_SLICES
+
+    def setup(self, format):
+        super().setup()
+        self.series = os.path.join(self.folder, 'series')
+        synthetic.mr_series(self.series, slices=SERIES_SLICES)
+        self.sources = [os.path.join(self.series, name) for name in sorted(os.listdir(self.series))]
+        self.archive_path = os.path.join(self.folder, f'series.{format}')
+        pack(self.archive_path, self.sources)
+
+    def time_pack(self, format):
+        pack(self.output(f'out.{format}'), self.sources)
+
+    def time_unpack(self, format):
+        unpack(self.archive_path, self.output())
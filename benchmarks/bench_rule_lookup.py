@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the confidentiality profile lookup done for each data element.
+
+Compares the compiled RuleTable lookup with the former dict lookup followed
+by a linear scan of the tag ranges, on the elements of a DICOM header.
+"""
+import argparse
+import timeit
+
+import pydicom
+
+from deidentification import tag_lists
+from deidentification.rules import RuleTable
+
+
+def legacy_conf_profile_action(group, element):
+    if (group, element) in tag_lists.conf_profile:
+        return tag_lists.conf_profile[(group, element)]['profile'][0]
+    for tag_range in tag_lists.conf_profile_range:
+        (group_min, element_min), (group_max, element_max) = tag_range
+        if group_min <= group <= group_max and element_min <= element <= element_max:
+            return tag_lists.conf_profile_range[tag_range]['profile'][0]
+    return ''
+
+
+def header_tags(dicom_path):
+    tags = []
+    pydicom.dcmread(dicom_path).walk(
+        lambda ds, data_element: tags.append((data_element.tag.group, data_element.tag.element)))
+    return tags
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dicom', default='tests/data/dicoms/IM04')
+    parser.add_argument('-n', '--number', type=int, default=200)
+    args = parser.parse_args()
+
+    tags = header_tags(args.dicom)
+    rules = RuleTable()
+    assert [rules.profile_action(*tag) for tag in tags] == [legacy_conf_profile_action(*tag) for tag in tags]
+
+    for name, lookup in (('legacy scan', legacy_conf_profile_action),
+                         ('rule table', rules.profile_action)):
+        duration = min(timeit.repeat(lambda: [lookup(group, element) for group, element in tags],
+                                     number=args.number, repeat=5))
+        print(f'{name:12}: {duration / args.number / len(tags) * 1e9:8.1f} ns/element '
+              f'({len(tags)} elements)')
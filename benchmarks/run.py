@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Runs the asv-style benchmarks of benchmarks/bench_*.py without asv.
+
+    python -m benchmarks.run [-b PATTERN] [-o results.json] [-c baseline.json]
+
+Each time_* method is timed repeat times after its setup, and its best time
+is kept. Results can be saved in a JSON file and compared to a baseline:
+the exit status is 1 if a benchmark is slower than the baseline by more
+than the threshold factor.
+"""
+import argparse
+import importlib
+import itertools
+import json
+import pkgutil
+import re
+import sys
+import timeit
+
+import benchmarks
+
+
+def iter_benchmarks(pattern=None):
+    """Yields (name, benchmark class, method name, params) of the benchmarks."""
+    for module_info in sorted(pkgutil.iter_modules(benchmarks.__path__), key=lambda m: m.name):
+        if not module_info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module(f'benchmarks.{module_info.name}')
+        for class_name, benchmark_class in sorted(vars(module).items()):
+            if not isinstance(benchmark_class, type) or class_name.startswith('_'):
+                continue
+            params = getattr(benchmark_class, 'params', [])
+            if params and not isinstance(params[0], (list, tuple)):
+                params = [params]
+            for method_name in sorted(vars(benchmark_class)):
+                if not method_name.startswith('time_'):
+                    continue
+                for param in itertools.product(*params):
+                    name = f'{module_info.name}.{class_name}.{method_name}'
+                    if param:
+                        name += '(' + ', '.join(map(str, param)) + ')'
+                    if pattern is None or re.search(pattern, name):
+                        yield name, benchmark_class, method_name, param
+
+
+def run_benchmark(benchmark_class, method_name, param, repeat):
+    """Returns the best time in seconds of a benchmark method."""
+    benchmark = benchmark_class()
+    if hasattr(benchmark, 'setup'):
+        benchmark.setup(*param)
+    try:
+        method = getattr(benchmark, method_name)
+        return min(timeit.repeat(lambda: method(*param), number=1, repeat=repeat))
+    finally:
+        if hasattr(benchmark, 'teardown'):
+            benchmark.teardown(*param)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the deidentification benchmarks.')
+    parser.add_argument('-b', '--bench', default=None,
+                        help='Regular expression of the benchmark names to run')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', default=None,
+                        help='JSON file where results are saved')
+    parser.add_argument('-c', '--compare', default=None,
+                        help='JSON results of a previous run to compare to')
+    parser.add_argument('-t', '--threshold', type=float, default=1.2,
+                        help='Slowdown factor reported as a regression')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    regressions = []
+    for name, benchmark_class, method_name, param in iter_benchmarks(args.bench):
+        duration = run_benchmark(benchmark_class, method_name, param, args.repeat)
+        results[name] = duration
+        files = getattr(benchmark_class, 'files', None)
+        line = f'{name:60} {duration * 1000:10.1f} ms'
+        if files:
+            line += f' {files / duration:10.1f} files/s'
+        if name in baseline:
+            ratio = duration / baseline[name]
+            line += f' {ratio:6.2f}x'
+            if ratio > args.threshold:
+                regressions.append(name)
+                line += ' REGRESSION'
+        print(line, flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+    if regressions:
+        print(f'{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold}x')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
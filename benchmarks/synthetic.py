@@ -0,0 +1,158 @@
+"""
+Synthetic DICOM data used by the benchmarks.
+
+Datasets are built from scratch with random identifiers, so that benchmarks
+do not depend on real (and identifying) data.
+"""
+import os
+import random
+
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+from deidentification.archive import pack
+
+ENHANCED_MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4.1'
+
+
+def _file_dataset(sop_class_uid, study_uid, series_uid, instance_number):
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = sop_class_uid
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = sop_class_uid
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.FrameOfReferenceUID = generate_uid()
+    ds.Modality = 'MR'
+    ds.ImageType = ['ORIGINAL', 'PRIMARY', 'M', 'ND']
+    ds.PatientName = 'DOE^JOHN'
+    ds.PatientID = 'PAT0001'
+    ds.PatientBirthDate = '19700101'
+    ds.PatientSex = 'M'
+    ds.StudyDate = ds.SeriesDate = ds.AcquisitionDate = '20240101'
+    ds.StudyTime = ds.SeriesTime = '120000'
+    ds.AccessionNumber = 'ACC0001'
+    ds.InstitutionName = 'Hospital'
+    ds.ReferringPhysicianName = 'HOUSE^GREGORY'
+    ds.StationName = 'MRC0001'
+    ds.SeriesDescription = 't1_mprage'
+    ds.InstanceNumber = instance_number
+    ds.SliceThickness = '1.0'
+    ds.RepetitionTime = '2300'
+    ds.EchoTime = '2.98'
+    return ds
+
+
+def _set_pixels(ds, rows, columns, frames=1):
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.Rows = rows
+    ds.Columns = columns
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.PixelData = random.Random(0).randbytes(frames * rows * columns * 2)
+
+
+def _add_siemens_private_tags(ds, csa_size):
+    ds.add_new((0x0019, 0x0010), 'LO', 'SIEMENS MR HEADER')
+    ds.add_new((0x0019, 0x1008), 'CS', 'IMAGE NUM 4')
+    ds.add_new((0x0019, 0x100B), 'DS', '3200')
+    ds.add_new((0x0019, 0x100F), 'SH', 'Fast')
+    ds.add_new((0x0029, 0x0010), 'LO', 'SIEMENS CSA HEADER')
+    ds.add_new((0x0029, 0x0011), 'LO', 'SIEMENS MEDCOM HEADER2')
+    ds.add_new((0x0029, 0x1008), 'CS', 'IMAGE NUM 4')
+    ds.add_new((0x0029, 0x1010), 'OB', os.urandom(csa_size))
+    ds.add_new((0x0029, 0x1018), 'CS', 'MR')
+    ds.add_new((0x0029, 0x1020), 'OB', os.urandom(csa_size * 4))
+    ds.add_new((0x0029, 0x1160), 'LO', 'com')
+
+
+# Private creators of the private blocks added by _add_private_elements,
+# safe (listed in safe private attributes) or not
+PRIVATE_CREATORS = ['SIEMENS MR HEADER', 'SIEMENS CSA HEADER', 'GEMS_PARM_01', 'GEMS_ACQU_01',
+                    'Philips Imaging DD 001', 'ACME PRIVATE 1', 'ACME PRIVATE 2']
+
+
+def _add_private_elements(ds, count):
+    """Adds count private elements, in blocks of 256 elements of PRIVATE_CREATORS."""
+    groups = [0x0019, 0x0021, 0x0029, 0x0043, 0x2001]
+    rng = random.Random(0)
+    block_index = 0
+    while count > 0:
+        group = groups[block_index % len(groups)]
+        creator = PRIVATE_CREATORS[block_index % len(PRIVATE_CREATORS)]
+        block = ds.private_block(group, creator, create=True)
+        for offset in range(min(count, 256)):
+            if offset % 3 == 0:
+                block.add_new(offset, 'DS', f'{rng.random():.6f}')
+            elif offset % 3 == 1:
+                block.add_new(offset, 'LO', f'value {offset}')
+            else:
+                block.add_new(offset, 'US', offset)
+        count -= 256
+        block_index += 1
+
+
+def mr_series(folder, slices=64, rows=256, columns=256, siemens_csa_size=0, private_elements=0):
+    """
+    Writes a single-frame MR series of slices files in folder and returns their paths.
+    Siemens private tags, with CSA headers of siemens_csa_size bytes, are added
+    if siemens_csa_size is not 0, and private_elements private elements of
+    several vendors.
+    """
+    os.makedirs(folder, exist_ok=True)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    paths = []
+    for i in range(slices):
+        ds = _file_dataset(MRImageStorage, study_uid, series_uid, i + 1)
+        ds.SliceLocation = str(float(i))
+        ds.ImagePositionPatient = [0, 0, i]
+        if siemens_csa_size:
+            _add_siemens_private_tags(ds, siemens_csa_size)
+        if private_elements:
+            _add_private_elements(ds, private_elements)
+        _set_pixels(ds, rows, columns)
+        path = os.path.join(folder, f'IM{i + 1:04d}')
+        pydicom.dcmwrite(path, ds, write_like_original=False)
+        paths.append(path)
+    return paths
+
+
+def enhanced_mr(path, frames=128, rows=256, columns=256):
+    """Writes an enhanced (multi-frame) MR file of frames frames in path."""
+    ds = _file_dataset(ENHANCED_MR_IMAGE_STORAGE, generate_uid(), generate_uid(), 1)
+    ds.NumberOfFrames = frames
+    per_frame = []
+    for i in range(frames):
+        frame = Dataset()
+        frame_content = Dataset()
+        frame_content.FrameAcquisitionDateTime = '20240101120000.00'
+        frame_content.InStackPositionNumber = i + 1
+        frame_content.DimensionIndexValues = [1, i + 1]
+        frame.FrameContentSequence = Sequence([frame_content])
+        plane_position = Dataset()
+        plane_position.ImagePositionPatient = [0, 0, i]
+        frame.PlanePositionSequence = Sequence([plane_position])
+        per_frame.append(frame)
+    ds.PerFrameFunctionalGroupsSequence = Sequence(per_frame)
+    _set_pixels(ds, rows, columns, frames)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    pydicom.dcmwrite(path, ds, write_like_original=False)
+    return path
+
+
+def archive(path, folder):
+    """Packs the files of folder in the path archive (zip, tar, tar.gz...)."""
+    pack(path, [os.path.join(folder, name) for name in sorted(os.listdir(folder))])
+    return path
@@ -3,58 +3,49 @@
 # This script is not guaranteed to be complete.
 # In particular, the detection of burnt-in PHI is not managed.
 
-import csv
-import hashlib
+import io
 import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
 import shutil
 from glob import glob
 from tempfile import mkdtemp
-from uuid import UUID
 
 import pydicom
 
 import deidentification as deid
-from deidentification import DeidentificationError, tag_lists
-from deidentification.archive import (is_archive_ext, is_archive_file, pack,
-                                      unpack, unpack_first)
-from deidentification.config import load_config_profile
-from deidentification.dicom import is_imaging_modality, is_folder_empty_of_files, is_dicom
-from deidentification.dicom import is_capture, is_capture_dicom, is_spectro
-
-
-def _load_config(config_profile, tags_to_keep, tags_to_delete, anonymous):
-    """Load config if no conflict with other params.
-
-    Parameters
-    ----------
-    config_profile : str
-    tags_to_keep : list
-    tags_to_delete : list
-    anonymous : bool
-
-    Returns
-    -------
-    tags_to_keep : list
-    tags_to_delete : list
-
-    Raises
-    ------
-    DeidentificationError
-        In case of config profile AND tags_to_keep/tags_to_delete defined
-    """
-    tags_config = {}
-    if config_profile:
-        if tags_to_keep or tags_to_delete:
-            raise DeidentificationError('Both tags_to_keep/tags_to_delete and config_profile have been specified.')
-
-        tags_config = load_config_profile(config_profile, anonymous)
-    else:
-        if tags_to_keep:
-            tags_config.update({k: {'action': 'K'} for k in tags_to_keep})
-        if tags_to_delete:
-            tags_config.update({x: {'action': 'X'} for x in tags_to_delete})
-    return tags_config
+from deidentification import DeidentificationError
+from deidentification.archive import (ArchiveIndex, ArchiveWriter, is_archive_ext, is_archive_file,
+                                      iter_archive_files, unpack)
+from deidentification.audit import AuditSummary, FileVerdict, SampleAudit
+from deidentification.manifest import FILE_DONE, FILE_FAILED, Manifest, file_digest
+from deidentification.pipeline import run_pipeline
+from deidentification.plan import AnonymizationPlan
+from deidentification.rules import FORCE, REMOVE, RuleTable, is_private_creator
+from deidentification.tracking import TRACK_DIGEST, TRACK_NONE, ValueTracker
+from deidentification.report import (REPORT_FILENAME, REPORT_FORMATS, DeidentificationReport,
+                                     ReportRows, append_report_rows, report_filename)
+from deidentification.uids import UIDCache, _generate_dicom_uid, _generate_uuid  # noqa: F401
+from deidentification.writer import dcmwrite_passthrough, detach_bulk_elements, is_bulk_data
+from deidentification.dicom import is_imaging_modality, is_folder_empty_of_files
+from deidentification.dicom import (PASSTHROUGH_DEFER_SIZE, FileClassification,
+                                    classify_file, classify_fileobj, is_capture_dicom,
+                                    is_spectro, read_series_instance_uid, read_sop_instance_uid)
+
+
+# Keys identifying duplicate input files (see anonymize)
+DEDUPE_KEYS = ('content', 'instance')
+
+# Number of files sent at once to a worker process by audit_folder
+CHECK_SHARD_SIZE = 64
+
+# Default number of files checked per series, and proportion of not
+# deidentified files of a series to be detected, by check_anonymize_sample
+SAMPLE_FILES_PER_SERIES = 5
+SAMPLE_TOLERANCE = 0.5
 
 
 def anonymize_file(dicom_file_in, dicom_folder_out,
@@ -64,7 +55,12 @@ def anonymize_file(dicom_file_in, dicom_folder_out,
                    config_profile=None,
                    anonymous=False,
                    report_path=None,
-                   capture_folder=None):
+                   capture_folder=None,
+                   clean_empty_output=True,
+                   report=None,
+                   uid_cache=None,
+                   plan=None,
+                   use_mmap=None):
     """Configures the Anonymizer and runs it on a DICOM file
 
     Parameters
@@ -78,57 +74,76 @@ def anonymize_file(dicom_file_in, dicom_folder_out,
     anonymous : bool, optional
     report_path : Path, optional
     capture_folder: None|str, optional
+    clean_empty_output : bool, optional
+        Remove dicom_folder_out if no file has been written in it.
+    report : report.DeidentificationReport, optional
+        Report sink used instead of report_path.
+    uid_cache : uids.UIDCache, optional
+        Cache of the generated UIDs.
+    plan : plan.AnonymizationPlan, optional
+        Resolved configuration, used instead of tags_to_keep, tags_to_delete,
+        forced_values, config_profile and anonymous.
+    use_mmap : bool, optional
+        Read dicom_file_in through a memory map (see dicom.MappedFile).
+        Defaults to the DEIDENTIFICATION_MMAP environment variable.
+
+    Returns
+    -------
+    str or None
+        Path of the output file, None if the file has been removed.
     """
     if os.path.isfile(dicom_folder_out):
         raise DeidentificationError('The DICOM output has to be a folder.')
 
-    tags_config = _load_config(config_profile, tags_to_keep,
-                               tags_to_delete, anonymous)
+    if plan is None:
+        plan = AnonymizationPlan(tags_to_keep, tags_to_delete, forced_values,
+                                 config_profile, anonymous)
+
+    # Read and identify the file once
+    classification = classify_file(dicom_file_in, use_mmap=use_mmap, defer_size=PASSTHROUGH_DEFER_SIZE)
 
-    # Only keep filename in case of config_profile path
-    if config_profile:
-        profile_name = os.path.basename(config_profile).rsplit('.', 1)[0]
-    else:
-        profile_name = config_profile
-    
     # Check for screen capture files
-    if capture_type := is_capture(dicom_file_in):
-        if capture_folder:
+    if capture_folder:
+        if classification.kind == FileClassification.IMAGE:
             os.makedirs(capture_folder, exist_ok=True)
-            if capture_type == "image":
-                # move file to a "captures" folder
-                shutil.copy2(dicom_file_in, os.path.join(capture_folder, os.path.basename(dicom_file_in)))
-                return
-            elif capture_type == "dicom":
-                file_out = os.path.join(capture_folder, os.path.basename(dicom_file_in))
-                anon = Anonymizer(dicom_file_in, file_out,
-                                tags_config, forced_values,
-                                anonymous=anonymous,
-                                config_profile=profile_name,
-                                report_path=report_path,
-                                keep_capture=True)
-                anon.run_ano()
-                return
+            # move file to a "captures" folder
+            file_out = os.path.join(capture_folder, os.path.basename(dicom_file_in))
+            shutil.copy2(dicom_file_in, file_out)
+            return file_out
+        elif classification.kind == FileClassification.CAPTURE:
+            os.makedirs(capture_folder, exist_ok=True)
+            file_out = os.path.join(capture_folder, os.path.basename(dicom_file_in))
+            anon = Anonymizer(dicom_file_in, file_out,
+                              plan=plan,
+                              report_path=report_path,
+                              keep_capture=True,
+                              dataset=classification.dataset,
+                              report=report,
+                              uid_cache=uid_cache)
+            return file_out if anon.run_ano() else None
 
     os.makedirs(dicom_folder_out, exist_ok=True)
     dicom_file_out = os.path.join(dicom_folder_out,
                                   os.path.basename(dicom_file_in))
 
     # Keep spectro non DICOM data
-    if not is_dicom(dicom_file_in) and is_spectro(dicom_file_in):
+    if not classification.is_dicom and is_spectro(dicom_file_in):
         shutil.copy2(dicom_file_in, dicom_file_out)
-        return
+        return dicom_file_out
 
     anon = Anonymizer(dicom_file_in, dicom_file_out,
-                      tags_config, forced_values,
-                      anonymous=anonymous,
-                      config_profile=profile_name,
-                      report_path=report_path)
-    anon.run_ano()
-    
+                      plan=plan,
+                      report_path=report_path,
+                      dataset=_get_dicom_dataset(classification, plan.anonymous),
+                      report=report,
+                      uid_cache=uid_cache)
+    if anon.run_ano():
+        return dicom_file_out
+
     # Check if output folder is empty
-    if is_folder_empty_of_files(Path(dicom_folder_out)):
+    if clean_empty_output and is_folder_empty_of_files(Path(dicom_folder_out)):
         shutil.rmtree(dicom_folder_out)
+    return None
 
 
 def anonymize(dicom_in, dicom_out,
@@ -139,7 +154,19 @@ def anonymize(dicom_in, dicom_out,
               anonymous=False,
               tempdir_prefix=None,
               error_no_dicom=True,
-              keep_capture=False):
+              keep_capture=False,
+              workers=1,
+              streaming=False,
+              report_formats=('csv',),
+              uid_cache=None,
+              plan=None,
+              manifest=None,
+              dedupe=None,
+              io_threads=0,
+              queue_depth=16,
+              compresslevel=None,
+              compress_threads=1,
+              use_mmap=None):
     """Configures the Anonymizer and runs it on DICOM files. It can configured using tags_to_keep
     or config_profile, and forced_values (ex: {(0x0010, 0x0010) : 'XXXX')})
 
@@ -149,6 +176,8 @@ def anonymize(dicom_in, dicom_out,
         Path of DICOM to deidentify. Can be archive, folder or file.
     dicom_out : str
         Path where to save deidentified DICOM. Can be archive or folder.
+        Deidentified files are added to an archive as they are produced,
+        without being written on disk before.
     tags_to_keep : list, optional
     tags_to_delete : list, optional
     forced_values : dict, optional
@@ -157,6 +186,56 @@ def anonymize(dicom_in, dicom_out,
     tempdir_prefix : str, optional
     error_no_dicom : bool
     keep_capture : bool
+    workers : int, optional
+        Number of processes used to deidentify the files of a folder.
+        Files are processed sequentially by default.
+    streaming : bool, optional
+        If dicom_in and dicom_out are archives, deidentify the files of dicom_in
+        in memory and write them directly in dicom_out, without extracting
+        dicom_in on disk. Files are processed sequentially: dedupe, workers
+        and io_threads cannot be used.
+    report_formats : tuple of str, optional
+        Formats of the deidentification report of removed files: 'csv',
+        'jsonl' and/or 'parquet' (needs pyarrow).
+    uid_cache : uids.UIDCache, optional
+        Cache of the UIDs generated for the files of dicom_in, giving its hits
+        and misses once done. A new cache is used by default.
+    plan : plan.AnonymizationPlan, optional
+        Resolved configuration, used instead of tags_to_keep, tags_to_delete,
+        forced_values, config_profile and anonymous.
+    manifest : str, optional
+        Path of the manifest of the files of a dicom_in folder or archive (see
+        manifest.Manifest). Files deidentified by a previous call with the same
+        manifest and settings are skipped if they have not changed, and the
+        output is kept if an error occurs, so that the deidentification can be
+        resumed. dicom_out has to be a folder.
+    dedupe : tuple of str, optional
+        Keys identifying duplicate files of a dicom_in folder or archive:
+        'content' (files with the same content) and/or 'instance' (DICOM files
+        with the same SOPInstanceUID). Each unique file is deidentified once,
+        the output of its duplicates is hard-linked (or copied) to its output,
+        and duplicates are listed in the deidentification report.
+    io_threads : int, optional
+        If not 0, the files of a dicom_in folder or archive are read and
+        written by io_threads threads each, while they are deidentified in
+        memory, so that input/output latency (on network file systems for
+        instance) and processing overlap. Cannot be used with workers.
+    queue_depth : int, optional
+        Maximum number of files read and not deidentified yet, and of
+        deidentified files not written yet, when io_threads is used.
+    compresslevel : int, optional
+        Compression level of a dicom_out archive, from 0 (no compression)
+        to 9. The default level of the archive format is used by default.
+        Files already compressed (DICOM files with a compressed transfer
+        syntax, JPEG and PNG images) are stored without compression in ZIP
+        archives.
+    compress_threads : int, optional
+        Number of threads compressing a gzip or bzip2 dicom_out archive.
+    use_mmap : bool, optional
+        Read the input files through memory maps (see dicom.MappedFile), in
+        worker processes too. Defaults to the DEIDENTIFICATION_MMAP environment
+        variable. It has no effect when the files are read in memory: archive
+        outputs, streaming and io_threads.
     """
     if not os.path.exists(dicom_in):
         raise DeidentificationError('The DICOM input does not exists.')
@@ -164,13 +243,44 @@ def anonymize(dicom_in, dicom_out,
         raise DeidentificationError('The DICOM input file type is not handled by this tool.')
     if not os.path.isfile(dicom_in) and os.path.isfile(dicom_out):
         raise DeidentificationError('The DICOM out could not be a file if DICOM in is not a file.')
-
-    _ = _load_config(config_profile, tags_to_keep,
-                     tags_to_delete, anonymous)
+    if workers < 1:
+        raise DeidentificationError('The number of workers must be at least 1.')
+    if io_threads < 0 or queue_depth < 1:
+        raise DeidentificationError('io_threads must be positive and queue_depth at least 1.')
+    if io_threads and workers > 1:
+        raise DeidentificationError('io_threads and workers cannot be used together.')
+    if compresslevel is not None and not 0 <= compresslevel <= 9:
+        raise DeidentificationError('The compression level must be between 0 and 9.')
+    if compress_threads < 1:
+        raise DeidentificationError('The number of compression threads must be at least 1.')
+    unknown_dedupe_keys = set(dedupe or ()) - set(DEDUPE_KEYS)
+    if unknown_dedupe_keys:
+        raise DeidentificationError(f'Unknown dedupe keys: {", ".join(sorted(unknown_dedupe_keys))}.')
+
+    if plan is None:
+        plan = AnonymizationPlan(tags_to_keep, tags_to_delete, forced_values,
+                                 config_profile, anonymous)
+    if uid_cache is None:
+        uid_cache = UIDCache()
 
     # Handle archives
     is_dicom_in_archive = is_archive_file(dicom_in)
     is_dicom_out_archive = is_archive_ext(dicom_out)
+    if manifest is not None and is_dicom_out_archive:
+        raise DeidentificationError('A manifest can only be used with a folder output.')
+    if streaming and is_dicom_in_archive and is_dicom_out_archive:
+        if dedupe or workers > 1 or io_threads:
+            raise DeidentificationError('dedupe, workers and io_threads cannot be used with streaming.')
+        _anonymize_archive_stream(dicom_in, os.path.abspath(dicom_out), plan,
+                                  tempdir_prefix=tempdir_prefix,
+                                  error_no_dicom=error_no_dicom,
+                                  keep_capture=keep_capture,
+                                  report_formats=report_formats,
+                                  uid_cache=uid_cache,
+                                  compresslevel=compresslevel,
+                                  compress_threads=compress_threads)
+        return
+
     if is_dicom_in_archive:
         wip_dicom_in = mkdtemp(prefix=tempdir_prefix)
         try:
@@ -180,63 +290,559 @@ def anonymize(dicom_in, dicom_out,
             raise DeidentificationError('Unpacking compressed file failed.')
     else:
         wip_dicom_in = os.path.abspath(dicom_in)
+    archive_output = None
     if is_dicom_out_archive:
+        # Deidentified files are added to the output archive as they are
+        # produced, the work folder only holds the report
         wip_dicom_out = mkdtemp(prefix=tempdir_prefix)
+        archive_output = _ArchiveOutput(ArchiveWriter(os.path.abspath(dicom_out), compresslevel, compress_threads),
+                                        wip_dicom_out)
     else:
         wip_dicom_out = os.path.abspath(dicom_out)
 
     # Deidentification report
-    deidentification_report = os.path.join(wip_dicom_out, 'deidentification_report.csv')
+    report = DeidentificationReport(os.path.join(wip_dicom_out, REPORT_FILENAME),
+                                    report_formats)
 
     capture_folder = None
     if keep_capture:
         capture_folder = os.path.join(wip_dicom_out, 'captures')
+    file_manifest = None
+    if manifest is not None:
+        file_manifest = Manifest(manifest, f'{plan.fingerprint}-capture={keep_capture}')
+    outputs = {} if dedupe else None
+    record_file = _file_recorder(file_manifest, wip_dicom_in, wip_dicom_out, outputs)
+
     # Launch deidentification
     try:
-        if os.path.isfile(wip_dicom_in):
+        if os.path.isfile(wip_dicom_in) and archive_output is not None:
+            _anonymize_file_to_archive(wip_dicom_in, wip_dicom_out, plan, archive_output,
+                                       capture_folder, report, uid_cache)
+        elif os.path.isfile(wip_dicom_in):
             anonymize_file(wip_dicom_in, wip_dicom_out,
-                           tags_to_keep, tags_to_delete,
-                           forced_values=forced_values,
-                           anonymous=anonymous,
-                           config_profile=config_profile,
-                           report_path=deidentification_report,
-                           capture_folder=capture_folder)
+                           capture_folder=capture_folder,
+                           report=report,
+                           uid_cache=uid_cache,
+                           plan=plan,
+                           use_mmap=use_mmap)
 
         elif os.path.isdir(wip_dicom_in):
-            for root, dirs, files in os.walk(wip_dicom_in):
-                folder_out = root.replace(wip_dicom_in, wip_dicom_out)
-                for name in files:
-                    current_file = os.path.join(root, name)
+            folder_files = _iter_folder_files(wip_dicom_in, wip_dicom_out)
+            if file_manifest is not None:
+                folder_files = _outdated_files(folder_files, file_manifest,
+                                               wip_dicom_in, wip_dicom_out)
+            duplicates = []
+            if dedupe:
+                folder_files, duplicates = _find_duplicates(folder_files, dedupe)
+                if archive_output is not None:
+                    archive_output.add_duplicates(duplicates, capture_folder)
+            if workers > 1:
+                _anonymize_files_parallel(folder_files, workers, plan, report, uid_cache,
+                                          error_no_dicom, capture_folder, record_file,
+                                          archive_output, use_mmap)
+                _remove_empty_folders(wip_dicom_out)
+            elif io_threads:
+                _anonymize_files_pipelined(folder_files, io_threads, queue_depth, plan, report,
+                                           uid_cache, error_no_dicom, capture_folder, record_file,
+                                           archive_output)
+            else:
+                for current_file, folder_out in folder_files:
                     try:
-                        anonymize_file(current_file, folder_out,
-                                       tags_to_keep, tags_to_delete,
-                                       forced_values=forced_values,
-                                       anonymous=anonymous,
-                                       config_profile=config_profile,
-                                       report_path=deidentification_report,
-                                       capture_folder=capture_folder)
+                        if archive_output is not None:
+                            file_out = _anonymize_file_to_archive(current_file, folder_out, plan,
+                                                                  archive_output, capture_folder,
+                                                                  report, uid_cache)
+                        else:
+                            file_out = anonymize_file(current_file, folder_out,
+                                                      capture_folder=capture_folder,
+                                                      report=report,
+                                                      uid_cache=uid_cache,
+                                                      plan=plan,
+                                                      use_mmap=use_mmap)
                     except AnonymizerError as e:
                         # Raise an error only if no DICOM file
                         if error_no_dicom:
-                            _clean_output(wip_dicom_out, is_dicom_out_archive)
                             raise e
+                        if record_file:
+                            record_file(current_file, None, FILE_FAILED)
+                    else:
+                        if record_file:
+                            record_file(current_file, file_out, FILE_DONE)
+            _link_duplicates(duplicates, outputs, capture_folder, report, record_file, archive_output)
+        report.close()
     except Exception as e:
-        _clean_output(wip_dicom_out, is_dicom_out_archive)
+        if file_manifest is None:
+            report.discard()
+            if archive_output is not None:
+                archive_output.discard()
+            _clean_output(wip_dicom_out, is_dicom_out_archive)
+        else:
+            # Deidentified files are kept to resume
+            report.close()
         raise e
     finally:
+        if file_manifest is not None:
+            file_manifest.close()
         if is_dicom_in_archive and os.path.exists(wip_dicom_in):
             shutil.rmtree(wip_dicom_in)
 
-    if is_dicom_out_archive:
+    if archive_output is not None:
         try:
-            pack(os.path.abspath(dicom_out),
-                 glob(os.path.join(wip_dicom_out, '*')))
+            for report_format in report.formats:
+                report_path = report.path(report_format)
+                if os.path.exists(report_path):
+                    with open(report_path, 'rb') as report_file:
+                        archive_output.add(report_path, report_file.read(), report_path)
+            archive_output.close()
         except Exception:
+            archive_output.discard()
             raise DeidentificationError('Compress deidentification results failed.')
         finally:
             shutil.rmtree(wip_dicom_out)
 
 
+def _anonymize_archive_stream(dicom_in, dicom_out, plan, tempdir_prefix=None,
+                              error_no_dicom=True, keep_capture=False, report_formats=('csv',),
+                              uid_cache=None, compresslevel=None, compress_threads=1):
+    """Deidentifies the files of the dicom_in archive in memory and writes
+    them in the dicom_out archive as they are processed.
+
+    Only the non-DICOM files are written in a temporary folder, to check if
+    they are spectroscopy data once all their neighbour files are known.
+    """
+    anonymous = plan.anonymous
+    wip_folder = mkdtemp(prefix=tempdir_prefix)
+    report = DeidentificationReport(os.path.join(wip_folder, REPORT_FILENAME), report_formats)
+    non_dicom_folder = os.path.join(wip_folder, 'non_dicom')
+    non_dicom_files = []
+    try:
+        with ArchiveWriter(dicom_out, compresslevel, compress_threads) as archive_writer:
+            for member_name, member_file, mtime in iter_archive_files(dicom_in):
+                data = member_file.read()
+                classification = classify_fileobj(io.BytesIO(data), member_name)
+                capture_name = os.path.join('captures', os.path.basename(member_name))
+
+                if keep_capture and classification.kind == FileClassification.IMAGE:
+                    archive_writer.add(capture_name, data, mtime)
+                    continue
+                if not classification.is_dicom:
+                    non_dicom_path = os.path.join(non_dicom_folder, member_name)
+                    os.makedirs(os.path.dirname(non_dicom_path), exist_ok=True)
+                    with open(non_dicom_path, 'wb') as non_dicom_file:
+                        non_dicom_file.write(data)
+                    non_dicom_files.append((member_name, non_dicom_path, mtime))
+                    continue
+
+                is_capture_kept = keep_capture and classification.kind == FileClassification.CAPTURE
+                dicom_out_buffer = io.BytesIO()
+                try:
+                    anon = Anonymizer(member_name, dicom_out_buffer,
+                                      plan=plan,
+                                      keep_capture=is_capture_kept,
+                                      dataset=_get_dicom_dataset(classification, anonymous),
+                                      report=report,
+                                      uid_cache=uid_cache)
+                    if anon.run_ano():
+                        archive_writer.add(capture_name if is_capture_kept else member_name,
+                                           dicom_out_buffer.getvalue(), mtime)
+                except AnonymizerError as e:
+                    # Raise an error only if no DICOM file
+                    if error_no_dicom:
+                        raise e
+
+            # Keep spectro non DICOM data
+            for member_name, non_dicom_path, mtime in non_dicom_files:
+                if is_spectro(non_dicom_path):
+                    with open(non_dicom_path, 'rb') as non_dicom_file:
+                        archive_writer.add(member_name, non_dicom_file.read(), mtime)
+                elif error_no_dicom:
+                    raise AnonymizerError('The file is not a DICOM file. {}', member_name, anonymous)
+
+            report.close()
+            for report_format in report.formats:
+                report_path = report.path(report_format)
+                if os.path.exists(report_path):
+                    with open(report_path, 'rb') as report_file:
+                        archive_writer.add(os.path.basename(report_path), report_file.read())
+    except Exception as e:
+        if os.path.exists(dicom_out):
+            os.remove(dicom_out)
+        raise e
+    finally:
+        shutil.rmtree(wip_folder, ignore_errors=True)
+
+
+def _iter_folder_files(wip_dicom_in, wip_dicom_out):
+    """Yields (input file, output folder) for each file of the wip_dicom_in tree,
+    in the order of their paths."""
+    for root, dirs, files in os.walk(wip_dicom_in):
+        dirs.sort()
+        folder_out = root.replace(wip_dicom_in, wip_dicom_out)
+        for name in sorted(files):
+            yield os.path.join(root, name), folder_out
+
+
+def _outdated_files(folder_files, manifest, wip_dicom_in, wip_dicom_out):
+    """Filters (input file, output folder) couples of the files which are not
+    up to date in manifest, removing their previous output."""
+    for file_in, folder_out in folder_files:
+        name = os.path.relpath(file_in, wip_dicom_in)
+        if manifest.is_up_to_date(name, file_in):
+            continue
+        record = manifest.get(name)
+        if record is not None and record['output']:
+            previous_output = os.path.join(wip_dicom_out, record['output'])
+            if os.path.isfile(previous_output):
+                os.remove(previous_output)
+        yield file_in, folder_out
+
+
+def _file_recorder(manifest, wip_dicom_in, wip_dicom_out, outputs=None):
+    """Returns a function recording a processed file and its output in manifest
+    and in the outputs dict, None if there is nothing to record."""
+    if manifest is None and outputs is None:
+        return None
+
+    def record_file(file_in, file_out, status, digest=None):
+        if outputs is not None:
+            outputs[file_in] = file_out
+        if manifest is not None:
+            manifest.record(os.path.relpath(file_in, wip_dicom_in), file_in,
+                            file_out and os.path.relpath(file_out, wip_dicom_out),
+                            status, digest)
+    return record_file
+
+
+def _find_duplicates(folder_files, dedupe):
+    """Splits (input file, output folder) couples in unique files and duplicates.
+
+    Returns the list of the couples of unique files, and the list of
+    (duplicate file, output folder, original file) of the others.
+    """
+    unique_files = []
+    duplicates = []
+    originals = {}
+    for file_in, folder_out in folder_files:
+        keys = []
+        if 'content' in dedupe:
+            keys.append(('content', file_digest(file_in)))
+        if 'instance' in dedupe:
+            sop_instance_uid = read_sop_instance_uid(file_in)
+            if sop_instance_uid:
+                keys.append(('instance', sop_instance_uid))
+        original = next((originals[key] for key in keys if key in originals), None)
+        if original is None:
+            unique_files.append((file_in, folder_out))
+            original = file_in
+        else:
+            duplicates.append((file_in, folder_out, original))
+        for key in keys:
+            originals.setdefault(key, original)
+    return unique_files, duplicates
+
+
+def _duplicate_output(file_in, folder_out, original_out, capture_folder):
+    """Returns the output path of the duplicate file_in of the file written in original_out."""
+    if capture_folder and os.path.dirname(original_out) == capture_folder:
+        folder_out = capture_folder
+    return os.path.join(folder_out, os.path.basename(file_in))
+
+
+def _link_duplicates(duplicates, outputs, capture_folder, report, record_file=None,
+                     archive_output=None):
+    """Creates the output of duplicate files (see _find_duplicates) from the
+    outputs of their original file, and adds them to the report.
+    Duplicates are already written in archive_output if set."""
+    for file_in, folder_out, original in duplicates:
+        original_out = outputs.get(original)
+        file_out = None
+        if original_out is not None:
+            file_out = _duplicate_output(file_in, folder_out, original_out, capture_folder)
+            if file_out != original_out and archive_output is None:
+                os.makedirs(folder_out, exist_ok=True)
+                if os.path.exists(file_out):
+                    os.remove(file_out)
+                try:
+                    os.link(original_out, file_out)
+                except OSError:
+                    shutil.copy2(original_out, file_out)
+        report.add([report_filename(file_in), f'duplicate of {report_filename(original)}',
+                    None, None, None, None])
+        if record_file:
+            record_file(file_in, file_out, FILE_DONE)
+
+
+# Plan, UID cache and memory-mapped reads setting of a worker process
+# (see _anonymize_files_parallel)
+_worker_plan = None
+_worker_uid_cache = None
+_worker_use_mmap = None
+
+
+def _init_worker(plan, uid_cache_maxsize, uids, use_mmap=None):
+    global _worker_plan, _worker_uid_cache, _worker_use_mmap
+    _worker_plan = plan
+    _worker_uid_cache = UIDCache(uid_cache_maxsize, track_updates=True)
+    _worker_uid_cache.update(uids)
+    _worker_use_mmap = use_mmap
+
+
+def _anonymize_file_task(dicom_file_in, dicom_folder_out, capture_folder, with_digest=False,
+                         in_memory=False):
+    """Runs anonymize_file in a worker process and returns its report rows
+    and UID cache updates, to be merged by the parent process, with the output
+    path and, if with_digest, the digest of dicom_file_in.
+
+    With in_memory, the output is not written but returned as (data, is_copy)
+    (see _anonymize_data), None otherwise.
+    """
+    report_rows = ReportRows()
+    output = None
+    # Output folders are shared between processes: empty ones are removed
+    # once all the files are processed.
+    try:
+        if in_memory:
+            with open(dicom_file_in, 'rb') as f:
+                data = f.read()
+            file_out, data, is_copy = _anonymize_data(dicom_file_in, data, dicom_folder_out, _worker_plan,
+                                                      capture_folder, report_rows, _worker_uid_cache)
+            output = data, is_copy
+        else:
+            file_out = anonymize_file(dicom_file_in, dicom_folder_out,
+                                      capture_folder=capture_folder,
+                                      report=report_rows, clean_empty_output=False,
+                                      uid_cache=_worker_uid_cache,
+                                      plan=_worker_plan,
+                                      use_mmap=_worker_use_mmap)
+    finally:
+        uid_updates = _worker_uid_cache.take_updates()
+    digest = file_digest(dicom_file_in) if with_digest else None
+    return report_rows.rows, uid_updates, file_out, digest, output
+
+
+def _anonymize_files_parallel(folder_files, workers, plan, report, uid_cache,
+                              error_no_dicom, capture_folder=None, record_file=None,
+                              archive_output=None, use_mmap=None):
+    """Deidentifies (input file, output folder) couples with a pool of processes.
+
+    The plan is sent once to each process. Each process has its own UID cache,
+    initialized with uid_cache items. The UIDs they generate and their hits
+    and misses are merged in uid_cache. Processed files are given to
+    record_file (see _file_recorder) if set. With archive_output, outputs
+    are sent back by the processes and added to the archive. use_mmap is
+    sent to the processes with the plan (see anonymize_file).
+
+    As in sequential mode, an AnonymizerError is raised only if error_no_dicom
+    is set. Pending files are then cancelled and running ones are awaited so
+    that the output can be cleaned safely by the caller.
+    """
+    folder_files = iter(folder_files)
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(plan, uid_cache.maxsize, uid_cache.items(),
+                                       use_mmap)) as executor:
+        # At most two files per process are in flight, so that their outputs
+        # are handled (and released) as soon as they are done
+        futures = {}
+
+        def handle(future):
+            """Handles a done future and returns its error to raise, if any."""
+            # Results are released once handled
+            file_in = futures.pop(future)
+            error = future.exception()
+            if error is None:
+                report_rows, uid_updates, file_out, digest, output = future.result()
+                report.add_rows(report_rows)
+                uid_cache.merge_updates(*uid_updates)
+                if archive_output is not None and file_out is not None:
+                    data, is_copy = output
+                    archive_output.add(file_out, data, file_in, is_copy)
+                if record_file:
+                    record_file(file_in, file_out, FILE_DONE, digest)
+                return None
+            if isinstance(error, AnonymizerError) and not error_no_dicom:
+                if record_file:
+                    record_file(file_in, None, FILE_FAILED)
+                return None
+            return error
+
+        while True:
+            while len(futures) < 2 * workers:
+                file_folder = next(folder_files, None)
+                if file_folder is None:
+                    break
+                file_in, folder_out = file_folder
+                future = executor.submit(_anonymize_file_task, file_in, folder_out,
+                                         capture_folder, record_file is not None,
+                                         archive_output is not None)
+                futures[future] = file_in
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            # Each file is recorded as soon as it is done, so that an interrupted
+            # deidentification can be resumed from the manifest
+            errors = [error for error in map(handle, done) if error is not None]
+            if errors:
+                executor.shutdown(wait=True, cancel_futures=True)
+                # Files which were running are recorded before the error is raised
+                for future in [future for future in futures if not future.cancelled()]:
+                    handle(future)
+                raise errors[0]
+
+
+def _anonymize_data(dicom_file_in, data, dicom_folder_out, plan,
+                    capture_folder=None, report=None, uid_cache=None):
+    """Deidentifies the data of dicom_file_in in memory, as anonymize_file.
+
+    Returns the path of the output file and its data, or (None, None) if the
+    file is removed, and if the output is a copy of dicom_file_in.
+    """
+    classification = classify_fileobj(io.BytesIO(data), dicom_file_in)
+    file_out = os.path.join(dicom_folder_out, os.path.basename(dicom_file_in))
+
+    # Check for screen capture files
+    is_capture_kept = False
+    if capture_folder:
+        capture_out = os.path.join(capture_folder, os.path.basename(dicom_file_in))
+        if classification.kind == FileClassification.IMAGE:
+            return capture_out, data, True
+        elif classification.kind == FileClassification.CAPTURE:
+            file_out = capture_out
+            is_capture_kept = True
+
+    # Keep spectro non DICOM data
+    if not classification.is_dicom and is_spectro(dicom_file_in):
+        return file_out, data, True
+
+    output = io.BytesIO()
+    anon = Anonymizer(dicom_file_in, output,
+                      plan=plan,
+                      keep_capture=is_capture_kept,
+                      dataset=_get_dicom_dataset(classification, plan.anonymous),
+                      report=report,
+                      uid_cache=uid_cache)
+    if anon.run_ano():
+        return file_out, output.getvalue(), False
+    return None, None, False
+
+
+def _anonymize_file_to_archive(dicom_file_in, dicom_folder_out, plan, archive_output,
+                               capture_folder=None, report=None, uid_cache=None):
+    """Deidentifies dicom_file_in in memory, as anonymize_file, and adds its
+    output to archive_output. Returns the output path, None if the file is removed."""
+    with open(dicom_file_in, 'rb') as f:
+        data = f.read()
+    file_out, data, is_copy = _anonymize_data(dicom_file_in, data, dicom_folder_out, plan,
+                                              capture_folder, report, uid_cache)
+    if file_out is not None:
+        archive_output.add(file_out, data, dicom_file_in, is_copy)
+    return file_out
+
+
+class _ArchiveOutput():
+
+    """
+    Deidentified files written in an archive instead of the wip_dicom_out
+    folder, named in the archive by their path relative to this folder.
+
+    The output of duplicate files (see add_duplicates) is written with the
+    output of their original file, whose data is not kept afterwards.
+    """
+
+    def __init__(self, archive_writer, wip_dicom_out):
+        self.archive_writer = archive_writer
+        self.wip_dicom_out = wip_dicom_out
+        self.capture_folder = None
+        self._duplicates = {}
+
+    def add_duplicates(self, duplicates, capture_folder=None):
+        """Registers (duplicate file, output folder, original file) duplicates
+        (see _find_duplicates)."""
+        self.capture_folder = capture_folder
+        for file_in, folder_out, original in duplicates:
+            self._duplicates.setdefault(original, []).append((file_in, folder_out))
+
+    def add(self, file_out, data, file_in, is_copy=False):
+        """Adds the file_out output of file_in, with the modification time of
+        file_in if it is a copy, and the output of its duplicates."""
+        mtime = os.stat(file_in).st_mtime if is_copy else time.time()
+        self.archive_writer.add(self._arcname(file_out), data, mtime)
+        for duplicate_in, folder_out in self._duplicates.get(file_in, ()):
+            duplicate_out = _duplicate_output(duplicate_in, folder_out, file_out, self.capture_folder)
+            if duplicate_out != file_out:
+                self.archive_writer.add(self._arcname(duplicate_out), data, mtime)
+
+    def close(self):
+        self.archive_writer.close()
+
+    def discard(self):
+        """Closes and removes the archive."""
+        try:
+            self.archive_writer.close()
+        finally:
+            if os.path.exists(self.archive_writer.output_filename):
+                os.remove(self.archive_writer.output_filename)
+
+    def _arcname(self, file_out):
+        return os.path.relpath(file_out, self.wip_dicom_out)
+
+
+def _anonymize_files_pipelined(folder_files, io_threads, queue_depth, plan, report, uid_cache,
+                               error_no_dicom, capture_folder=None, record_file=None,
+                               archive_output=None):
+    """Deidentifies (input file, output folder) couples in a pipeline (see
+    pipeline.run_pipeline): files are read by io_threads threads, deidentified
+    in memory by one thread and written by io_threads threads, or added to
+    archive_output if set.
+
+    Errors are handled as in sequential mode. Files are recorded by
+    record_file (see _file_recorder) in the calling thread.
+    """
+    def read(item, _):
+        with open(item[0], 'rb') as f:
+            return f.read()
+
+    def deidentify(item, data):
+        file_in, folder_out = item
+        return _anonymize_data(file_in, data, folder_out, plan,
+                               capture_folder, report, uid_cache)
+
+    def write(item, result):
+        file_out, data, is_copy = result
+        if file_out is not None and archive_output is not None:
+            archive_output.add(file_out, data, item[0], is_copy)
+        elif file_out is not None:
+            os.makedirs(os.path.dirname(file_out), exist_ok=True)
+            with open(file_out, 'wb') as f:
+                f.write(data)
+            if is_copy:
+                shutil.copystat(item[0], file_out)
+        return file_out
+
+    # Files are listed before, as the manifest can only be used by this thread
+    results = run_pipeline(list(folder_files),
+                           [(read, io_threads), (deidentify, 1), (write, io_threads)],
+                           queue_depth)
+    try:
+        for (file_in, folder_out), file_out, error in results:
+            if error is not None:
+                if not isinstance(error, AnonymizerError) or error_no_dicom:
+                    raise error
+                if record_file:
+                    record_file(file_in, None, FILE_FAILED)
+            elif record_file:
+                record_file(file_in, file_out, FILE_DONE)
+    finally:
+        results.close()
+
+
+def _remove_empty_folders(folder):
+    """Removes the sub-folders of folder which do not contain any file."""
+    for root, dirs, files in os.walk(folder, topdown=False):
+        if root != folder and os.path.isdir(root) and is_folder_empty_of_files(Path(root)):
+            shutil.rmtree(root)
+
+
 def _clean_output(wip_dicom_out, is_dicom_out_archive):
     if os.path.exists(wip_dicom_out):
         if is_dicom_out_archive:
@@ -255,43 +861,54 @@ def check_anonymize_fast(dicom_in,
                          forced_values=None,
                          config_profile=None,
                          anonymous=False,
-                         tempdir_prefix=None):
+                         tempdir_prefix=None,
+                         plan=None,
+                         use_mmap=None):
     """
     Configures the Anonymizer and runs it on one DICOM file to check if anonymization already done.
+    use_mmap: read the file through a memory map, as in check_anonymize.
     """
 
     if not os.path.exists(dicom_in):
         raise DeidentificationError('The DICOM input does not exists.')
 
-    tags_config = _load_config(config_profile, tags_to_keep,
-                               tags_to_delete, anonymous)
+    if plan is None:
+        plan = AnonymizationPlan(tags_to_keep, tags_to_delete, forced_values,
+                                 config_profile, anonymous)
 
-    dicom_tmp = ''
     if is_archive_file(dicom_in):
-        dicom_tmp = mkdtemp(prefix=tempdir_prefix)
+        # The first member is read in memory, the archive is not extracted
+        members = iter_archive_files(dicom_in)
         try:
-            wip_dicom_in = unpack_first(dicom_in, dicom_tmp)
+            first_member = next(((name, member_file.read()) for name, member_file, _ in members), None)
         except Exception:
-            shutil.rmtree(dicom_tmp)
             raise DeidentificationError('Unpacking compressed file failed.')
+        finally:
+            members.close()
+        if first_member is None:
+            raise DeidentificationError('File input type is not handled by this tool.')
+        name, data = first_member
+        anon = Anonymizer(name, '',
+                          plan=plan,
+                          dataset=_read_header_dataset(name, data, plan.anonymous),
+                          header_only=True)
+        anon.runCheck()
+        return anon.result
     elif os.path.isfile(dicom_in):
         wip_dicom_in = dicom_in
     elif os.path.isdir(dicom_in):
-        items_in_folder = glob.glob(os.path.join(dicom_in, '*'))
+        items_in_folder = glob(os.path.join(dicom_in, '*'))
         wip_dicom_in = next(filter(os.path.isfile, items_in_folder), '')
     else:
         raise DeidentificationError('File input type is not handled by this tool.')
 
     if os.path.isfile(wip_dicom_in):
-        try:
-            anon = Anonymizer(wip_dicom_in, '',
-                              tags_config, forced_values,
-                              anonymous=anonymous)
-            anon.runCheck()
-            return anon.result
-        finally:
-            if dicom_tmp and os.path.exists(dicom_tmp):
-                shutil.rmtree(dicom_tmp)
+        anon = Anonymizer(wip_dicom_in, '',
+                          plan=plan,
+                          header_only=True,
+                          use_mmap=use_mmap)
+        anon.runCheck()
+        return anon.result
     else:
         raise DeidentificationError('File input type is not handled by this tool.')
 
@@ -302,54 +919,71 @@ def check_anonymize(dicom_in,
                     forced_values=None,
                     config_profile=None,
                     anonymous=False,
-                    tempdir_prefix=None):
+                    tempdir_prefix=None,
+                    plan=None,
+                    use_mmap=None):
     """
     Check if dicom_in is an anonymized DICOM.
     Input can be DICOM file/folder or archive of DICOM files/folder
+    use_mmap: read the DICOM files through memory maps (see dicom.MappedFile),
+    defaults to the DEIDENTIFICATION_MMAP environment variable. It has no
+    effect on the members of an archive, which are read in memory.
     """
     if not os.path.exists(dicom_in):
         raise DeidentificationError('The DICOM input does not exists.')
 
-    tags_config = _load_config(config_profile, tags_to_keep,
-                               tags_to_delete, anonymous)
+    if plan is None:
+        plan = AnonymizationPlan(tags_to_keep, tags_to_delete, forced_values,
+                                 config_profile, anonymous)
 
-    is_archive_in = is_archive_file(dicom_in)
-    if is_archive_in:
-        wip_dicom_in = mkdtemp(prefix=tempdir_prefix)
-        try:
-            unpack(dicom_in, wip_dicom_in)
-        except Exception:
-            shutil.rmtree(wip_dicom_in)
-            raise DeidentificationError('Unpacking compressed file failed.')
-    else:
-        wip_dicom_in = dicom_in
+    if is_archive_file(dicom_in):
+        return _check_archive_anonymize(dicom_in, plan)
 
-    if os.path.isfile(wip_dicom_in):
-        try:
-            anon = Anonymizer(wip_dicom_in, '',
-                              tags_config, forced_values,
-                              anonymous=anonymous)
-            anon.runCheck()
-            return anon.result
-        finally:
-            if is_archive_in and os.path.exists(wip_dicom_in):
-                shutil.rmtree(wip_dicom_in)
+    elif os.path.isfile(dicom_in):
+        anon = Anonymizer(dicom_in, '',
+                          plan=plan,
+                          header_only=True,
+                          use_mmap=use_mmap)
+        anon.runCheck()
+        return anon.result
 
-    elif os.path.isdir(wip_dicom_in):
-        return check_folder_anonymize(wip_dicom_in,
-                                      forced_values=forced_values,
-                                      config_profile=config_profile)
+    elif os.path.isdir(dicom_in):
+        return check_folder_anonymize(dicom_in, plan=plan, use_mmap=use_mmap)
 
     else:
         raise DeidentificationError('File input type is not handled by this tool.')
 
 
+def _check_archive_anonymize(dicom_archive, plan):
+    """Checks deidentification of all the files of an archive, read in memory
+    one by one, as check_folder_anonymize."""
+    report_names = _report_names()
+    try:
+        with ArchiveIndex(dicom_archive) as archive_index:
+            for name, member_file in archive_index.iter_members():
+                if name in report_names:
+                    continue
+                verdict = _check_file(name, plan, member_file.read())
+                if verdict.error is not None:
+                    raise verdict.error
+                if verdict.failures:
+                    return False
+    except DeidentificationError:
+        raise
+    except Exception:
+        raise DeidentificationError('Unpacking compressed file failed.')
+    return True
+
+
 def check_folder_anonymize(dicom_folder,
                            tags_to_keep=None,
                            tags_to_delete=None,
                            forced_values=None,
                            config_profile=None,
-                           anonymous=False):
+                           anonymous=False,
+                           plan=None,
+                           workers=1,
+                           use_mmap=None):
     """Check deidentification for all files in the input folder.
     All the files in the folder have to be DICOM files.
 
@@ -361,95 +995,329 @@ def check_folder_anonymize(dicom_folder,
     forced_values : dict, optional
     config_profile : str, optional
     anonymous : bool, optional
+    plan : plan.AnonymizationPlan, optional
+        Resolved configuration, used instead of tags_to_keep, tags_to_delete,
+        forced_values, config_profile and anonymous.
+    workers : int, optional
+        Number of processes checking the files (see audit_folder).
+    use_mmap : bool, optional
+        Read the files through memory maps (see audit_folder).
 
     Returns
     -------
     bool
     """
+    for verdict in audit_folder(dicom_folder, tags_to_keep, tags_to_delete, forced_values,
+                                config_profile, anonymous, plan=plan, workers=workers,
+                                stop_on_failure=True, use_mmap=use_mmap):
+        if verdict.error is not None:
+            raise verdict.error
+        if verdict.failures:
+            return False
+    return True
+
+
+def audit_folder(dicom_folder,
+                 tags_to_keep=None,
+                 tags_to_delete=None,
+                 forced_values=None,
+                 config_profile=None,
+                 anonymous=False,
+                 plan=None,
+                 workers=1,
+                 stop_on_failure=False,
+                 shard_size=CHECK_SHARD_SIZE,
+                 summary=None,
+                 use_mmap=None):
+    """Check deidentification of all files in the input folder, and yield
+    an audit.FileVerdict for each file as it is checked.
+
+    Parameters
+    ----------
+    dicom_folder : str
+        Deidentification reports at its root are not checked.
+    tags_to_keep : list, optional
+    tags_to_delete : list, optional
+    forced_values : dict, optional
+    config_profile : str, optional
+    anonymous : bool, optional
+    plan : plan.AnonymizationPlan, optional
+        Resolved configuration, used instead of tags_to_keep, tags_to_delete,
+        forced_values, config_profile and anonymous.
+    workers : int, optional
+        Number of processes checking the files. Files are split in shards of
+        shard_size files, and verdicts are yielded shard by shard, as they are
+        completed.
+    stop_on_failure : bool, optional
+        Stop after the first file which is not deidentified or cannot be checked,
+        instead of checking all the files.
+    shard_size : int, optional
+    summary : audit.AuditSummary, optional
+        Counters updated with the verdicts, giving the throughput of the audit.
+    use_mmap : bool, optional
+        Read the files through memory maps (see dicom.MappedFile), in worker
+        processes too. Defaults to the DEIDENTIFICATION_MMAP environment variable.
+
+    Yields
+    ------
+    audit.FileVerdict
+    """
     if not os.path.isdir(dicom_folder):
         raise DeidentificationError('DICOM folder input is not a folder path.')
+    if workers < 1:
+        raise DeidentificationError('The number of workers must be at least 1.')
+
+    if plan is None:
+        plan = AnonymizationPlan(tags_to_keep, tags_to_delete, forced_values,
+                                 config_profile, anonymous)
+    if summary is None:
+        summary = AuditSummary()
+
+    files = _iter_audited_files(dicom_folder)
+    if workers > 1:
+        verdicts = _check_files_parallel(files, workers, plan, stop_on_failure, shard_size, use_mmap)
+    else:
+        verdicts = (_check_file(file_in, plan, use_mmap=use_mmap) for file_in in files)
+    summary.start()
+    try:
+        for verdict in verdicts:
+            summary.add(verdict)
+            yield verdict
+            if stop_on_failure and not verdict.passed:
+                return
+        summary.complete = True
+    finally:
+        verdicts.close()
+        summary.stop()
 
-    tags_config = _load_config(config_profile, tags_to_keep,
-                               tags_to_delete, anonymous)
-
-    for root, dirs, files in os.walk(dicom_folder):
-        for filename in files:
-            anon = Anonymizer(os.path.join(root, filename), '',
-                              tags_config, forced_values,
-                              anonymous=anonymous)
-            anon.runCheck()
-            if not anon.result:
-                return False
-    return True
 
+def check_anonymize_sample(dicom_in,
+                           tags_to_keep=None,
+                           tags_to_delete=None,
+                           forced_values=None,
+                           config_profile=None,
+                           anonymous=False,
+                           files_per_series=SAMPLE_FILES_PER_SERIES,
+                           tolerance=SAMPLE_TOLERANCE,
+                           seed=None,
+                           plan=None,
+                           use_mmap=None):
+    """Check deidentification of a random sample of files of each series.
+
+    Files are grouped by SeriesInstanceUID, reading their header up to this
+    element only, and files_per_series files are checked in each series.
+    Sampled members of an archive input are read in memory, the archive is
+    not extracted (see archive.ArchiveIndex).
 
-class AnonymizerError(DeidentificationError):
-    def __init__(self, message='', complement='', anonymous=False):
-        self.message = message
-        self.complement = complement
-        self.anonymous = anonymous
+    Parameters
+    ----------
+    dicom_in : str
+        DICOM file or folder, or archive of DICOM files.
+    tags_to_keep : list, optional
+    tags_to_delete : list, optional
+    forced_values : dict, optional
+    config_profile : str, optional
+    anonymous : bool, optional
+    files_per_series : int, optional
+        Number of files checked in each series, all the files of smaller series
+        are checked.
+    tolerance : float, optional
+        Proportion of not deidentified files of a series that the sample has to
+        detect, used to compute the confidence of the check
+        (see audit.SampleAudit.confidence).
+    seed : int, optional
+        Seed of the random sampling, to check the same files again.
+    plan : plan.AnonymizationPlan, optional
+        Resolved configuration, used instead of tags_to_keep, tags_to_delete,
+        forced_values, config_profile and anonymous.
+    use_mmap : bool, optional
+        Read the files through memory maps (see dicom.MappedFile). Defaults to
+        the DEIDENTIFICATION_MMAP environment variable. It has no effect on the
+        members of an archive, which are read in memory.
 
-    def __str__(self):
-        if self.anonymous:
-            return self.message.format('')
-        return self.message.format(self.complement)
+    Returns
+    -------
+    audit.SampleAudit
+    """
+    if not os.path.exists(dicom_in):
+        raise DeidentificationError('The DICOM input does not exists.')
+    if files_per_series < 1:
+        raise DeidentificationError('The number of files per series must be at least 1.')
+    if not 0 < tolerance <= 1:
+        raise DeidentificationError('The tolerance must be in ]0, 1].')
 
+    if plan is None:
+        plan = AnonymizationPlan(tags_to_keep, tags_to_delete, forced_values,
+                                 config_profile, anonymous)
+    rng = random.Random(seed)
 
-def _generate_uuid(value):
-    """
-    Generate a (not) random UUID based on the SHA512 hash of the input value.
+    if is_archive_file(dicom_in):
+        report_names = _report_names()
+        with ArchiveIndex(dicom_in) as archive_index:
+            series = _group_series((name, member_file) for name, member_file in archive_index.iter_members()
+                                   if name not in report_names)
+            sample = _sample_series(series, files_per_series, rng)
+            sampled_series = {name: series_instance_uid
+                              for series_instance_uid, names in sample.items() for name in names}
+            verdicts = {series_instance_uid: [] for series_instance_uid in sample}
+            for name, data in archive_index.read_members(sampled_series):
+                verdicts[sampled_series[name]].append(_check_file(name, plan, data))
+    elif os.path.isfile(dicom_in) or os.path.isdir(dicom_in):
+        files = [dicom_in] if os.path.isfile(dicom_in) else _iter_audited_files(dicom_in)
+        series = _group_series(_open_files(files))
+        sample = _sample_series(series, files_per_series, rng)
+        verdicts = {series_instance_uid: [_check_file(file_in, plan, use_mmap=use_mmap)
+                                          for file_in in files_in]
+                    for series_instance_uid, files_in in sample.items()}
+    else:
+        raise DeidentificationError('File input type is not handled by this tool.')
 
-    We need reproducible UUIDs, not random UUIDs, yet the best course of
-    action is probably to apply Section 4.4 of `RFC 4122`_ which specifies
-    random UUIDs:
-    * The two most significant bits (bits 6 and 7) of the
-      clock_seq_hi_and_reserved must be set to zero and one, respectively.
-    * The four most significant bits (bits 12 through 15) of the
-      time_hi_and_version field must be set to 0, 0, 1, 0.
+    return SampleAudit({series_instance_uid: len(names) for series_instance_uid, names in series.items()},
+                       verdicts, tolerance)
 
-    See also ISO/IEC 9834-8 / `ITU-T X.667``_.
 
-    .. _RFC 4122: https://www.rfc-editor.org/info/rfc4122
-    .. _ITU-T X.667: https://www.itu.int/rec/T-REC-X.667
+def _report_names(dicom_folder=''):
+    """Returns the paths of the deidentification reports written by anonymize in dicom_folder."""
+    return {os.path.join(dicom_folder, os.path.splitext(REPORT_FILENAME)[0] + '.' + report_format)
+            for report_format in REPORT_FORMATS}
+
+
+def _iter_audited_files(dicom_folder):
+    """Yields the files of dicom_folder to check, except deidentification reports."""
+    report_names = _report_names(dicom_folder)
+    for file_in, _ in _iter_folder_files(dicom_folder, dicom_folder):
+        if file_in not in report_names:
+            yield file_in
+
+
+def _open_files(files):
+    """Yields (filepath, file object) for files, each file being closed once the next one is read."""
+    for filepath in files:
+        with open(filepath, 'rb') as fp:
+            yield filepath, fp
 
-    """
-    u = hashlib.sha512(str(value).encode('utf-8')).digest()  # 64 bytes (512 bits) of SHA-512 hash
 
-    u = bytearray(u[:16])  # keep first 16 bytes (128 bits) for UUID
+def _group_series(files):
+    """Groups (name, file object) files by SeriesInstanceUID, as {SeriesInstanceUID: [name, ...]}."""
+    series = {}
+    for name, fp in files:
+        series.setdefault(read_series_instance_uid(fp), []).append(name)
+    return series
 
-    # comply with section 4.4 of RFC 4122, although the UUID is not random
-    u[6] &= 0b01001111  # set bits 12, 13, 15 of time_hi_and_version to 0
-    u[6] |= 0b01000000  # set bits 14 of time_hi_and_version to 1
-    u[8] &= 0b10111111  # set bit 6 of clock_seq_hi_and_reserved to 0
-    u[8] |= 0b10000000  # set bit 7 of clock_seq_hi_and_reserved to 1
 
-    return UUID(bytes=bytes(u))
+def _sample_series(series, files_per_series, rng):
+    """Returns files_per_series random files of each series, sorted by name
+    so that a seed gives the same sample of a folder and of its archive."""
+    sample = {}
+    for series_instance_uid, names in series.items():
+        names = sorted(names)
+        if len(names) > files_per_series:
+            names = sorted(rng.sample(names, files_per_series))
+        sample[series_instance_uid] = names
+    return sample
 
 
-def _generate_dicom_uid(value):
+def _check_file(dicom_file, plan, data=None, use_mmap=None):
+    """Checks the deidentification of dicom_file, or of its data bytes if given,
+    and returns its audit.FileVerdict. dicom_file is read through a memory map
+    with use_mmap."""
+    try:
+        dataset = None
+        if data is not None:
+            dataset = _read_header_dataset(dicom_file, data, plan.anonymous)
+        anon = Anonymizer(dicom_file, '',
+                          plan=plan,
+                          dataset=dataset,
+                          header_only=True,
+                          use_mmap=use_mmap)
+        anon.runCheck()
+    except DeidentificationError as e:
+        return FileVerdict(dicom_file, error=e)
+    return FileVerdict(dicom_file, anon.check_failures())
+
+
+def _read_header_dataset(dicom_file, data, anonymous=False):
+    """Returns the dataset of the DICOM file dicom_file read from its data bytes, without pixel data."""
+    classification = classify_fileobj(io.BytesIO(data), dicom_file, header_only=True)
+    return _get_dicom_dataset(classification, anonymous)
+
+
+def _init_check_worker(plan, use_mmap=None):
+    global _worker_plan, _worker_use_mmap
+    _worker_plan = plan
+    _worker_use_mmap = use_mmap
+
+
+def _check_files_task(dicom_files, stop_on_failure):
+    """Checks a shard of files in a worker process (see _check_files_parallel)."""
+    verdicts = []
+    for dicom_file in dicom_files:
+        verdict = _check_file(dicom_file, _worker_plan, use_mmap=_worker_use_mmap)
+        verdicts.append(verdict)
+        if stop_on_failure and not verdict.passed:
+            break
+    return verdicts
+
+
+def _check_files_parallel(files, workers, plan, stop_on_failure, shard_size, use_mmap=None):
+    """Yields the audit.FileVerdict of files checked by a pool of processes.
+
+    Files are sent to processes by shards of shard_size files, with at most
+    two shards per process at a time. Pending shards are cancelled when the
+    generator is closed.
     """
-    Generate a DICOM UID based on a reproducible UUID hashed from the input value.
+    files = iter(files)
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=_init_check_worker,
+                                   initargs=(plan, use_mmap))
+    pending = set()
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                shard = list(islice(files, shard_size))
+                if not shard:
+                    break
+                pending.add(executor.submit(_check_files_task, shard, stop_on_failure))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
 
-    See `PS 3.5 Sect B2`_:
 
-        [ISO/IEC 9834-8] / [ITU-T X.667] defines a method by which a UID
-        may be constructed from the root "2.25." followed by a decimal
-        representation of a Universally Unique Identifier (UUID). That
-        decimal representation treats the 128 bit UUID as an integer, and
-        may thus be up to 39 digits long (leading zeros must be suppressed).
+class AnonymizerError(DeidentificationError):
+    def __init__(self, message='', complement='', anonymous=False):
+        self.message = message
+        self.complement = complement
+        self.anonymous = anonymous
+
+    def __str__(self):
+        if self.anonymous:
+            return self.message.format('')
+        return self.message.format(self.complement)
 
-    .. _PS 3.5 Sect B2: https://dicom.nema.org/medical/dicom/current/output/chtml/part05/sect_B.2.html
 
+def _get_dicom_dataset(classification, anonymous=False):
+    """
+    Returns the dataset of a classified file.
+    Raise an AnonymizerError if the file is not a DICOM file to deidentify.
     """
-    return "2.25." + str(_generate_uuid(value).int)
+    if classification.kind == FileClassification.DICOMDIR:
+        raise AnonymizerError('The file is a DICOMDIR. {}', classification.filepath, anonymous)
+    if classification.dataset is None:
+        raise AnonymizerError('The file is not a DICOM file. {}', classification.filepath, anonymous)
+    return classification.dataset
 
 
-def _get_cleaned_value(data_element):
+def _get_cleaned_value(data_element, generate_uid=_generate_dicom_uid):
     """
     Gets a cleaned value of data_element value according to its representation.
+    UIDs are generated with generate_uid (see uids.UIDCache).
     """
     if data_element.VR == 'UI':
-        return _generate_dicom_uid(data_element.value)
+        return generate_uid(data_element.value)
     elif data_element.VR == 'DA':
         return "19700101"
     elif data_element.VR == 'TM':
@@ -464,22 +1332,29 @@ def _get_cleaned_value(data_element):
         return "NO VALUE"
 
 
-def _is_private_creator(group, element):
+def _get_private_creator_value(private_creator):
     """
-    Returns true if the (group, element) tag is a private creator and false otherwise.
+    Gets the value of a private creator data element, as a string to be looked up in rules.
     """
-    return group % 2 != 0 and 0x0000 < element < 0x00ff
+    value = private_creator.value
+    if not isinstance(value, str):
+        value = str(value)
+    return value
 
 
-def _get_private_creator_tag(data_element):
+def _removed_element_value(ds, tag, encoding):
     """
-    Gets the private creator tag of data_element.
+    Gets the value of a data element to be removed from ds, converted from its
+    raw value without being stored back in ds.
     """
-    if _is_private_creator(data_element.tag.group, data_element.tag.element):
-        return data_element.tag
-    group = data_element.tag.group
-    element = (data_element.tag.element & 0xff00) >> 8
-    return pydicom.tag.Tag(group, element)
+    raw = ds.get_item(tag)
+    if (isinstance(raw, pydicom.dataelem.RawDataElement) and raw.VR is not None
+            and raw.value is not None and tag != SPECIFIC_CHARACTER_SET_TAG):
+        return pydicom.dataelem.DataElement_from_raw(raw, encoding, ds).value
+    return ds[tag].value
+
+
+SPECIFIC_CHARACTER_SET_TAG = 0x00080005
 
 
 class Anonymizer():
@@ -491,14 +1366,37 @@ class Anonymizer():
     def __init__(self, dicom_filein, dicom_fileout,
                  tags_config=None,
                  forced_values=None, config_profile=None,
-                 anonymous=False, report_path=None, keep_capture=False):
+                 anonymous=False, report_path=None, keep_capture=False,
+                 dataset=None, header_only=False, report=None, uid_cache=None,
+                 plan=None, tracking=None, use_mmap=None):
         """
         dicom_filein: the DICOM file to anonymize
         dicom_fileout: the file to write the output of the anonymization
         tags_config: a dict with action to do on tags (keep ('K'), remove ('X'), ...)
         forced_values: a dictionary constructed as shown here: {(0x0010,0x0010): "My forced patient name"}
         When a tag is in forced_values, it will be kept whether or not in tags_to_keep.
+        dataset: the already parsed dataset of dicom_filein (see dicom.classify_file),
+        dicom_filein is read if not given.
+        header_only: read dicom_filein without its pixel data, to check its anonymization only.
+        report: a report sink (see report.DeidentificationReport) where rows are added,
+        rows are written directly in report_path if not given.
+        uid_cache: a uids.UIDCache of the generated UIDs, shared between anonymizers.
+        plan: a plan.AnonymizationPlan, used instead of tags_config, forced_values,
+        config_profile and anonymous.
+        tracking: how the original and output values of the deidentified data elements
+        are kept in originalDict and outputDict (see tracking.ValueTracker): 'none',
+        'digest' or 'full'. Defaults to 'digest' with header_only or without
+        dicom_fileout (to check the anonymization) and to 'none' otherwise. runCheck
+        switches to 'digest' if values are not tracked.
+        use_mmap: read dicom_filein through a memory map (see dicom.MappedFile), defaults
+        to the DEIDENTIFICATION_MMAP environment variable.
         """
+        if plan is not None:
+            tags_config, forced_values = plan.tags_config, plan.forced_values
+            config_profile, anonymous = plan.profile_name, plan.anonymous
+            self._rules = plan.rules
+        else:
+            self._rules = RuleTable(tags_config, forced_values)
         self._dicom_filein = dicom_filein
         self._dicom_fileout = dicom_fileout
         self._tags_config = tags_config
@@ -506,24 +1404,43 @@ class Anonymizer():
         self.anonymous = anonymous
         self.config_profile = config_profile
         self.report_path = report_path
+        self.report = report
         self.keep_capture = keep_capture
-
-        self.originalDict = {}
-        self.outputDict = {}
-        self._dataset = self._load_dataset() # TODO Handle PNG/JPEG if necessary
+        self.header_only = header_only
+        self.uid_cache = uid_cache
+        self.use_mmap = use_mmap
+        self._generate_uid = uid_cache if uid_cache is not None else _generate_dicom_uid
+
+        if tracking is None:
+            # Anonymizers without output are used to check the anonymization
+            tracking = TRACK_DIGEST if header_only or not dicom_fileout else TRACK_NONE
+        self._tracker = ValueTracker(tracking)
+        if dataset is None:
+            dataset = self._load_dataset()  # TODO Handle PNG/JPEG if necessary
+        self._dataset = dataset
         self.result = None
         self.ano_run = False
 
+    @property
+    def originalDict(self):
+        return self._tracker.original
+
+    @property
+    def outputDict(self):
+        return self._tracker.output
+
     def run_ano(self):
         """
         Reads the DICOM file, anonymizes it and write the result.
         """
+        if self.header_only:
+            raise DeidentificationError('Anonymization cannot be run on a DICOM header only.')
         if not is_imaging_modality(self._dataset):
             if not self.keep_capture or not is_capture_dicom(self._dataset):
                 self.fill_report('removed')
                 return 0
         if not self.ano_run:
-            self._dataset.walk(self._anonymize_check)
+            self._apply_rules(self._dataset)
 
         # Patient Identity Removed
         self._dataset.add_new((0x0012, 0x0062), 'CS', 'YES')
@@ -533,141 +1450,156 @@ class Anonymizer():
             method += f' - {self.config_profile}'
         self._dataset.add_new((0x0012, 0x0063), 'LO', method)
 
-        pydicom.dcmwrite(self._dicom_fileout, self._dataset)
+        # Large pixel data and bulk data, not read with the dataset and left
+        # untouched by the rules, are copied as is in the output
+        bulk_ranges = detach_bulk_elements(self._dataset)
+        if bulk_ranges:
+            dcmwrite_passthrough(self._dicom_fileout, self._dataset, bulk_ranges)
+        else:
+            pydicom.dcmwrite(self._dicom_fileout, self._dataset)
         return 1
 
     def runCheck(self):
         """
         Check anonymization.
         """
+        if not self._tracker.enabled:
+            # Values are tracked from now on to be compared
+            self._tracker = ValueTracker(TRACK_DIGEST)
         if not self.ano_run:
-            self._dataset.walk(self._anonymize_check)
+            self._apply_rules(self._dataset)
 
-        self.result = self.originalDict == self.outputDict
+        self.result = self._tracker.passed
         return self.result
 
-    def fill_report(self, state):
-        if self.report_path is not None:
-            write_header = not os.path.exists(self.report_path)
-            with open(self.report_path, 'a') as report_file:
-                csv_writer = csv.writer(report_file)
-                if write_header:
-                    csv_writer.writerow(['input DICOM filename', 'state', 'modality', 'SOP Class UID', 'Series Description', 'Image Type'])
-
-                image_type = self._dataset.get((0x8, 0x8), None)
-                if image_type is not None:
-                    image_type = image_type.value
-
-                sop_class_uid = self._dataset.get('SOPClassUID', None)
-                if not sop_class_uid:
-                    sop_class_uid_str = 'Tag not found'
-                elif sop_class_uid not in pydicom.uid.UID_dictionary:
-                    sop_class_uid_str = f"unknown uid: {sop_class_uid}"
-                else:
-                    sop_class_uid_str = pydicom.uid.UID_dictionary[sop_class_uid][0]
+    def check_failures(self):
+        """
+        Returns the data elements which are not deidentified, as {tag: reason},
+        once the anonymization has been checked (see runCheck). Reasons do not
+        contain the values of the file.
+        """
+        return self._tracker.failures()
+
+    def report_row(self, state):
+        """
+        Returns the deidentification report row of the DICOM file (see report.REPORT_HEADER).
+        """
+        image_type = self._dataset.get((0x8, 0x8), None)
+        if image_type is not None:
+            image_type = image_type.value
+            if isinstance(image_type, pydicom.multival.MultiValue):
+                image_type = [str(value) for value in image_type]
+
+        sop_class_uid = self._dataset.get('SOPClassUID', None)
+        if not sop_class_uid:
+            sop_class_uid_str = 'Tag not found'
+        elif sop_class_uid not in pydicom.uid.UID_dictionary:
+            sop_class_uid_str = f"unknown uid: {sop_class_uid}"
+        else:
+            sop_class_uid_str = pydicom.uid.UID_dictionary[sop_class_uid][0]
+
+        return [
+            report_filename(self._dicom_filein),
+            state,
+            str(self._dataset.get('Modality', 'Tag not found')),
+            sop_class_uid_str,
+            str(self._dataset.get('SeriesDescription', 'Tag not found')),
+            image_type
+        ]
 
-                csv_writer.writerow([
-                    os.path.join(Path(self._dicom_filein).parent.name, Path(self._dicom_filein).name),
-                    state,
-                    self._dataset.get('Modality', 'Tag not found'),
-                    sop_class_uid_str,
-                    self._dataset.get('SeriesDescription', 'Tag not found'),
-                    image_type
-                ])
+    def fill_report(self, state):
+        if self.report is not None:
+            self.report.add(self.report_row(state))
+        elif self.report_path is not None:
+            append_report_rows(self.report_path, [self.report_row(state)])
 
     def _load_dataset(self):
         try:
-            ds = pydicom.dcmread(self._dicom_filein)
-            meta_data = pydicom.filereader.read_file_meta_info(self._dicom_filein)
-            if (meta_data.get((0x0002, 0x0002)) and
-                    meta_data.get((0x0002, 0x0002)).value == "Media Storage Directory Storage"):
-                raise AnonymizerError('The file is a DICOMDIR. {}', self._dicom_filein, self.anonymous)
-        except Exception:
+            if self.header_only:
+                classification = classify_file(self._dicom_filein, header_only=True,
+                                               use_mmap=self.use_mmap)
+            else:
+                classification = classify_file(self._dicom_filein, use_mmap=self.use_mmap,
+                                               defer_size=PASSTHROUGH_DEFER_SIZE)
+        except OSError:
             raise AnonymizerError('The file is not a DICOM file. {}', self._dicom_filein, self.anonymous)
-        return ds
+        return _get_dicom_dataset(classification, self.anonymous)
 
-    def _anonymize_check(self, ds, data_element):
+    def _apply_rules(self, ds):
         """
-        Check anonymization on a single DICOM element.
-        ds: the DICOM descriptor
-        data_element: the current element to anonymize
-        """
-        group = data_element.tag.group
-        element = data_element.tag.element
-        tag = (group, element)
-
-        # Check if the value must be forced
-        if self._forced_values is not None and tag in self._forced_values:
-            self.originalDict[data_element.tag] = data_element.value
-            data_element.value = self._forced_values[tag]
-            self.outputDict[data_element.tag] = self._forced_values[tag]
-            return
+        Anonymizes ds and the datasets of its sequences with the compiled rules.
 
-        # Check if the data element has to be kept
-        if self._tags_config is not None and tag in self._tags_config:
-            do_apply_action = True
-            # In case of private tag, check if private creator and check its value
-            if (data_element.tag.is_private
-                    and self._tags_config[tag].get('private_creator')
-                    and not _is_private_creator(data_element.tag.group, data_element.tag.element)):
-                private_creator = ds.get(_get_private_creator_tag(data_element), None)
-                if not private_creator or private_creator.value not in self._tags_config[tag].get('private_creator'):
-                    do_apply_action = False
-            if do_apply_action:
-                action = self._tags_config[tag]['action']
-                self._apply_action(ds, data_element, action)
-                return
+        Data elements are visited once in tag order, only the data elements
+        with an action or a sequence value are converted from their raw
+        value, and the removed data elements are deleted once all the data
+        elements of ds are visited.
 
-        # Check if the data element is in the DICOM part 15/annex E tag list
-        action = self._find_in_conf_profile(group, element)
-        if action:
-            self._apply_action(ds, data_element, action)
+        Private creators are visited before the data elements of their block,
+        so the private creator of each (group, block) is resolved once per
+        dataset, after its own action: the data elements of a block whose
+        private creator is removed are removed as orphans.
 
-        # Check if the data element is private
-        elif data_element.tag.is_private:
-            if _is_private_creator(group, element):
-                self.originalDict[data_element.tag] = data_element.value
-                self.outputDict[data_element.tag] = data_element.value
-                return
-            private_creator = ds.get(_get_private_creator_tag(data_element), None)
-            if not private_creator:
-                del ds[data_element.tag]
-                return
-            private_creator_value = private_creator.value
-            private_creator_tag = (private_creator.tag.group, private_creator.tag.element)
-            # Check if private creator in tag_config
-            if (self._tags_config is not None
-                    and private_creator_tag in self._tags_config
-                    and private_creator.value in self._tags_config[private_creator_tag]['private_creator']):
-                self._apply_action(ds, data_element, self._tags_config[private_creator_tag]['action'])
-                return
-            # Check if the private creator is in the safe private attribute keys
-            if private_creator_value not in list(tag_lists.safe_private_attributes.keys()):
-                self.originalDict[data_element.tag] = data_element.value
-                del ds[data_element.tag]
-                return
-            block = element & 0x00ff
-            # Check if the data element is in the safe private attributes list
-            if (group, block) not in tag_lists.safe_private_attributes[private_creator_value]:
-                self.originalDict[data_element.tag] = data_element.value
-                del ds[data_element.tag]
-        # else:
-            # self.originalDict[data_element.tag] = data_element.value
-            # self.outputDict[data_element.tag] = data_element.value
+        Parameters
+        ----------
+        ds : pydicom.dataset.Dataset
+        """
+        rules = self._rules
+        tracker = self._tracker
+        encoding = ds.read_encoding or ds._character_set
+        removed = []
+        # {(group, block): private creator value}
+        private_creators = {}
+        for tag in sorted(ds.keys()):
+            group = tag >> 16
+            element = tag & 0xffff
+            private_creator = None
+            creator_block = False
+            if group % 2 != 0:
+                if is_private_creator(group, element):
+                    creator_block = True
+                else:
+                    private_creator = private_creators.get((group, element >> 8))
+            action = rules.element_action(group, element, private_creator)
+            if action == 'K' and not tracker.enabled:
+                action = ''
+
+            if action == REMOVE:
+                removed.append(tag)
+                continue
+            if action == 'X':
+                tracker.removed(tag, _removed_element_value(ds, tag, encoding) if tracker.keep_values else None)
+                removed.append(tag)
+                continue
+            if action:
+                data_element = ds[tag]
+                if action == FORCE:
+                    original = data_element.value
+                    data_element.value = rules.forced_values[(group, element)]
+                    tracker.replaced(data_element.tag, original, rules.forced_values[(group, element)])
+                else:
+                    self._apply_action(ds, data_element, action)
+            else:
+                # Only the data elements which may hold a sequence are converted (and
+                # read if deferred): Dataset.get_item would read all deferred values.
+                raw_element = ds._dict[tag]
+                vr = raw_element.VR
+                if not creator_block and (vr not in (None, 'SQ', 'UN') or is_bulk_data(tag, vr)):
+                    continue
+                data_element = ds[tag]
+            if creator_block:
+                private_creators[(group, element)] = _get_private_creator_value(data_element)
+            if data_element.VR == 'SQ':
+                for dataset_seq in data_element.value:
+                    self._apply_rules(dataset_seq)
+
+        for tag in removed:
+            del ds[tag]
 
     def _find_in_conf_profile(self, group: int, element: int) -> str:
         """
         Find (group, element) in confidentiality profiles and return action expected if found.
         """
-        if (group, element) in tag_lists.conf_profile:
-            return tag_lists.conf_profile[(group, element)]['profile'][0]
-
-        for tag_range in tag_lists.conf_profile_range:
-            (group_min, element_min), (group_max, element_max) = tag_range
-            if group_min <= group <= group_max and element_min <= element <= element_max:
-                return tag_lists.conf_profile_range[tag_range]['profile'][0]
-
-        return ''
+        return self._rules.profile_action(group, element)
 
     def _apply_action(self, ds, data_element, action, save=True):
         """
@@ -684,26 +1616,23 @@ class Anonymizer():
         data_element : pydicom.dataelem.DataElement
         action : str
         """
+        original = data_element.value
         if action == 'X':
-            if save: self.originalDict[data_element.tag] = data_element.value
             del ds[data_element.tag]
+            if save: self._tracker.removed(data_element.tag, original)
+            return
         elif action == 'Z':
-            if save: self.originalDict[data_element.tag] = data_element.value
             data_element.value = ""
-            if save: self.outputDict[data_element.tag] = data_element.value
         elif action == 'D':
-            if save: self.originalDict[data_element.tag] = data_element.value
             if data_element.VR == 'SQ':
                 for dataset_seq in data_element:
                     for data_element_seq in dataset_seq:
                         self._apply_action(dataset_seq, data_element_seq, action, False)
             else:
-                data_element.value = _get_cleaned_value(data_element)
-            if save: self.outputDict[data_element.tag] = data_element.value
+                data_element.value = _get_cleaned_value(data_element, self._generate_uid)
         elif action == 'U':
-            data_element.value = _generate_dicom_uid(data_element.value.encode())
-        elif action == 'K':
-            if save: self.originalDict[data_element.tag] = data_element.value
-            if save: self.outputDict[data_element.tag] = data_element.value
-        else:
+            data_element.value = self._generate_uid(data_element.value.encode())
+            return
+        elif action != 'K':
             raise DeidentificationError(f'Action not recognized: {action}')
+        if save: self._tracker.replaced(data_element.tag, original, data_element.value)
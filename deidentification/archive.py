@@ -1,8 +1,22 @@
+import bz2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import gzip
+import io
+import json
 import os
 import tarfile
+import threading
+import time
 import zipfile
 
 from deidentification import DeidentificationError
+from deidentification.dicom import is_precompressed
+
+# Size of the blocks of a TAR archive compressed by several threads, each
+# block being written as a gzip or bzip2 member of the archive
+PARALLEL_BLOCK_SIZE = 1024 * 1024
 
 
 def is_archive_file(filepath):
@@ -67,22 +81,408 @@ def unpack_first(input_filename: str, extract_dir: str) -> str:
         return untar_first(input_filename, extract_dir)
 
 
-def pack(output_filename, sources):
+def pack(output_filename, sources, compresslevel=None, threads=1):
     """
     Packs the source_dir directory in the output_filename archive.
+
+    compresslevel is the compression level from 0 (no compression) to 9, the
+    default level of the archive format is used if None. Already compressed
+    files are stored without compression in ZIP archives (see
+    dicom.is_precompressed). gzip and bzip2 TAR archives are compressed by
+    threads threads (see pack_tar).
     """
     dirname = os.path.dirname(output_filename)
     if not os.path.exists(dirname):
         os.makedirs(dirname)
     ext = os.path.splitext(output_filename)[1][1:]
     if ext == 'zip':
-        pack_zip(output_filename, sources)
+        pack_zip(output_filename, sources, compresslevel)
     elif ext in ('gz', 'tgz', 'bz2', 'tar'):
-        pack_tar(output_filename, sources, ext)
+        pack_tar(output_filename, sources, ext, compresslevel, threads)
     else:
         raise AttributeError('Output_filename must be an archive (ex: .tar.gz, .zip)')
 
 
+def _member_name(name):
+    """
+    Returns an archive member name relative to the archive root, or None if
+    the member is outside of the root (ex: '../file'), such members being
+    skipped.
+    """
+    name = os.path.normpath(name).lstrip('/')
+    if name in (os.curdir, os.pardir) or name.startswith(os.pardir + os.sep):
+        return None
+    return name
+
+
+def iter_archive_files(input_filename):
+    """
+    Iterates over the files of the input_filename archive without extracting them.
+    Yields (member name, file-like object, modification time) in the archive order.
+    File-like objects can only be read before getting the next item.
+    """
+    if not is_archive_file(input_filename):
+        raise AttributeError("Input_filename must be an archive (ex: .tar.gz, .zip)")
+    if zipfile.is_zipfile(input_filename):
+        with zipfile.ZipFile(input_filename) as zip_file:
+            for zip_info in zip_file.infolist():
+                name = _member_name(zip_info.filename)
+                if zip_info.is_dir() or name is None:
+                    continue
+                with zip_file.open(zip_info) as member_file:
+                    yield name, member_file, time.mktime(zip_info.date_time + (0, 0, -1))
+    else:
+        # Stream mode: the archive is read sequentially, without seeking
+        with tarfile.open(input_filename, 'r|*') as tar_data:
+            for tar_info in tar_data:
+                name = _member_name(tar_info.name)
+                if not tar_info.isfile() or name is None:
+                    continue
+                yield name, tar_data.extractfile(tar_info), tar_info.mtime
+
+
+def read_archive_members(input_filename, names):
+    """
+    Reads the names members of the input_filename archive in memory, without
+    extracting them. Yields (member name, content bytes) in the archive order
+    (see ArchiveIndex).
+    """
+    with ArchiveIndex(input_filename) as archive_index:
+        yield from archive_index.read_members(names)
+
+
+class _MemberFile(io.RawIOBase):
+
+    """
+    Read-only file-like object of the size bytes at offset in the fp file.
+    """
+
+    def __init__(self, fp, offset, size):
+        self._fp = fp
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self._position
+        elif whence == io.SEEK_END:
+            position += self._size
+        self._position = min(max(position, 0), self._size)
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0 or self._position + size > self._size:
+            size = self._size - self._position
+        self._fp.seek(self._offset + self._position)
+        data = self._fp.read(size)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class ArchiveIndex():
+
+    """
+    Index of the files of an archive, to read some of them directly in memory,
+    without extracting the archive.
+
+    - ZIP archives are indexed by their central directory.
+    - Uncompressed TAR archives are indexed in one pass over the member
+      headers, member data being skipped, and members are then read at their
+      offset. The index can be saved in the index_path sidecar file (JSON),
+      it is reused while the size and modification time of the archive match.
+    - Compressed TAR archives cannot be read at an offset: they are indexed and
+      read sequentially, the members which are not needed being skipped.
+    """
+
+    def __init__(self, input_filename, index_path=None):
+        if not is_archive_file(input_filename):
+            raise AttributeError("Input_filename must be an archive (ex: .tar.gz, .zip)")
+        self.input_filename = input_filename
+        self.index_path = index_path
+        self._zip_file = None
+        self._fp = None
+        self._members = None
+        if zipfile.is_zipfile(input_filename):
+            self._zip_file = zipfile.ZipFile(input_filename)
+            self._members = {_member_name(zip_info.filename): zip_info
+                             for zip_info in self._zip_file.infolist()
+                             if not zip_info.is_dir() and _member_name(zip_info.filename) is not None}
+        elif _is_uncompressed_tar(input_filename):
+            self._fp = open(input_filename, 'rb')
+            self._members = self._load_tar_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def random_access(self):
+        """True if members can be read directly, without reading the archive sequentially."""
+        return self._members is not None
+
+    def names(self):
+        """Returns the names of the archive files, in the archive order."""
+        if self._members is None:
+            return [name for name, _, _ in iter_archive_files(self.input_filename)]
+        return list(self._members)
+
+    def open(self, name):
+        """
+        Returns a file-like object of the name member.
+        Only archives with random access can open a member.
+        """
+        if self._zip_file is not None:
+            return self._zip_file.open(self._members[name])
+        if self._fp is not None:
+            offset, size = self._members[name]
+            return io.BufferedReader(_MemberFile(self._fp, offset, size))
+        raise DeidentificationError('Members of a compressed TAR archive cannot be opened directly.')
+
+    def read(self, name):
+        """Returns the content bytes of the name member."""
+        for _, data in self.read_members([name]):
+            return data
+        raise KeyError(name)
+
+    def iter_members(self):
+        """
+        Yields (member name, file-like object) for all the archive files,
+        in the archive order. File-like objects can only be read before
+        getting the next item.
+        """
+        if self._members is None:
+            for name, member_file, _ in iter_archive_files(self.input_filename):
+                yield name, member_file
+        else:
+            for name in self._members:
+                with self.open(name) as member_file:
+                    yield name, member_file
+
+    def read_members(self, names):
+        """
+        Yields (member name, content bytes) for the names members which are in
+        the archive, in the archive order.
+        """
+        names = set(names)
+        if self._members is None:
+            for name, member_file, _ in iter_archive_files(self.input_filename):
+                if name in names:
+                    yield name, member_file.read()
+        else:
+            for name in self._members:
+                if name in names:
+                    with self.open(name) as member_file:
+                        yield name, member_file.read()
+
+    def close(self):
+        if self._zip_file is not None:
+            self._zip_file.close()
+            self._zip_file = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _load_tar_index(self):
+        stat = os.stat(self.input_filename)
+        if self.index_path is not None and os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as index_file:
+                    index = json.load(index_file)
+                if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+                    return {name: (offset, size) for name, offset, size in index['members']
+                            if _member_name(name) == name}
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        members = {}
+        with tarfile.open(fileobj=self._fp, mode='r:') as tar_data:
+            for tar_info in tar_data:
+                name = _member_name(tar_info.name)
+                if tar_info.isfile() and not tar_info.issparse() and name is not None:
+                    members[name] = (tar_info.offset_data, tar_info.size)
+
+        if self.index_path is not None:
+            index = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                     'members': [[name, offset, size] for name, (offset, size) in members.items()]}
+            try:
+                with open(self.index_path, 'w') as index_file:
+                    json.dump(index, index_file)
+            except OSError:
+                # The index is only an optimization, the archive folder may be read-only
+                pass
+        return members
+
+
+def _is_uncompressed_tar(input_filename):
+    try:
+        with tarfile.open(input_filename, 'r:'):
+            return True
+    except tarfile.ReadError:
+        return False
+
+
+class ArchiveWriter():
+
+    """
+    Writes files in an archive as they come, without temporary files.
+    The archive type is defined by output_filename extension, and compresslevel
+    and threads are used, as in pack.
+    """
+
+    def __init__(self, output_filename, compresslevel=None, threads=1):
+        dirname = os.path.dirname(output_filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        ext = os.path.splitext(output_filename)[1][1:]
+        self.output_filename = output_filename
+        self.compresslevel = compresslevel
+        self._zip_ds = None
+        self._tar_ds = None
+        self._tar_files = []
+        self._lock = threading.Lock()
+        if ext == 'zip':
+            self._zip_ds = zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED)
+        elif ext in ('gz', 'tgz', 'bz2', 'tar'):
+            self._tar_ds, self._tar_files = _open_tar_writer(output_filename, ext, compresslevel, threads)
+        else:
+            raise AttributeError('Output_filename must be an archive (ex: .tar.gz, .zip)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, arcname, data, mtime=None):
+        """
+        Adds data bytes as the arcname file of the archive.
+        Files can be added by concurrent threads.
+        """
+        if mtime is None:
+            mtime = time.time()
+        if self._zip_ds is not None:
+            # ZIP format does not handle dates before 1980
+            date_time = max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+            zip_info = zipfile.ZipInfo(arcname, date_time)
+            zip_info.compress_type, compresslevel = _zip_compression(io.BytesIO(data), self.compresslevel)
+            with self._lock:
+                self._zip_ds.writestr(zip_info, data, compresslevel=compresslevel)
+        else:
+            tar_info = tarfile.TarInfo(arcname)
+            tar_info.size = len(data)
+            tar_info.mtime = mtime
+            with self._lock:
+                self._tar_ds.addfile(tar_info, io.BytesIO(data))
+
+    def close(self):
+        if self._zip_ds is not None:
+            self._zip_ds.close()
+        if self._tar_ds is not None:
+            self._tar_ds.close()
+            for tar_file in self._tar_files:
+                tar_file.close()
+
+
+class _ParallelCompressWriter():
+
+    """
+    Write-only file-like object compressing the written data by blocks of
+    block_size bytes in threads threads, and writing the compressed blocks
+    in order in fileobj.
+
+    compress compresses a block into a complete gzip or bzip2 stream: the
+    concatenation of the streams is a valid gzip or bzip2 file.
+    """
+
+    def __init__(self, fileobj, compress, threads, block_size=None):
+        self._fileobj = fileobj
+        self._compress = compress
+        self._threads = threads
+        self._block_size = block_size or PARALLEL_BLOCK_SIZE
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block)
+        return len(data)
+
+    def close(self):
+        if self._executor is None:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(self._compress, block))
+        # Compressed blocks are written in order, with at most two blocks
+        # per thread in memory
+        while len(self._pending) > 2 * self._threads or (self._pending and self._pending[0].done()):
+            self._fileobj.write(self._pending.popleft().result())
+
+
+def _open_tar_writer(output_filename, ext, compresslevel=None, threads=1):
+    """
+    Opens the output_filename TAR archive to write, compressed according to
+    its ext extension. Returns the tarfile.TarFile and the file objects to
+    close after it.
+    """
+    compression = {'tgz': 'gz', 'tar': ''}.get(ext, ext)
+    if compression == 'bz2' and compresslevel == 0:
+        # bzip2 has no level without compression
+        compresslevel = 1
+    if compression and threads > 1:
+        if compression == 'gz':
+            compress = functools.partial(gzip.compress, mtime=0,
+                                         compresslevel=9 if compresslevel is None else compresslevel)
+        else:
+            compress = functools.partial(bz2.compress, compresslevel=9 if compresslevel is None else compresslevel)
+        output_file = open(output_filename, 'wb')
+        writer = _ParallelCompressWriter(output_file, compress, threads)
+        return tarfile.open(fileobj=writer, mode='w|'), [writer, output_file]
+    if compression and compresslevel is not None:
+        return tarfile.open(output_filename, 'w:' + compression, compresslevel=compresslevel), []
+    return tarfile.open(output_filename, 'w:' + compression), []
+
+
+def _zip_compression(fp, compresslevel=None):
+    """
+    Returns the ZIP compression type and level of the content of fp,
+    which is stored without compression if it is already compressed.
+    """
+    if compresslevel == 0 or is_precompressed(fp):
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, compresslevel
+
+
 def untar(input_filename, extract_dir):
     """
     Extracts the input_filename archive to the extract_dir directory.
@@ -142,39 +542,49 @@ def unzip_first(input_filename: str, extract_dir: str) -> str:
     return res
 
 
-def pack_tar(output_filename, sources, type='gz'):
+def pack_tar(output_filename, sources, type='gz', compresslevel=None, threads=1):
     """
     Creates a tar archive in output_filename from the source_dir directory.
+
+    With several threads, a gzip or bzip2 archive is compressed by blocks
+    in parallel, each block being a member of the compressed file, which
+    can be read by any gzip or bzip2 reader.
     """
-    if type == 'tgz':
-        type = 'gz'
-    elif type == 'tar':
-        type = ''
-    tar_ds = tarfile.open(output_filename, 'w:' + type)
+    tar_ds, tar_files = _open_tar_writer(output_filename, type, compresslevel, threads)
     if not isinstance(sources, (list, tuple)) and \
        isinstance(sources, str):
         sources = [sources]
-    for source in sources:
-        tar_ds.add(source, arcname=os.path.basename(source))
-    tar_ds.close()
+    try:
+        for source in sources:
+            tar_ds.add(source, arcname=os.path.basename(source))
+    finally:
+        tar_ds.close()
+        for tar_file in tar_files:
+            tar_file.close()
 
 
-def pack_zip(output_filename, sources):
+def pack_zip(output_filename, sources, compresslevel=None):
     """
     Creates a zip archive in output_filename from the source_dir directory.
+    Already compressed files are stored without compression.
     """
-    previous_dir = os.getcwd()
     if not isinstance(sources, (list, tuple)) and \
        isinstance(sources, str):
         sources = [sources]
-    zip_ds = zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED)
-    for source in sources:
-        os.chdir(os.path.dirname(source))
-        if os.path.isdir(source):
-            for root, dirs, files in os.walk(os.path.basename(source)):
-                for file in files:
-                    zip_ds.write(os.path.join(root, file))
-        else:
-            zip_ds.write(os.path.basename(source))
-    zip_ds.close()
-    os.chdir(previous_dir)
+    with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as zip_ds:
+        for source in sources:
+            # Files are named relatively to the folder of source
+            source_dir = os.path.dirname(source)
+            if os.path.isdir(source):
+                for root, dirs, files in os.walk(source):
+                    for file in files:
+                        filepath = os.path.join(root, file)
+                        _zip_write(zip_ds, filepath, os.path.relpath(filepath, source_dir), compresslevel)
+            else:
+                _zip_write(zip_ds, source, os.path.basename(source), compresslevel)
+
+
+def _zip_write(zip_ds, filepath, arcname, compresslevel=None):
+    with open(filepath, 'rb') as fp:
+        compress_type, compresslevel = _zip_compression(fp, compresslevel)
+    zip_ds.write(filepath, arcname, compress_type=compress_type, compresslevel=compresslevel)
@@ -0,0 +1,138 @@
+import math
+import time
+
+from pydicom.datadict import keyword_for_tag
+
+
+class FileVerdict():
+
+    """
+    Result of the deidentification check of a file.
+
+    failures are the data elements which are not deidentified, as
+    {tag: reason}. error is the exception raised if the file could not be
+    checked (not a DICOM file for instance).
+    """
+
+    def __init__(self, filepath, failures=None, error=None):
+        self.filepath = filepath
+        self.failures = failures or {}
+        self.error = error
+
+    def __repr__(self):
+        return f'FileVerdict({self.filepath!r}, {len(self.failures)} failures, error={self.error!r})'
+
+    def __str__(self):
+        if self.error is not None:
+            return f'{self.filepath}: error: {self.error}'
+        if not self.failures:
+            return f'{self.filepath}: passed'
+        failures = '; '.join(f'{tag} {keyword_for_tag(tag) or "Unknown"} {reason}'
+                             for tag, reason in sorted(self.failures.items()))
+        return f'{self.filepath}: failed: {failures}'
+
+    @property
+    def passed(self):
+        return self.error is None and not self.failures
+
+
+class AuditSummary():
+
+    """
+    Counters of a folder audit (see anonymizer.audit_folder), updated as
+    verdicts are given.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.failed = 0
+        self.errors = 0
+        self.complete = False
+        self._start = None
+        self._end = None
+
+    def __repr__(self):
+        return (f'AuditSummary({self.files} files, {self.failed} failed, {self.errors} errors, '
+                f'{self.elapsed:.1f}s, {self.throughput:.1f} files/s)')
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._end = None
+
+    def stop(self):
+        self._end = time.perf_counter()
+
+    def add(self, verdict):
+        self.files += 1
+        if verdict.error is not None:
+            self.errors += 1
+        elif verdict.failures:
+            self.failed += 1
+
+    @property
+    def elapsed(self):
+        """Duration of the audit in seconds."""
+        if self._start is None:
+            return 0.
+        return (self._end or time.perf_counter()) - self._start
+
+    @property
+    def throughput(self):
+        """Checked files per second."""
+        elapsed = self.elapsed
+        return self.files / elapsed if elapsed else 0.
+
+
+class SampleAudit():
+
+    """
+    Result of the deidentification check of a sample of files of each series
+    (see anonymizer.check_anonymize_sample).
+
+    series_files are the numbers of files of the series, as
+    {SeriesInstanceUID: number of files}, files without SeriesInstanceUID
+    being grouped under None. verdicts are the FileVerdict of the sampled
+    files, as {SeriesInstanceUID: [FileVerdict, ...]}.
+    """
+
+    def __init__(self, series_files, verdicts, tolerance):
+        self.series_files = series_files
+        self.verdicts = verdicts
+        self.tolerance = tolerance
+
+    def __repr__(self):
+        return (f'SampleAudit({len(self.series_files)} series, {self.sampled}/{self.files} files, '
+                f'{self.failed} failed, confidence={self.confidence:.3f})')
+
+    @property
+    def files(self):
+        return sum(self.series_files.values())
+
+    @property
+    def sampled(self):
+        return sum(len(verdicts) for verdicts in self.verdicts.values())
+
+    @property
+    def failed(self):
+        return sum(not verdict.passed for verdicts in self.verdicts.values() for verdict in verdicts)
+
+    @property
+    def passed(self):
+        return self.failed == 0
+
+    @property
+    def confidence(self):
+        """
+        Probability that the sample contains a failed file when at least
+        tolerance of the files of a series are not deidentified, for the least
+        sampled series.
+
+        For a series of N files with n sampled files and D = ceil(tolerance * N)
+        failed files, it is 1 - C(N - D, n) / C(N, n).
+        """
+        confidence = 1.
+        for series_instance_uid, files in self.series_files.items():
+            sampled = len(self.verdicts.get(series_instance_uid, ()))
+            failed = max(1, math.ceil(self.tolerance * files))
+            confidence = min(confidence, 1. - math.comb(files - failed, sampled) / math.comb(files, sampled))
+        return confidence
@@ -1,8 +1,22 @@
 import csv
+import hashlib
+import io
+import json
 import os
+import threading
 
 from deidentification import CONFIG_FOLDER, DeidentificationError
 
+# Folder where parsed configuration files are cached between processes, if set
+CACHE_DIR_ENV = 'DEIDENTIFICATION_CACHE_DIR'
+
+# Version of the format of the cached files, cached files of other versions are ignored
+CACHE_VERSION = 1
+
+# Parsed configuration files of the process, by (path, modification time, size)
+_parsed_files = {}
+_parsed_files_lock = threading.Lock()
+
 
 def tag_to_tuple(tag_str: str) -> tuple:
     tag = tag_str
@@ -23,6 +37,97 @@ def tag_to_tuple(tag_str: str) -> tuple:
     return tag_tuple
 
 
+def _encode_cached(value):
+    """Returns parsed, made of dicts, lists, tuples and scalars, as a JSON
+    value, tuples and dicts being tagged to be decoded (see _decode_cached)."""
+    if isinstance(value, tuple):
+        return {'tuple': [_encode_cached(item) for item in value]}
+    if isinstance(value, dict):
+        return {'dict': [[_encode_cached(key), _encode_cached(item)] for key, item in value.items()]}
+    if isinstance(value, list):
+        return [_encode_cached(item) for item in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(f'{type(value).__name__} values cannot be cached.')
+
+
+def _decode_cached(value):
+    if isinstance(value, dict):
+        if 'tuple' in value:
+            return tuple(_decode_cached(item) for item in value['tuple'])
+        return {_decode_cached(key): _decode_cached(item) for key, item in value['dict']}
+    if isinstance(value, list):
+        return [_decode_cached(item) for item in value]
+    return value
+
+
+def load_cached(path, parser):
+    """
+    Parses the path text file with parser (a function of the file content),
+    once per process as long as the file is not modified.
+
+    If the DEIDENTIFICATION_CACHE_DIR environment variable is set, parsed
+    files are also saved as JSON in this folder, keyed by the hash of their
+    content, to be shared between processes. Cached files which cannot be
+    read are ignored. The returned object must not be modified.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, parser.__qualname__, stat.st_mtime_ns, stat.st_size)
+    with _parsed_files_lock:
+        if key in _parsed_files:
+            return _parsed_files[key]
+
+    with open(path, 'rb') as config_file:
+        content = config_file.read()
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    cache_path = None
+    parsed = None
+    if cache_dir:
+        digest = hashlib.sha256(content + parser.__qualname__.encode()).hexdigest()[:32]
+        cache_path = os.path.join(cache_dir, f'{os.path.basename(path)}.{digest}.json')
+        try:
+            with open(cache_path, encoding='utf-8') as cache_file:
+                cached = json.load(cache_file)
+            if cached['version'] == CACHE_VERSION:
+                parsed = _decode_cached(cached['parsed'])
+        except Exception:
+            # Missing, corrupted or outdated cached file, parsed again
+            parsed = None
+    if parsed is None:
+        parsed = parser(content.decode())
+        if cache_path is not None:
+            try:
+                cached = json.dumps({'version': CACHE_VERSION, 'parsed': _encode_cached(parsed)})
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+                    cache_file.write(cached)
+                os.replace(tmp_path, cache_path)
+            except (OSError, TypeError):
+                # The cache is optional
+                pass
+
+    with _parsed_files_lock:
+        _parsed_files[key] = parsed
+    return parsed
+
+
+def _parse_config_profile(content):
+    tsv_reader = csv.reader(io.StringIO(content), delimiter='\t')
+    _ = next(tsv_reader)  # header
+    tags_profile = {}
+    for d in tsv_reader:
+        if len(d) <= 2 or not d[2]:
+            action = 'K'
+        else:
+            action = d[2]
+        tags_profile.setdefault(tag_to_tuple(d[0]), {}).update({'name': d[1], 'action': action})
+        if len(d) > 3:
+            tags_profile[tag_to_tuple(d[0])].setdefault('private_creator', []).append(d[3])
+    return tags_profile
+
+
 def load_config_profile(profile: str, anonymous: bool = False):
     profile_path = os.path.join(CONFIG_FOLDER, 'profiles', profile + '.tsv')
     if not os.path.exists(profile_path):
@@ -33,18 +138,7 @@ def load_config_profile(profile: str, anonymous: bool = False):
 
     tag_load_error = ''
     try:
-        with open(profile_path) as tsv_file:
-            tsv_reader = csv.reader(tsv_file, delimiter='\t')
-            _ = next(tsv_reader)  # header
-            tags_profile = {}
-            for d in tsv_reader:
-                if len(d) <= 2 or not d[2]:
-                    action = 'K'
-                else:
-                    action = d[2]
-                tags_profile.setdefault(tag_to_tuple(d[0]), {}).update({'name': d[1], 'action': action})
-                if len(d) > 3:
-                    tags_profile[tag_to_tuple(d[0])].setdefault('private_creator', []).append(d[3])
+        tags_profile = load_cached(profile_path, _parse_config_profile)
     except ValueError as e:
         if anonymous:
             tag_load_error = 'Error occurs during config profile load.'
@@ -53,7 +147,10 @@ def load_config_profile(profile: str, anonymous: bool = False):
     if tag_load_error:
         raise DeidentificationError(tag_load_error)
 
-    return tags_profile
+    # The parsed profile is shared, a copy is returned
+    return {tag: {key: list(value) if isinstance(value, list) else value
+                  for key, value in rule.items()}
+            for tag, rule in tags_profile.items()}
 
 
 # /!\ Siemens VIDA and CSA header ?
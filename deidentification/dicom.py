@@ -1,6 +1,12 @@
+from functools import lru_cache
+import io
+import mmap
+import os
 from pathlib import Path
+import re
 import puremagic
 import pydicom
+from pydicom.filereader import read_partial
 import shutil
 from subprocess import DEVNULL, run
 import tempfile
@@ -20,6 +26,263 @@ SOP_CLASS_UID_NO_IMAGING = [
 
 CAPTURE_SOP_CLASS_UIDS = ["1.2.840.10008.5.1.4.1.1.7"]
 
+# Siemens RDA spectroscopy files header
+RDA_SIGNATURE = b'>>> Begin of header <<<'
+# Parameters of Philips SPAR files used by spec2nii to read SDAT files
+SPAR_MAX_SIZE = 64 * 1024
+SPAR_PARAMETER_PATTERN = re.compile(r'^\s*(samples|rows|sample_frequency)\s*:\s*(\S+)', re.MULTILINE)
+
+# Number of bytes read at the beginning of a file to identify its type
+# (DICOM magic number is at offset 128)
+MAGIC_HEADER_SIZE = 1024
+
+# Pixel data elements (Float Pixel Data, Double Float Pixel Data, Pixel Data)
+PIXEL_DATA_TAGS = [(0x7FE0, 0x0008), (0x7FE0, 0x0009), (0x7FE0, 0x0010)]
+
+# Series Instance UID, read alone to group files by series
+SERIES_INSTANCE_UID_TAG = 0x0020000E
+
+# Number of bytes first read from a file to find its Series Instance UID
+SERIES_HEADER_SIZE = 16 * 1024
+
+# Values larger than this size (in bytes) are not read when only the header
+# of a DICOM file is needed, they are read on access only.
+HEADER_ONLY_DEFER_SIZE = 64 * 1024
+
+# Values larger than this size (in bytes) are not read during the parse of a
+# DICOM file to deidentify. Pixel data and bulk data left untouched by the
+# deidentification are then copied by chunks from the input file to the output
+# file (see writer.dcmwrite_passthrough).
+PASSTHROUGH_DEFER_SIZE = 64 * 1024
+
+# Environment variable enabling memory-mapped reads of DICOM files (see MappedFile)
+MMAP_ENV = 'DEIDENTIFICATION_MMAP'
+
+
+class MappedFile():
+
+    """
+    Read-only file object over a memory map of a file.
+
+    Only the pages of the file which are read are loaded, and they are shared
+    with the page cache instead of being copied in read buffers: parsing the
+    header of a large file touches a few pages, and deferred values are read
+    back through a new map (pydicom opens them with the class of the file
+    object the dataset was read from).
+    """
+
+    def __init__(self, filename, mode='rb'):
+        if mode != 'rb':
+            raise ValueError(f'Memory-mapped files are read-only, mode not supported: {mode}')
+        self.name = filename
+        with open(filename, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                self._map = io.BytesIO()
+            else:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_RANDOM'):
+                    # Reads are seeks over large values, not sequential reads
+                    self._map.madvise(mmap.MADV_RANDOM)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, size=-1):
+        return self._map.read(None if size is None or size < 0 else size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def close(self):
+        self._map.close()
+
+
+def use_mmap_default():
+    """Returns true if the MMAP_ENV environment variable enables memory-mapped reads."""
+    return os.environ.get(MMAP_ENV, '') not in ('', '0')
+
+
+class FileClassification():
+    """
+    Type of a file, with its DICOM dataset when it has been parsed.
+
+    Kinds of file are:
+    - dicom: a DICOM file
+    - capture: a DICOM file of a screen capture
+    - image: a JPEG or PNG image
+    - dicomdir: a DICOMDIR file
+    - non-dicom: any other file
+    """
+
+    DICOM = 'dicom'
+    CAPTURE = 'capture'
+    IMAGE = 'image'
+    DICOMDIR = 'dicomdir'
+    NON_DICOM = 'non-dicom'
+
+    def __init__(self, filepath, kind, dataset=None):
+        self.filepath = filepath
+        self.kind = kind
+        self.dataset = dataset
+
+    def __repr__(self):
+        return f'FileClassification({self.filepath!r}, {self.kind!r})'
+
+    @property
+    def is_dicom(self):
+        return self.kind in (self.DICOM, self.CAPTURE, self.DICOMDIR)
+
+
+def classify_file(filepath, header_only=False, use_mmap=None, **read_kwargs):
+    """
+    Identify the type of filepath, reading it only once.
+    DICOM files are parsed and their dataset is kept in the classification
+    to be reused. read_kwargs are passed to pydicom.dcmread.
+
+    With header_only, large values are skipped during the parse and pixel data
+    elements are removed from the dataset, so that they are never read. The
+    elements following the pixel data are kept, unlike with stop_before_pixels.
+
+    With use_mmap, the file is read through a memory map (see MappedFile).
+    It defaults to the MMAP_ENV environment variable.
+    """
+    if use_mmap is None:
+        use_mmap = use_mmap_default()
+    with (MappedFile if use_mmap else open)(filepath, 'rb') as fp:
+        return classify_fileobj(fp, filepath, header_only, **read_kwargs)
+
+
+def classify_fileobj(fp, filepath=None, header_only=False, **read_kwargs):
+    """
+    Identify the type of the file-like object fp, as classify_file.
+    filepath is the name given to the file in the classification.
+    """
+    if header_only:
+        read_kwargs.setdefault('defer_size', HEADER_ONLY_DEFER_SIZE)
+
+    header = fp.read(MAGIC_HEADER_SIZE)
+    try:
+        magic_mime_type = set(m.mime_type for m in puremagic.magic_string(header))
+    except (puremagic.PureError, ValueError):
+        # Unidentified or empty file
+        magic_mime_type = set()
+
+    if magic_mime_type & {"image/jpeg", "image/png"}:
+        return FileClassification(filepath, FileClassification.IMAGE)
+    if "application/dicom" not in magic_mime_type:
+        return FileClassification(filepath, FileClassification.NON_DICOM)
+
+    fp.seek(0)
+    try:
+        ds = pydicom.dcmread(fp, **read_kwargs)
+        if (read_kwargs.get('defer_size') is not None
+                and ds.file_meta.get('TransferSyntaxUID') == pydicom.uid.DeflatedExplicitVRLittleEndian):
+            # Deferred values of a deflated dataset cannot be read back from the file
+            fp.seek(0)
+            ds = pydicom.dcmread(fp, **dict(read_kwargs, defer_size=None))
+    except Exception:
+        return FileClassification(filepath, FileClassification.NON_DICOM)
+
+    if header_only:
+        for tag in PIXEL_DATA_TAGS:
+            if tag in ds:
+                del ds[tag]
+
+    media_storage_sop_class_uid = ds.file_meta.get('MediaStorageSOPClassUID')
+    if media_storage_sop_class_uid == pydicom.uid.MediaStorageDirectoryStorage:
+        return FileClassification(filepath, FileClassification.DICOMDIR, ds)
+    if is_capture_dicom(ds):
+        return FileClassification(filepath, FileClassification.CAPTURE, ds)
+    return FileClassification(filepath, FileClassification.DICOM, ds)
+
+
+def read_sop_instance_uid(filepath):
+    """
+    Returns the SOPInstanceUID of the filepath DICOM file, None if filepath is
+    not a DICOM file or has no SOPInstanceUID.
+    """
+    try:
+        ds = pydicom.dcmread(filepath, stop_before_pixels=True,
+                             specific_tags=['SOPInstanceUID'])
+    except Exception:
+        return None
+    return ds.get('SOPInstanceUID')
+
+
+def is_precompressed(fp):
+    """
+    Returns True if the content of the file-like object fp is already
+    compressed, so that compressing it again is useless: JPEG or PNG image,
+    or DICOM file with a compressed transfer syntax (JPEG, JPEG 2000, RLE,
+    deflate...). Only the beginning of fp is read.
+    """
+    start = fp.tell()
+    header = fp.read(MAGIC_HEADER_SIZE)
+    try:
+        magic_mime_type = set(m.mime_type for m in puremagic.magic_string(header))
+    except (puremagic.PureError, ValueError):
+        return False
+    if magic_mime_type & {"image/jpeg", "image/png"}:
+        return True
+    if "application/dicom" not in magic_mime_type:
+        return False
+
+    fp.seek(start)
+    try:
+        # The parse stops at the first element after the file meta information
+        ds = read_partial(fp, stop_when=lambda tag, vr, length: True)
+    except Exception:
+        return False
+    transfer_syntax_uid = ds.file_meta.get('TransferSyntaxUID')
+    return transfer_syntax_uid is not None and pydicom.uid.UID(transfer_syntax_uid).is_compressed
+
+
+def read_series_instance_uid(fp):
+    """
+    Returns the SeriesInstanceUID of the DICOM file-like object fp, None if fp
+    is not a DICOM file or has no SeriesInstanceUID.
+
+    The header is parsed up to the SeriesInstanceUID only. SERIES_HEADER_SIZE
+    bytes of fp are read first, the rest of fp is read only if the
+    SeriesInstanceUID is not found in them.
+    """
+    header = fp.read(SERIES_HEADER_SIZE)
+    series_instance_uid, found = _parse_series_instance_uid(header)
+    if not found and len(header) == SERIES_HEADER_SIZE:
+        series_instance_uid, found = _parse_series_instance_uid(header + fp.read())
+    return series_instance_uid
+
+
+def _parse_series_instance_uid(header):
+    """
+    Parses the SeriesInstanceUID of the beginning of a DICOM file.
+    Returns (SeriesInstanceUID, True) if the element following it was reached,
+    so that the value is known to be complete, (SeriesInstanceUID, False) otherwise.
+    """
+    next_tags = []
+
+    def after_series_instance_uid(tag, vr, length):
+        if tag > SERIES_INSTANCE_UID_TAG:
+            next_tags.append(tag)
+            return True
+        return False
+
+    try:
+        ds = read_partial(io.BytesIO(header), stop_when=after_series_instance_uid)
+    except Exception:
+        return None, False
+    series_instance_uid = ds.get('SeriesInstanceUID')
+    return (str(series_instance_uid) if series_instance_uid else None), bool(next_tags)
+
+
 def is_imaging_modality(dicom_ds):
     """ Check if modality tag (0008, 0060) in dicom correspond to a supported imaging modality.
     Supported modalities are:
@@ -51,24 +314,11 @@ def is_capture(filepath):
     """
     Check if filepath is a capture file. Check if jpg, png, or DICOM with class UID of capture
     """
-    # jpg : 'image/jpeg'
-    # png : 'image/png'
-    # DICOM : 'application/dicom'
-
-    magic = puremagic.magic_file(filepath)
-    magic_mime_type = set(m.mime_type for m in magic)
-    if "image/jpeg" in magic_mime_type:
+    kind = classify_file(filepath).kind
+    if kind == FileClassification.IMAGE:
         return "image"
-    elif "image/png" in magic_mime_type:
-        return "image"
-    elif "application/dicom" in magic_mime_type:
-        try:
-            # check tag
-            ds = pydicom.read_file(filepath)
-            if is_capture_dicom(ds):
-                return "dicom"
-        except Exception:
-            return ""
+    elif kind == FileClassification.CAPTURE:
+        return "dicom"
     return ""
 
 
@@ -83,11 +333,59 @@ def is_capture_dicom(ds):
     return False
 
 
-def is_spectro(filepath):
+def _read_spar_parameters(spar_path):
+    with open(spar_path, 'rb') as spar_file:
+        spar = spar_file.read(SPAR_MAX_SIZE).decode('latin-1')
+    return dict(SPAR_PARAMETER_PATTERN.findall(spar))
+
+
+def detect_spectro(filepath):
+    """
+    Identify spectroscopy data converted by spec2nii (see is_spectro) from the
+    file extension and header, without running spec2nii.
+    Returns True or False, or None if the file cannot be identified this way.
+    """
+    path = Path(filepath)
+    suffix = path.suffix.lower()
+
+    # Siemens RDA
+    if suffix == '.rda':
+        with open(path, 'rb') as rda_file:
+            return True if rda_file.read(len(RDA_SIGNATURE)) == RDA_SIGNATURE else None
+
+    # Philips SPAR/SDAT pair, SDAT containing samples x rows complex values
+    if suffix in ('.spar', '.sdat'):
+        spar_path, sdat_path = path.with_suffix('.SPAR'), path.with_suffix('.SDAT')
+        if not spar_path.is_file() or not sdat_path.is_file():
+            return False
+        parameters = _read_spar_parameters(spar_path)
+        try:
+            sdat_size = int(parameters['samples']) * int(parameters['rows']) * 8
+            float(parameters['sample_frequency'])
+        except (KeyError, ValueError):
+            return None
+        return True if sdat_path.stat().st_size == sdat_size else None
+
+    # Siemens Twix and GE P-files need their vendor readers
+    if suffix in ('.dat', '.7'):
+        return None
+
+    # Philips DATA/LIST are not converted automatically
+    if suffix in ('.data', '.list'):
+        return False
+
+    # Other files can only be converted as DICOM, which needs a DICOM preamble
+    with open(path, 'rb') as f:
+        header = f.read(132)
+    if header[128:132] == b'DICM':
+        return None
+    return False
+
+
+def _run_spec2nii(filepath):
     """
     Check if spec2nii can convert data in auto mode or philips_dcm mode.
     """
-    
     temp_folder = tempfile.mkdtemp()
     cmd = ["spec2nii", "auto", "-o", temp_folder, filepath]
     cmd_ph = ["spec2nii", "philips_dcm", "-o", temp_folder, filepath]
@@ -105,6 +403,39 @@ def is_spectro(filepath):
     return True
 
 
+@lru_cache(maxsize=4096)
+def _is_spectro(filepath, file_stats):
+    spectro = detect_spectro(filepath)
+    if spectro is None:
+        spectro = _run_spec2nii(filepath)
+    return spectro
+
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def is_spectro(filepath):
+    """
+    Check if spec2nii can convert data in auto mode or philips_dcm mode.
+
+    Data is identified by its extension and header signature, spec2nii is only
+    run for files which cannot be identified this way. Results are cached by
+    file path, size and modification time, and by those of the other file of
+    a SPAR/SDAT pair, which is needed to identify it.
+    """
+    path = Path(filepath)
+    stat = os.stat(path)
+    file_stats = ((stat.st_size, stat.st_mtime_ns),)
+    if path.suffix.lower() in ('.spar', '.sdat'):
+        file_stats += (_stat_key(path.with_suffix('.SPAR')), _stat_key(path.with_suffix('.SDAT')))
+    return _is_spectro(os.path.abspath(filepath), file_stats)
+
+
 def is_folder_empty_of_files(folder_path) -> bool:
     if isinstance(folder_path, str):
         folder_path = Path(folder_path)
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import sqlite3
+
+from deidentification import DeidentificationError
+
+# Number of recorded files between two commits of the manifest
+COMMIT_INTERVAL = 100
+
+FILE_DONE = 'done'
+FILE_FAILED = 'failed'
+
+
+def file_digest(filepath, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of the filepath content."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest():
+
+    """
+    SQLite manifest of the files deidentified from an input folder, to resume
+    an interrupted deidentification or to update its output.
+
+    Files are recorded by their path relative to the input folder, with their
+    size, modification time, content hash, status (done or failed) and output
+    path relative to the output folder. A file is up to date if its size and
+    modification time, or else its content, have not changed since it was
+    recorded.
+
+    The manifest is reset if it has been written with other settings (see
+    plan.AnonymizationPlan.fingerprint), all the files are then processed again.
+    Settings are not checked if fingerprint is None.
+    """
+
+    def __init__(self, path, fingerprint=None):
+        try:
+            self._connection = sqlite3.connect(path)
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    sha256 TEXT,
+                    status TEXT,
+                    output TEXT
+                );
+            ''')
+        except sqlite3.DatabaseError as e:
+            raise DeidentificationError(f'Manifest {path} cannot be opened: {e}')
+        self.path = path
+        self._pending = 0
+
+        if fingerprint is None:
+            return
+        row = self._connection.execute(
+            "SELECT value FROM settings WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            with self._connection:
+                self._connection.execute('DELETE FROM files')
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO settings VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def get(self, name):
+        """Returns the record of name as a dict, or None if it is not recorded."""
+        cursor = self._connection.execute(
+            'SELECT name, size, mtime_ns, sha256, status, output FROM files WHERE name = ?', (name,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def is_up_to_date(self, name, filepath):
+        """Checks if filepath, recorded as name, has not changed since it was recorded."""
+        record = self.get(name)
+        if record is None:
+            return False
+        stat = os.stat(filepath)
+        if stat.st_size != record['size']:
+            return False
+        if stat.st_mtime_ns == record['mtime_ns']:
+            return True
+        # Same content with another modification time (copied or extracted again)
+        if file_digest(filepath) != record['sha256']:
+            return False
+        self._connection.execute('UPDATE files SET mtime_ns = ? WHERE name = ?',
+                                 (stat.st_mtime_ns, name))
+        self._commit_later()
+        return True
+
+    def record(self, name, filepath, output=None, status=FILE_DONE, digest=None):
+        """
+        Records filepath as name, with its output path and status.
+        digest is the SHA-256 digest of filepath (see file_digest), computed if not given.
+        """
+        stat = os.stat(filepath)
+        if digest is None:
+            digest = file_digest(filepath)
+        self._connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                 (name, stat.st_size, stat.st_mtime_ns, digest, status, output))
+        self._commit_later()
+
+    def commit(self):
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def _commit_later(self):
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.commit()
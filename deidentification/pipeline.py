@@ -0,0 +1,122 @@
+import queue
+import threading
+
+# Time between two checks of the pipeline stop, in seconds
+_POLL_INTERVAL = 0.1
+
+# End of the items of a queue
+_END = object()
+
+
+class _PipelineStopped(Exception):
+    pass
+
+
+def _put(item_queue, entry, stop):
+    while not stop.is_set():
+        try:
+            item_queue.put(entry, timeout=_POLL_INTERVAL)
+            return
+        except queue.Full:
+            pass
+    raise _PipelineStopped()
+
+
+def _get(item_queue, stop):
+    while not stop.is_set():
+        try:
+            return item_queue.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    raise _PipelineStopped()
+
+
+def _start_feeder(items, out_queue, stop):
+    def feed():
+        try:
+            for item in items:
+                _put(out_queue, (item, None, None), stop)
+            _put(out_queue, _END, stop)
+        except _PipelineStopped:
+            pass
+
+    thread = threading.Thread(target=feed, daemon=True)
+    thread.start()
+    return [thread]
+
+
+def _start_stage(function, threads, in_queue, out_queue, stop):
+    running = [threads]
+    lock = threading.Lock()
+
+    def run():
+        try:
+            while True:
+                entry = _get(in_queue, stop)
+                if entry is _END:
+                    # Other threads of the stage stop on it too
+                    _put(in_queue, _END, stop)
+                    break
+                item, value, error = entry
+                if error is None:
+                    try:
+                        value = function(item, value)
+                    except Exception as e:
+                        value, error = None, e
+                _put(out_queue, (item, value, error), stop)
+        except _PipelineStopped:
+            pass
+        finally:
+            with lock:
+                running[0] -= 1
+                is_last = running[0] == 0
+            if is_last:
+                try:
+                    _put(out_queue, _END, stop)
+                except _PipelineStopped:
+                    pass
+
+    stage_threads = [threading.Thread(target=run, daemon=True) for _ in range(threads)]
+    for thread in stage_threads:
+        thread.start()
+    return stage_threads
+
+
+def run_pipeline(items, stages, queue_depth=16):
+    """
+    Runs the stages on items, overlapping them: each stage runs in its own
+    threads, and gives its results to the next one through a queue of
+    queue_depth items. A stage waits when its output queue is full, which
+    bounds the number of items (and the memory) in the pipeline.
+
+    Parameters
+    ----------
+    items : iterable
+    stages : list
+        (function, number of threads) of the stages. The first function is
+        called with (item, None), the next ones with (item, result of the
+        previous function).
+    queue_depth : int
+
+    Yields
+    ------
+    (item, result of the last function, exception or None)
+        An item whose processing raised an exception is not given to the
+        next stages. Items are yielded as they are processed, not in order.
+        Stages are stopped when the generator is closed.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_depth) for _ in range(len(stages) + 1)]
+    threads = _start_feeder(items, queues[0], stop)
+    for i, (function, stage_threads) in enumerate(stages):
+        threads += _start_stage(function, stage_threads, queues[i], queues[i + 1], stop)
+    try:
+        while True:
+            entry = queues[-1].get()
+            if entry is _END:
+                break
+            yield entry
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,97 @@
+import hashlib
+import os
+
+from deidentification import DeidentificationError, __version__
+from deidentification.config import load_config_profile
+from deidentification.rules import RuleTable
+
+
+def resolve_tags_config(config_profile=None, tags_to_keep=None, tags_to_delete=None, anonymous=False):
+    """Load config if no conflict with other params.
+
+    Parameters
+    ----------
+    config_profile : str
+    tags_to_keep : list
+    tags_to_delete : list
+    anonymous : bool
+
+    Returns
+    -------
+    dict
+        Action to do on tags (keep ('K'), remove ('X'), ...) and optionally
+        their private creators.
+
+    Raises
+    ------
+    DeidentificationError
+        In case of config profile AND tags_to_keep/tags_to_delete defined
+    """
+    tags_config = {}
+    if config_profile:
+        if tags_to_keep or tags_to_delete:
+            raise DeidentificationError('Both tags_to_keep/tags_to_delete and config_profile have been specified.')
+
+        tags_config = load_config_profile(config_profile, anonymous)
+    else:
+        if tags_to_keep:
+            tags_config.update({k: {'action': 'K'} for k in tags_to_keep})
+        if tags_to_delete:
+            tags_config.update({x: {'action': 'X'} for x in tags_to_delete})
+    return tags_config
+
+
+def get_profile_name(config_profile):
+    """Only keep filename in case of config_profile path."""
+    if config_profile:
+        return os.path.basename(config_profile).rsplit('.', 1)[0]
+    return config_profile
+
+
+class AnonymizationPlan():
+
+    """
+    Deidentification configuration resolved once, to be used for many files.
+
+    The configuration profile is loaded and the deidentification rules are
+    compiled when the plan is created. A plan can be given to anonymize_file,
+    Anonymizer and the check functions of the anonymizer module, and can be
+    sent to other processes.
+
+    Example
+    -------
+    plan = AnonymizationPlan(config_profile='data_sharing',
+                             forced_values={(0x0010, 0x0010): '0001XXXX'})
+    for dicom_file in dicom_files:
+        anonymize_file(dicom_file, output_folder, plan=plan)
+    """
+
+    def __init__(self, tags_to_keep=None, tags_to_delete=None, forced_values=None,
+                 config_profile=None, anonymous=False):
+        """
+        tags_to_keep, tags_to_delete: lists of tags to keep or delete, they
+        cannot be used with config_profile.
+        forced_values: a dict of values forced for tags.
+        config_profile: name or path of a configuration profile.
+        anonymous: do not give file names in error messages.
+        """
+        self.tags_config = resolve_tags_config(config_profile, tags_to_keep,
+                                               tags_to_delete, anonymous)
+        self.forced_values = forced_values or {}
+        self.config_profile = config_profile
+        self.profile_name = get_profile_name(config_profile)
+        self.anonymous = anonymous
+        self.rules = RuleTable(self.tags_config, self.forced_values)
+
+    @property
+    def fingerprint(self):
+        """Hash of the plan settings and of the version of the tool, which
+        changes if files may be deidentified differently."""
+        settings = repr((sorted(self.tags_config.items()),
+                         sorted(self.forced_values.items(), key=repr),
+                         self.profile_name, __version__))
+        return hashlib.sha256(settings.encode()).hexdigest()
+
+    def __repr__(self):
+        return (f'AnonymizationPlan(config_profile={self.config_profile!r}, '
+                f'{len(self.tags_config)} tag rules, {len(self.forced_values)} forced values)')
@@ -0,0 +1,143 @@
+import csv
+import io
+import json
+import os
+import threading
+from pathlib import Path
+
+from deidentification import DeidentificationError
+
+REPORT_FILENAME = 'deidentification_report.csv'
+REPORT_HEADER = ['input DICOM filename', 'state', 'modality', 'SOP Class UID', 'Series Description', 'Image Type']
+REPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+def report_filename(filepath):
+    """Returns the name of filepath in the report: its folder and file names."""
+    filepath = Path(filepath)
+    return os.path.join(filepath.parent.name, filepath.name)
+
+
+def append_report_rows(report_path, rows):
+    """
+    Appends rows to the report_path CSV report, writing its header if it does not exist.
+    """
+    report = DeidentificationReport(report_path)
+    report.add_rows(rows)
+    report.close()
+
+
+class ReportRows():
+
+    """
+    Collects report rows in memory, to be added to a DeidentificationReport
+    by another process.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, row):
+        self.rows.append(row)
+
+
+class DeidentificationReport():
+
+    """
+    Deidentification report sink.
+
+    Rows are lists of report values (strings, None or lists of strings), in
+    REPORT_HEADER order.
+
+    Rows are buffered and written by batches of batch_size rows, each batch
+    with a single write call per format. Rows can be added by concurrent
+    threads. The CSV report is written in report_path, other formats next to it
+    with their own extension (deidentification_report.jsonl, ...). Parquet
+    format needs pyarrow and is written when the report is closed.
+    """
+
+    def __init__(self, report_path, formats=('csv',), batch_size=1000):
+        unknown_formats = set(formats) - set(REPORT_FORMATS)
+        if unknown_formats:
+            raise DeidentificationError(f'Report formats not handled: {", ".join(sorted(unknown_formats))}.')
+        if 'parquet' in formats:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise DeidentificationError('pyarrow is needed to write the report in parquet format.')
+        self.report_path = report_path
+        self.formats = tuple(formats)
+        self.batch_size = batch_size
+        self._buffer = []
+        self._parquet_rows = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def path(self, report_format):
+        """Returns the path of the report in report_format."""
+        if report_format == 'csv':
+            return self.report_path
+        return os.path.splitext(self.report_path)[0] + '.' + report_format
+
+    def add(self, row):
+        self.add_rows([row])
+
+    def add_rows(self, rows):
+        with self._lock:
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def discard(self):
+        """Drops the rows not written yet."""
+        with self._lock:
+            self._buffer = []
+            self._parquet_rows = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._parquet_rows:
+                self._write_parquet(self._parquet_rows)
+                self._parquet_rows = []
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        os.makedirs(os.path.dirname(os.path.abspath(self.report_path)), exist_ok=True)
+        if 'csv' in self.formats:
+            self._write_csv(rows)
+        if 'jsonl' in self.formats:
+            lines = ''.join(json.dumps(dict(zip(REPORT_HEADER, row))) + '\n' for row in rows)
+            with open(self.path('jsonl'), 'a') as report_file:
+                report_file.write(lines)
+        if 'parquet' in self.formats:
+            self._parquet_rows.extend(rows)
+
+    def _write_csv(self, rows):
+        report_path = self.path('csv')
+        content = io.StringIO()
+        csv_writer = csv.writer(content)
+        if not os.path.exists(report_path):
+            csv_writer.writerow(REPORT_HEADER)
+        csv_writer.writerows(rows)
+        with open(report_path, 'a') as report_file:
+            report_file.write(content.getvalue())
+
+    def _write_parquet(self, rows):
+        import pyarrow
+        import pyarrow.parquet
+
+        columns = {name: [None if v is None else str(v) for v in values]
+                   for name, values in zip(REPORT_HEADER, zip(*rows))}
+        pyarrow.parquet.write_table(pyarrow.table(columns), self.path('parquet'))
@@ -0,0 +1,194 @@
+from bisect import bisect_right
+from functools import lru_cache
+
+from deidentification import tag_lists
+
+
+def _compile_ranges(ranges):
+    """Compile tag ranges in an interval index keyed by group.
+
+    Parameters
+    ----------
+    ranges : list
+        ((group_min, element_min), (group_max, element_max), action) items,
+        the first matching range having priority.
+
+    Returns
+    -------
+    dict
+        {group: (element_starts, actions)} where element_starts are sorted and
+        actions[i] applies to elements from element_starts[i] to element_starts[i + 1] - 1.
+        Overlapping ranges are resolved at compile time.
+    """
+    group_intervals = {}
+    for (group_min, element_min), (group_max, element_max), action in ranges:
+        for group in range(group_min, group_max + 1):
+            group_intervals.setdefault(group, []).append((element_min, element_max, action))
+
+    index = {}
+    for group, intervals in group_intervals.items():
+        bounds = sorted({b for element_min, element_max, _ in intervals
+                         for b in (element_min, element_max + 1)})
+        actions = []
+        for start in bounds:
+            actions.append(next((action for element_min, element_max, action in intervals
+                                 if element_min <= start <= element_max), ''))
+        index[group] = (bounds, actions)
+    return index
+
+
+@lru_cache(maxsize=None)
+def _confidentiality_profile_rules():
+    """Returns the compiled (exact actions, range index) of the confidentiality profile."""
+    exact = {tag: value['profile'][0] for tag, value in tag_lists.conf_profile.items()}
+    ranges = _compile_ranges([(tag_min, tag_max, value['profile'][0])
+                              for (tag_min, tag_max), value in tag_lists.conf_profile_range.items()])
+    return exact, ranges
+
+
+@lru_cache(maxsize=None)
+def _safe_private_rules():
+    """Returns safe private attributes as {private creator: frozenset((group, block))}."""
+    return {private_creator: frozenset(blocks)
+            for private_creator, blocks in tag_lists.safe_private_attributes.items()}
+
+
+def _private_creators_set(private_creators):
+    if not private_creators:
+        return None
+    if isinstance(private_creators, str):
+        return frozenset([private_creators])
+    return frozenset(private_creators)
+
+
+# Actions of compiled rules (see RuleTable.element_action), besides the
+# confidentiality profile actions ('X', 'Z', 'D', 'U', 'K')
+FORCE = 'F'
+# Private element without private creator, removed without being tracked
+REMOVE = 'R'
+
+
+def is_private_creator(group, element):
+    """
+    Returns true if the (group, element) tag is a private creator and false otherwise.
+    """
+    return group % 2 != 0 and 0x0000 < element < 0x00ff
+
+
+class RuleTable():
+
+    """
+    Deidentification rules resolved once for a configuration.
+
+    It gathers forced values, the user tags configuration, the DICOM
+    confidentiality profile and the safe private attributes. The
+    confidentiality profile is compiled once per process in an exact-match
+    dict and an interval index of element ranges keyed by group. The action
+    resolved for a data element is cached in the table, so that each tag of
+    a series is resolved once (see element_action).
+    """
+
+    def __init__(self, tags_config=None, forced_values=None):
+        """
+        tags_config: a dict with action to do on tags (keep ('K'), remove ('X'), ...)
+        and optionally their private creators.
+        forced_values: a dict of values forced for tags.
+        """
+        self.forced_values = forced_values or {}
+        # {tag: (action, frozenset of private creators or None)}
+        self.config = {tag: (rule['action'], _private_creators_set(rule.get('private_creator')))
+                       for tag, rule in (tags_config or {}).items()}
+        self._profile, self._profile_ranges = _confidentiality_profile_rules()
+        self.safe_private = _safe_private_rules()
+        # {(group, element, private creator): action}
+        self._actions = {}
+
+    def __getstate__(self):
+        # Compiled profile rules are shared by the tables of a process
+        state = self.__dict__.copy()
+        for name in ('_profile', '_profile_ranges', 'safe_private'):
+            del state[name]
+        state['_actions'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._profile, self._profile_ranges = _confidentiality_profile_rules()
+        self.safe_private = _safe_private_rules()
+
+    def profile_action(self, group, element):
+        """
+        Find (group, element) in confidentiality profiles and return action expected if found.
+        """
+        action = self._profile.get((group, element))
+        if action is not None:
+            return action
+
+        group_ranges = self._profile_ranges.get(group)
+        if group_ranges is None:
+            return ''
+        element_starts, actions = group_ranges
+        index = bisect_right(element_starts, element) - 1
+        if index < 0:
+            return ''
+        return actions[index]
+
+    def element_action(self, group, element, private_creator=None):
+        """
+        Returns the action to apply to the (group, element) data element.
+
+        Parameters
+        ----------
+        group : int
+        element : int
+        private_creator : str
+            The value of the private creator of a private data element, None
+            if the data element is public or if its private creator is missing.
+
+        Returns
+        -------
+        str
+            FORCE, REMOVE, a confidentiality profile action or '' if the data
+            element is kept untracked.
+        """
+        key = (group, element, private_creator)
+        action = self._actions.get(key)
+        if action is None:
+            action = self._actions[key] = self._resolve_action(group, element, private_creator)
+        return action
+
+    def _resolve_action(self, group, element, private_creator):
+        tag = (group, element)
+        # Check if the value must be forced
+        if tag in self.forced_values:
+            return FORCE
+
+        is_private = group % 2 != 0
+        is_creator = is_private_creator(group, element)
+        # Check if the data element is configured, for its private creator if any
+        config_rule = self.config.get(tag)
+        if config_rule is not None:
+            action, private_creators = config_rule
+            if not is_private or not private_creators or is_creator or private_creator in private_creators:
+                return action
+
+        # Check if the data element is in the DICOM part 15/annex E tag list
+        action = self.profile_action(group, element)
+        if action or not is_private:
+            return action
+
+        if is_creator:
+            return 'K'
+        if private_creator is None:
+            return REMOVE
+        # Check if the private creator is configured
+        private_creator_rule = self.config.get((group, element >> 8))
+        if (private_creator_rule is not None
+                and private_creator_rule[1]
+                and private_creator in private_creator_rule[1]):
+            return private_creator_rule[0]
+        # Check if the data element is in the safe private attributes list
+        safe_blocks = self.safe_private.get(private_creator)
+        if safe_blocks is None or (group, element & 0x00ff) not in safe_blocks:
+            return 'X'
+        return ''
@@ -1,13 +1,19 @@
 import csv
+import io
 
 from deidentification import CONFIG_FOLDER
-from deidentification.config import tag_to_tuple
+from deidentification.config import load_cached, tag_to_tuple
 
+# conf_profile, conf_profile_range and safe_private_attributes are loaded
+# on first access, once per process (see config.load_cached)
 conf_profile_path = CONFIG_FOLDER.joinpath('confidentiality_profiles.tsv')
-conf_profile = {}
-conf_profile_range = {}
-with open(conf_profile_path) as tsv_file:
-    tsv_reader = csv.reader(tsv_file, delimiter='\t')
+safe_private_path = CONFIG_FOLDER.joinpath('safe_private.tsv')
+
+
+def _parse_conf_profile(content):
+    conf_profile = {}
+    conf_profile_range = {}
+    tsv_reader = csv.reader(io.StringIO(content), delimiter='\t')
     header = next(tsv_reader)
     for d in tsv_reader:
         if 'X' not in d[0]:
@@ -18,12 +24,24 @@ with open(conf_profile_path) as tsv_file:
                 tag_to_tuple(d[0].replace('X', 'F'))
             )
             conf_profile_range[range_key] = {'name': d[2], 'profile': d[1]}
+    return conf_profile, conf_profile_range
 
-safe_private_path = CONFIG_FOLDER.joinpath('safe_private.tsv')
-safe_private_attributes = {}
-with open(safe_private_path) as tsv_file:
-    tsv_reader = csv.reader(tsv_file, delimiter='\t')
+
+def _parse_safe_private(content):
+    safe_private_attributes = {}
+    tsv_reader = csv.reader(io.StringIO(content), delimiter='\t')
     header = next(tsv_reader)
     for d in tsv_reader:
         safe_private_attributes.setdefault(d[1], [])
         safe_private_attributes[d[1]].append(tag_to_tuple(d[0]))
+    return safe_private_attributes
+
+
+def __getattr__(name):
+    if name == 'conf_profile':
+        return load_cached(conf_profile_path, _parse_conf_profile)[0]
+    if name == 'conf_profile_range':
+        return load_cached(conf_profile_path, _parse_conf_profile)[1]
+    if name == 'safe_private_attributes':
+        return load_cached(safe_private_path, _parse_safe_private)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
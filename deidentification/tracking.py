@@ -0,0 +1,106 @@
+import hashlib
+from collections.abc import MutableSequence
+
+from deidentification import DeidentificationError
+
+# Tracking modes of the values of deidentified data elements (see ValueTracker)
+TRACK_NONE = 'none'
+TRACK_DIGEST = 'digest'
+TRACK_FULL = 'full'
+TRACKING_MODES = (TRACK_NONE, TRACK_DIGEST, TRACK_FULL)
+
+# Digest of the original value of removed data elements, which is not needed
+# to know that they should be removed
+REMOVED_DIGEST = b''
+
+
+def _canonical_value(value):
+    """
+    Returns bytes of value such that values equal for the deidentification
+    check (a str and a PersonName, an int and a DSfloat, a list and a
+    MultiValue...) have the same bytes.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return b'b' + bytes(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = float(value)
+        if number.is_integer():
+            return b'n' + str(int(value)).encode()
+        return b'n' + repr(number).encode()
+    if isinstance(value, (list, tuple, MutableSequence)):
+        return b'[' + b','.join(hashlib.blake2b(_canonical_value(item), digest_size=16).digest()
+                                for item in value) + b']'
+    return b's' + str(value).encode('utf-8', 'surrogateescape')
+
+
+def value_digest(value):
+    """Returns the digest of a data element value (see _canonical_value)."""
+    return hashlib.blake2b(_canonical_value(value), digest_size=16).digest()
+
+
+class ValueTracker():
+
+    """
+    Original and expected output values of the data elements changed or
+    removed by the deidentification of a dataset, as {tag: value} dicts.
+
+    A deidentified dataset is checked by deidentifying it again: it passes if
+    each tracked original value is equal to its output value.
+
+    - TRACK_FULL keeps the values, for debugging.
+    - TRACK_DIGEST keeps digests of the values, and the expected output
+      values of the data elements which fail the check only.
+    - TRACK_NONE keeps nothing, for deidentification only.
+    """
+
+    def __init__(self, mode=TRACK_FULL):
+        if mode not in TRACKING_MODES:
+            raise DeidentificationError(f'Tracking mode not recognized: {mode}')
+        self.mode = mode
+        self.enabled = mode != TRACK_NONE
+        # Original values of removed data elements are needed in TRACK_FULL mode only
+        self.keep_values = mode == TRACK_FULL
+        self.original = {}
+        self.output = {}
+        self._expected = {}
+
+    def removed(self, tag, value=None):
+        """Tracks the removal of a data element, with its original value in TRACK_FULL mode."""
+        if self.keep_values:
+            self.original[tag] = value
+        elif self.enabled:
+            self.original[tag] = REMOVED_DIGEST
+
+    def replaced(self, tag, original, output):
+        """Tracks a data element kept with its original value or replaced with output."""
+        if self.keep_values:
+            self.original[tag] = original
+            self.output[tag] = output
+        elif self.enabled:
+            # Sequences are cleaned in place, their original and output values are the same
+            original_digest = value_digest(original)
+            output_digest = original_digest if output is original else value_digest(output)
+            self.original[tag] = original_digest
+            self.output[tag] = output_digest
+            if output_digest != original_digest:
+                self._expected[tag] = output
+
+    @property
+    def passed(self):
+        return self.original == self.output
+
+    def failures(self):
+        """
+        Returns the data elements which are not deidentified, as {tag: reason}.
+        Reasons do not contain the original values.
+        """
+        failures = {}
+        for tag, value in self.original.items():
+            if tag not in self.output:
+                failures[tag] = 'should be removed'
+            elif self.output[tag] != value:
+                expected = repr(self._expected.get(tag, self.output[tag]))
+                if len(expected) > 64:
+                    expected = expected[:61] + '...'
+                failures[tag] = f'should be {expected}'
+        return failures
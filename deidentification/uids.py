@@ -0,0 +1,146 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from uuid import UUID
+
+# Maximum number of UIDs kept by default in a UIDCache
+DEFAULT_UID_CACHE_SIZE = 65536
+
+
+def _generate_uuid(value):
+    """
+    Generate a (not) random UUID based on the SHA512 hash of the input value.
+
+    We need reproducible UUIDs, not random UUIDs, yet the best course of
+    action is probably to apply Section 4.4 of `RFC 4122`_ which specifies
+    random UUIDs:
+    * The two most significant bits (bits 6 and 7) of the
+      clock_seq_hi_and_reserved must be set to zero and one, respectively.
+    * The four most significant bits (bits 12 through 15) of the
+      time_hi_and_version field must be set to 0, 0, 1, 0.
+
+    See also ISO/IEC 9834-8 / `ITU-T X.667``_.
+
+    .. _RFC 4122: https://www.rfc-editor.org/info/rfc4122
+    .. _ITU-T X.667: https://www.itu.int/rec/T-REC-X.667
+
+    """
+    u = hashlib.sha512(str(value).encode('utf-8')).digest()  # 64 bytes (512 bits) of SHA-512 hash
+
+    u = bytearray(u[:16])  # keep first 16 bytes (128 bits) for UUID
+
+    # comply with section 4.4 of RFC 4122, although the UUID is not random
+    u[6] &= 0b01001111  # set bits 12, 13, 15 of time_hi_and_version to 0
+    u[6] |= 0b01000000  # set bits 14 of time_hi_and_version to 1
+    u[8] &= 0b10111111  # set bit 6 of clock_seq_hi_and_reserved to 0
+    u[8] |= 0b10000000  # set bit 7 of clock_seq_hi_and_reserved to 1
+
+    return UUID(bytes=bytes(u))
+
+
+def _generate_dicom_uid(value):
+    """
+    Generate a DICOM UID based on a reproducible UUID hashed from the input value.
+
+    See `PS 3.5 Sect B2`_:
+
+        [ISO/IEC 9834-8] / [ITU-T X.667] defines a method by which a UID
+        may be constructed from the root "2.25." followed by a decimal
+        representation of a Universally Unique Identifier (UUID). That
+        decimal representation treats the 128 bit UUID as an integer, and
+        may thus be up to 39 digits long (leading zeros must be suppressed).
+
+    .. _PS 3.5 Sect B2: https://dicom.nema.org/medical/dicom/current/output/chtml/part05/sect_B.2.html
+
+    """
+    return "2.25." + str(_generate_uuid(value).int)
+
+
+class UIDCache():
+
+    """
+    Bounded LRU cache of the UIDs generated by _generate_dicom_uid.
+
+    The same Study, Series or Frame of Reference UIDs are found in all the
+    files of a series: a cache is shared by the files deidentified in one
+    anonymize() call, so that they are hashed once. Hits and misses are
+    counted to measure it.
+
+    UIDs are generated from the string of the input value, which is the
+    cache key. Generated UIDs do not depend on the cache, it only avoids to
+    hash values again. The cache is kept in memory only: it maps original
+    UIDs to deidentified UIDs, and would allow to reidentify the output.
+    """
+
+    def __init__(self, maxsize=DEFAULT_UID_CACHE_SIZE, track_updates=False):
+        """
+        maxsize: maximum number of UIDs in the cache, the least recently used
+        ones are dropped first.
+        track_updates: keep UIDs generated since the last call to take_updates.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._uids = OrderedDict()
+        self._updates = {} if track_updates else None
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        """Returns the deidentified UID of value."""
+        key = str(value)
+        with self._lock:
+            uid = self._uids.get(key)
+            if uid is not None:
+                self.hits += 1
+                self._uids.move_to_end(key)
+                return uid
+            self.misses += 1
+        uid = _generate_dicom_uid(key)
+        with self._lock:
+            self._put(key, uid)
+            if self._updates is not None:
+                self._updates[key] = uid
+        return uid
+
+    def __len__(self):
+        return len(self._uids)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._uids), 'maxsize': self.maxsize}
+
+    def items(self):
+        with self._lock:
+            return list(self._uids.items())
+
+    def update(self, uids):
+        """Adds {value: UID} items to the cache, without counting them as misses."""
+        with self._lock:
+            for key, uid in dict(uids).items():
+                self._put(key, uid)
+
+    def take_updates(self):
+        """
+        Returns (hits, misses, {value: UID} generated) since the last call,
+        to be merged in another cache with merge_updates.
+        """
+        with self._lock:
+            updates = (self.hits, self.misses, self._updates or {})
+            self.hits = self.misses = 0
+            if self._updates is not None:
+                self._updates = {}
+        return updates
+
+    def merge_updates(self, hits, misses, uids):
+        """Merges the counters and UIDs of another cache (see take_updates)."""
+        self.update(uids)
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _put(self, key, uid):
+        self._uids[key] = uid
+        self._uids.move_to_end(key)
+        while len(self._uids) > self.maxsize:
+            self._uids.popitem(last=False)
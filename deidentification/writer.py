@@ -0,0 +1,245 @@
+import os
+import stat
+import struct
+import tempfile
+
+import pydicom
+from pydicom.charset import default_encoding
+from pydicom.datadict import dictionary_VR
+from pydicom.dataelem import RawDataElement
+from pydicom.filebase import DicomFileLike
+from pydicom.filereader import data_element_offset_to_value
+from pydicom.filewriter import write_dataset
+from pydicom.tag import Tag
+
+from deidentification.dicom import PIXEL_DATA_TAGS
+
+# Size of the chunks used to copy data element values between files
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Value representations of bulk data, copied as is in the output when kept
+BULK_DATA_VRS = frozenset(['OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'UN'])
+
+_PIXEL_DATA_TAGS = frozenset(Tag(tag) for tag in PIXEL_DATA_TAGS)
+
+ITEM_TAG = (0xFFFE, 0xE000)
+SEQUENCE_DELIMITER_TAG = (0xFFFE, 0xE0DD)
+
+
+class ElementRange():
+
+    """
+    Location of an encoded data element (header and value) in a DICOM file.
+    """
+
+    def __init__(self, tag, filename, offset, length):
+        self.tag = Tag(tag)
+        self.filename = filename
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return f'ElementRange({self.tag}, {self.filename!r}, {self.offset}, {self.length})'
+
+
+def _undefined_length_value_end(fp, value_offset, is_little_endian):
+    """
+    Returns the position following the sequence delimiter of an encapsulated value,
+    skipping its items without reading them.
+    """
+    item_header = struct.Struct(('<' if is_little_endian else '>') + 'HHL')
+    fp.seek(value_offset)
+    while True:
+        header = fp.read(item_header.size)
+        if len(header) < item_header.size:
+            raise EOFError('Sequence delimiter of encapsulated value not found.')
+        group, element, length = item_header.unpack(header)
+        if (group, element) == SEQUENCE_DELIMITER_TAG:
+            return fp.tell()
+        if (group, element) != ITEM_TAG or length == 0xFFFFFFFF:
+            raise ValueError('Encapsulated value items could not be parsed.')
+        fp.seek(length, os.SEEK_CUR)
+
+
+def detach_deferred_element(ds, tag):
+    """
+    Removes a data element whose value has not been read (see the defer_size
+    parameter of pydicom.dcmread) from ds, without reading it.
+
+    Returns its ElementRange in the source file, or None if the element is not
+    a deferred element which can be copied as is in a file written like ds.
+    """
+    tag = Tag(tag)
+    # Dataset.get_item would read the deferred value
+    raw_element = ds._dict.get(tag)
+    if not isinstance(raw_element, RawDataElement) or raw_element.value is not None:
+        return None
+    # A deferred sequence has to be deidentified
+    if raw_element.VR in (None, 'SQ', 'UN') and not is_bulk_data(tag, raw_element.VR):
+        return None
+    if (not isinstance(ds.filename, str)
+            or raw_element.is_implicit_VR != ds.is_implicit_VR
+            or raw_element.is_little_endian != ds.is_little_endian):
+        return None
+
+    offset = raw_element.value_tell - data_element_offset_to_value(raw_element.is_implicit_VR,
+                                                                   raw_element.VR)
+    if raw_element.length == 0xFFFFFFFF:
+        try:
+            with open(ds.filename, 'rb') as fp:
+                end = _undefined_length_value_end(fp, raw_element.value_tell,
+                                                  raw_element.is_little_endian)
+        except (OSError, EOFError, ValueError):
+            return None
+    else:
+        end = raw_element.value_tell + raw_element.length
+
+    del ds[tag]
+    return ElementRange(tag, ds.filename, offset, end - offset)
+
+
+def is_bulk_data(tag, vr):
+    """
+    Returns true if a raw data element of VR vr (None in implicit VR) is pixel
+    data or bulk data (see BULK_DATA_VRS), which is never a sequence.
+
+    Any other raw data element, deferred or not, may hold a sequence: pydicom
+    defers defined-length sequences larger than defer_size, implicit VR raw
+    elements have no VR, and UN values of sequence attributes are converted
+    to sequences.
+    """
+    if tag in _PIXEL_DATA_TAGS:
+        return True
+    if vr not in BULK_DATA_VRS:
+        return False
+    if vr == 'UN':
+        try:
+            return dictionary_VR(tag) != 'SQ'
+        except KeyError:
+            # Private or unknown tag, kept as UN by pydicom
+            return True
+    return True
+
+
+def detach_bulk_elements(ds):
+    """
+    Removes the deferred pixel data and bulk data (see BULK_DATA_VRS) elements
+    of ds, without reading them (see detach_deferred_element).
+
+    Returns their ElementRange, sorted by tag.
+    """
+    element_ranges = []
+    # Dataset.items would read the deferred values
+    for tag, raw_element in list(ds._dict.items()):
+        if not isinstance(raw_element, RawDataElement) or raw_element.value is not None:
+            continue
+        if is_bulk_data(tag, raw_element.VR):
+            element_range = detach_deferred_element(ds, tag)
+            if element_range is not None:
+                element_ranges.append(element_range)
+    return sorted(element_ranges, key=lambda element_range: element_range.tag)
+
+
+def copy_range(source, destination, offset, length, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Copies length bytes of the source file from offset to the current position of
+    the destination file, by chunks of chunk_size bytes. The copy is done by the
+    kernel (copy_file_range) when possible.
+    """
+    destination.flush()
+    destination_offset = destination.tell()
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                count = os.copy_file_range(source.fileno(), destination.fileno(),
+                                           min(chunk_size, length - copied),
+                                           offset + copied, destination_offset + copied)
+                if count == 0:
+                    break
+                copied += count
+        except (AttributeError, OSError, ValueError):
+            # Not a file on disk, or copy not supported between those files
+            pass
+        destination.seek(destination_offset + copied)
+
+    source.seek(offset + copied)
+    while copied < length:
+        chunk = source.read(min(chunk_size, length - copied))
+        if not chunk:
+            raise EOFError('Unexpected end of file during copy.')
+        destination.write(chunk)
+        copied += len(chunk)
+
+
+def _is_same_file(path, other_path):
+    try:
+        return os.path.samefile(path, other_path)
+    except OSError:
+        return False
+
+
+def dcmwrite_passthrough(fileout, ds, element_ranges):
+    """
+    Writes ds in fileout (path or file-like object) like pydicom.dcmwrite, with the
+    data elements of element_ranges (ElementRange or list of ElementRange, see
+    detach_deferred_element and detach_bulk_elements) copied as is from their
+    source file at their place, by chunks. Their values are never loaded in memory.
+
+    When fileout is the source file of element_ranges, ds is written in a
+    temporary file of the same folder which then replaces fileout, so that the
+    source is not truncated before its values are copied.
+    """
+    if isinstance(element_ranges, ElementRange):
+        element_ranges = [element_ranges]
+    element_ranges = sorted(element_ranges, key=lambda element_range: element_range.tag)
+
+    if not hasattr(fileout, 'write') and any(_is_same_file(fileout, element_range.filename)
+                                             for element_range in element_ranges):
+        fileout = os.fspath(fileout)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fileout)),
+                                         prefix=f'.{os.path.basename(fileout)}.')
+        os.close(fd)
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(fileout).st_mode))
+            dcmwrite_passthrough(temp_path, ds, element_ranges)
+            os.replace(temp_path, fileout)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return
+
+    # Elements following each copied element, up to the next one, are written after it
+    trailing_datasets = []
+    for index, element_range in enumerate(element_ranges):
+        next_tag = element_ranges[index + 1].tag if index + 1 < len(element_ranges) else None
+        trailing_ds = pydicom.Dataset()
+        for tag in [tag for tag in ds.keys()
+                    if tag > element_range.tag and (next_tag is None or tag < next_tag)]:
+            trailing_ds.add(ds[tag])
+            del ds[tag]
+        trailing_datasets.append(trailing_ds)
+
+    is_filename = not hasattr(fileout, 'write')
+    try:
+        pydicom.dcmwrite(fileout, ds)
+    finally:
+        for trailing_ds in trailing_datasets:
+            ds.update(trailing_ds)
+
+    destination = open(fileout, 'r+b') if is_filename else fileout
+    try:
+        destination.seek(0, os.SEEK_END)
+        fp = DicomFileLike(destination)
+        fp.is_little_endian = ds.is_little_endian
+        fp.is_implicit_VR = ds.is_implicit_VR
+        encoding = ds.get('SpecificCharacterSet', default_encoding)
+        for element_range, trailing_ds in zip(element_ranges, trailing_datasets):
+            with open(element_range.filename, 'rb') as source:
+                copy_range(source, destination, element_range.offset, element_range.length)
+            if trailing_ds:
+                write_dataset(fp, trailing_ds, encoding)
+    finally:
+        if is_filename:
+            destination.close()
@@ -3,7 +3,7 @@ import os
 from setuptools import find_packages, setup
 
 # Select appropriate modules
-modules = find_packages()
+modules = find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*'])
 
 release_info = locals()
 info_path = os.path.join(os.path.dirname(__file__), 'deidentification', 'info.py')
@@ -1,17 +1,25 @@
 import glob
+import json
 import os
 import os.path as osp
 import shutil
 import subprocess
 import tarfile
 import tempfile
+import zipfile
 
 import pydicom
 import pytest
 
-from deidentification import anonymizer
+from deidentification import DeidentificationError, anonymizer, dicom
 from deidentification.anonymizer import Anonymizer, AnonymizerError, anonymize
+from deidentification.archive import iter_archive_files
+from deidentification.audit import AuditSummary, SampleAudit
 from deidentification.config import load_config_profile
+from deidentification.dicom import MMAP_ENV
+from deidentification.manifest import Manifest
+from deidentification.plan import AnonymizationPlan
+from deidentification.uids import UIDCache
 
 from . import create_fake_config
 
@@ -161,6 +169,14 @@ def test_anonymizer_data_sharing_profile(dicom_path):
     assert ds.get((0x2005, 0x101D))
 
 
+def test_anonymizer_parsed_dataset(dicom_path):
+    ds = pydicom.read_file(dicom_path)
+    # The input file is not read again when its dataset is given
+    a = anonymizer.Anonymizer('not_existing_file', path_ano(dicom_path), dataset=ds)
+    a.run_ano()
+    assert not pydicom.read_file(path_ano(dicom_path)).get((0x0008, 0x0032))
+
+
 def test_anonymizer_not_file(dicom_archives_path):
     with pytest.raises(anonymizer.AnonymizerError, match=r".*not a DICOM file.*{}".format(dicom_archives_path)):
         _ = anonymizer.Anonymizer(dicom_archives_path, path_ano(dicom_archives_path))
@@ -186,11 +202,52 @@ def test_anonymize_data_sharing_profile(dicom_path):
     assert osp.basename(dicom_path) in os.listdir(OUTPUT_DIR)
 
 
+def test_anonymize_plan(dicom_path, monkeypatch):
+    plan = AnonymizationPlan(config_profile='data_sharing',
+                             forced_values={(0x0010, 0x0010): 'SUBJECT'})
+    # The profile is not loaded again when a plan is given
+    monkeypatch.setattr('deidentification.plan.load_config_profile', None)
+    anonymizer.anonymize_file(dicom_path, OUTPUT_DIR, plan=plan)
+    ds = pydicom.read_file(osp.join(OUTPUT_DIR, osp.basename(dicom_path)))
+    assert ds.PatientName == 'SUBJECT'
+    assert ds.get((0x2005, 0x101D))
+    assert ds.DeidentificationMethod.endswith('data_sharing')
+    assert anonymizer.check_anonymize(OUTPUT_DIR, plan=plan)
+
+
+def test_anonymization_plan_conflict():
+    with pytest.raises(DeidentificationError, match='Both tags_to_keep/tags_to_delete and config_profile'):
+        AnonymizationPlan(tags_to_keep=[(0x0010, 0x0010)], config_profile='data_sharing')
+
+
 def test_anonymize_archive_basic(dicom_archives_path):
     anonymize(dicom_archives_path, path_ano(dicom_archives_path))
     assert osp.exists(path_ano(dicom_archives_path))
 
 
+def _archive_files(archive_path):
+    with tarfile.open(archive_path) as tar:
+        return {member.name: tar.extractfile(member).read()
+                for member in tar.getmembers() if member.isfile()}
+
+
+def test_anonymize_archive_streaming(dicom_archives_path):
+    output_streaming = path_ano(dicom_archives_path).replace('_ano', '_ano_streaming')
+    try:
+        anonymize(dicom_archives_path, path_ano(dicom_archives_path))
+        anonymize(dicom_archives_path, output_streaming, streaming=True)
+        assert _archive_files(output_streaming) == _archive_files(path_ano(dicom_archives_path))
+    finally:
+        if osp.exists(output_streaming):
+            os.remove(output_streaming)
+
+
+def test_anonymize_bad_archive_streaming(dicom_bad_archives_path):
+    with pytest.raises(AnonymizerError):
+        anonymize(dicom_bad_archives_path, path_ano(dicom_bad_archives_path), streaming=True)
+    assert not osp.exists(path_ano(dicom_bad_archives_path))
+
+
 def test_anonymize_bad_archive_basic(dicom_bad_archives_path):
     with pytest.raises(AnonymizerError):
         anonymize(dicom_bad_archives_path, path_ano(dicom_bad_archives_path))
@@ -290,6 +347,50 @@ def test_anonymize_private_creator_tree(dicom_path):
     assert not ds[(0x3030, 0x1001)][0].get((0x3035, 1011))
 
 
+def test_anonymizer_tracking(dicom_path, tmp_path):
+    dicom_out = str(tmp_path / 'out.dcm')
+    anon = Anonymizer(dicom_path, dicom_out)
+    anon.run_ano()
+    assert anon.originalDict == anon.outputDict == {}
+    # Values are tracked on check, without output or once anonymized
+    assert not Anonymizer(dicom_path, '').runCheck()
+    assert Anonymizer(dicom_out, dicom_out + '_2').runCheck()
+
+    anon = Anonymizer(dicom_path, '', header_only=True)
+    assert not anon.runCheck()
+    full = Anonymizer(dicom_path, '', header_only=True, tracking='full')
+    assert not full.runCheck()
+    assert anon.originalDict.keys() == full.originalDict.keys()
+    assert anon.check_failures() == full.check_failures()
+    assert Anonymizer(dicom_out, '', header_only=True).runCheck()
+
+
+def test_anonymize_private_creator_blocks(dicom_path, tmp_path):
+    # Private creators are resolved per (group, block), after their own action
+    ds = pydicom.read_file(osp.abspath(dicom_path))
+    ds.private_block(0x0019, 'SIEMENS MR HEADER', create=True).add_new(0x0c, 'DS', '1000')
+    ds.private_block(0x0021, 'SIEMENS MR HEADER', create=True).add_new(0x0c, 'DS', '1000')
+    ds.private_block(0x0023, 'Removed creator', create=True).add_new(0x11, 'SH', 'Orphan')
+    dicom_in = str(tmp_path / 'in.dcm')
+    ds.save_as(dicom_in)
+
+    tags_config = {
+        (0x0021, 0x100c): {'action': 'K', 'private_creator': 'SIEMENS MR HEADER'},
+        (0x0023, 0x0010): {'action': 'X'},
+    }
+    dicom_out = str(tmp_path / 'out.dcm')
+    anon = Anonymizer(dicom_in, dicom_out, tags_config, tracking='full')
+    anon.run_ano()
+
+    ds = pydicom.read_file(dicom_out)
+    assert ds[(0x0019, 0x100c)].value == 1000
+    assert ds[(0x0021, 0x100c)].value == 1000
+    assert (0x0023, 0x0010) not in ds
+    assert (0x0023, 0x1011) not in ds
+    assert 0x00230010 in anon.originalDict
+    assert 0x00231011 not in anon.originalDict
+
+
 def test_ano_several_private_creator_name(dicom_path):
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
@@ -336,6 +437,27 @@ def test_anonymize_non_imaging_dicom(dicom_non_imaging_archives_path):
     
     assert len(files_in_tar) == 1 and files_in_tar[0] == 'deidentification_report.csv'
 
+
+def test_anonymize_non_imaging_dicom_streaming(dicom_non_imaging_archives_path):
+    anonymize(dicom_non_imaging_archives_path, path_ano(dicom_non_imaging_archives_path),
+              streaming=True)
+    assert list(_archive_files(path_ano(dicom_non_imaging_archives_path))) == ['deidentification_report.csv']
+
+
+def test_anonymize_archive_streaming_outside_root(tmp_path):
+    # Members outside of the archive root are not written outside of the scratch folder
+    archive_path = str(tmp_path / 'input.zip')
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        archive.write(osp.join(DICOM_DATA_DIR, 'IM04'), 'IM04')
+        archive.writestr('../../evil', b'not a DICOM file')
+    (tmp_path / 'scratch').mkdir()
+    anonymize(archive_path, str(tmp_path / 'output.tar.gz'), streaming=True, error_no_dicom=False,
+              tempdir_prefix=str(tmp_path / 'scratch' / 'wip'))
+    assert not (tmp_path / 'evil').exists() and not (tmp_path / 'scratch' / 'evil').exists()
+    assert os.listdir(tmp_path / 'scratch') == []
+    assert sorted(_archive_files(str(tmp_path / 'output.tar.gz'))) == ['IM04']
+
+
 def test_anonymize_non_dicom_w_err(dicom_with_other):
     dicom_folder, tmp_folder = dicom_with_other
     with pytest.raises(anonymizer.AnonymizerError, match=f".*not a DICOM file.*{dicom_folder}.*"):
@@ -361,6 +483,107 @@ def test_anonymize_non_dicom_wo_err(dicom_with_other):
     anonymize(DICOM_DATA_DIR, tmp_folder, error_no_dicom=False)
 
 
+@pytest.fixture
+def dicom_folder_tree():
+    # Folder tree of imaging and non-imaging DICOM files
+    tmp_folder = tempfile.mkdtemp()
+    ds = pydicom.read_file(osp.join(DICOM_DATA_DIR, 'IM04'))
+    for series in ('series1', 'series2'):
+        os.makedirs(osp.join(tmp_folder, series))
+        for i in range(4):
+            ds.save_as(osp.join(tmp_folder, series, f'IM{i:02d}'))
+    os.makedirs(osp.join(tmp_folder, 'annotations'))
+    ds.Modality = "ANN"
+    ds.save_as(osp.join(tmp_folder, 'annotations', 'IM00'))
+    yield tmp_folder
+    shutil.rmtree(tmp_folder)
+
+
+def test_anonymize_workers(dicom_folder_tree):
+    output_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+    try:
+        anonymize(dicom_folder_tree, output_dirs[0])
+        anonymize(dicom_folder_tree, output_dirs[1], workers=2)
+        outputs = [sorted(osp.relpath(osp.join(root, f), output_dir)
+                          for root, dirs, files in os.walk(output_dir) for f in files)
+                   for output_dir in output_dirs]
+        assert outputs[0] == outputs[1]
+        assert 'annotations' not in os.listdir(output_dirs[1])
+        with open(osp.join(output_dirs[1], 'deidentification_report.csv')) as report:
+            lines = report.readlines()
+        assert len(lines) == 2 and lines[0].startswith('input DICOM filename')
+    finally:
+        for output_dir in output_dirs:
+            shutil.rmtree(output_dir)
+
+
+def test_anonymize_workers_in_flight(dicom_folder_tree, monkeypatch, tmp_path):
+    # Outputs are handled as files are done, with at most two files per process in flight
+    in_flight = []
+
+    def wait(futures, return_when):
+        in_flight.append(len(futures))
+        return anonymizer_wait(futures, return_when=return_when)
+
+    anonymizer_wait = anonymizer.wait
+    monkeypatch.setattr(anonymizer, 'wait', wait)
+    anonymize(dicom_folder_tree, str(tmp_path / 'out.zip'), workers=2)
+    assert max(in_flight) == 4
+    assert len(in_flight) >= 9 - 4
+    with zipfile.ZipFile(str(tmp_path / 'out.zip')) as archive:
+        assert len([name for name in archive.namelist() if osp.basename(name).startswith('IM')]) == 8
+
+
+def test_anonymize_workers_non_dicom_w_err(dicom_with_other):
+    dicom_folder, tmp_folder = dicom_with_other
+    with pytest.raises(anonymizer.AnonymizerError, match=f".*not a DICOM file.*{dicom_folder}.*"):
+        anonymize(dicom_folder, tmp_folder, error_no_dicom=True, workers=2)
+    assert not os.listdir(tmp_folder)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_anonymize_use_mmap(dicom_folder_tree, monkeypatch, tmp_path, workers):
+    # use_mmap reaches the worker processes without the environment variable
+    mapped_files = tmp_path / 'mapped_files'
+
+    class RecordedMappedFile(dicom.MappedFile):
+        def __init__(self, filename, mode='rb'):
+            super().__init__(filename, mode)
+            with open(mapped_files, 'a') as f:
+                f.write(f'{filename}\n')
+
+    monkeypatch.delenv(MMAP_ENV, raising=False)
+    monkeypatch.setattr(dicom, 'MappedFile', RecordedMappedFile)
+    anonymize(dicom_folder_tree, str(tmp_path / 'out'), workers=workers)
+    assert not mapped_files.exists()
+    anonymize(dicom_folder_tree, str(tmp_path / 'out_mmap'), workers=workers, use_mmap=True)
+    assert len(mapped_files.read_text().splitlines()) == 9
+
+    mapped_files.unlink()
+    assert anonymizer.check_anonymize(str(tmp_path / 'out_mmap'), use_mmap=True)
+    assert len(mapped_files.read_text().splitlines()) == 8
+    verdicts = list(anonymizer.audit_folder(str(tmp_path / 'out_mmap'), workers=workers, use_mmap=True))
+    assert len(verdicts) == 8 and all(v.passed for v in verdicts)
+    assert len(mapped_files.read_text().splitlines()) == 16
+
+
+def test_check_anonymize(dicom_path):
+    assert not anonymizer.check_anonymize(dicom_path)
+    anonymize(dicom_path, OUTPUT_DIR)
+    output_dicom_path = osp.join(OUTPUT_DIR, osp.basename(dicom_path))
+    assert anonymizer.check_anonymize(output_dicom_path)
+    assert anonymizer.check_folder_anonymize(OUTPUT_DIR)
+    assert anonymizer.check_anonymize_fast(OUTPUT_DIR)
+
+
+def test_anonymizer_header_only(dicom_path):
+    a = anonymizer.Anonymizer(dicom_path, '', header_only=True)
+    assert 'PixelData' not in a._dataset
+    assert a._dataset.get((0x0010, 0x0010))
+    with pytest.raises(anonymizer.DeidentificationError):
+        a.run_ano()
+
+
 def test_anonymize_spectro(spectro_path):
     anonymize(spectro_path, path_ano(spectro_path))
     assert osp.exists(path_ano(spectro_path))
@@ -377,3 +600,303 @@ def test_deidentification_bin(dicom_path):
 
     assert not stderr
     assert os.listdir(OUTPUT_DIR)
+
+
+def test_anonymize_report_formats(dicom_folder_tree):
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        anonymize(dicom_folder_tree, tmp_folder, workers=2, report_formats=('csv', 'jsonl'))
+        with open(osp.join(tmp_folder, 'deidentification_report.jsonl')) as report:
+            rows = [json.loads(line) for line in report]
+        assert len(rows) == 1
+        assert rows[0]['state'] == 'removed' and rows[0]['modality'] == 'ANN'
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_anonymize_uid_cache(dicom_folder_tree, workers):
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        uid_cache = UIDCache()
+        anonymize(dicom_folder_tree, osp.join(tmp_folder, 'out'), workers=workers, uid_cache=uid_cache)
+        assert uid_cache.hits > 0
+        # The cache is not written on disk
+        assert os.listdir(tmp_folder) == ['out']
+        ds = pydicom.dcmread(osp.join(tmp_folder, 'out', 'series1', 'IM00'))
+        assert ds.StudyInstanceUID in dict(uid_cache.items()).values()
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+def test_anonymize_manifest(dicom_folder_tree, monkeypatch):
+    tmp_folder = tempfile.mkdtemp()
+    output_folder = osp.join(tmp_folder, 'out')
+    manifest_path = osp.join(tmp_folder, 'manifest.sqlite')
+    try:
+        anonymize(dicom_folder_tree, output_folder, workers=2, manifest=manifest_path)
+        with Manifest(manifest_path) as manifest:
+            records = {name: manifest.get(name) for name in ('series1/IM00', 'annotations/IM00')}
+        assert records['series1/IM00']['output'] == osp.join('series1', 'IM00')
+        assert records['annotations/IM00']['status'] == 'done'
+        assert records['annotations/IM00']['output'] is None
+
+        anonymized_files = []
+        anonymize_file = anonymizer.anonymize_file
+
+        def counted_anonymize_file(dicom_file_in, *args, **kwargs):
+            anonymized_files.append(osp.relpath(dicom_file_in, dicom_folder_tree))
+            return anonymize_file(dicom_file_in, *args, **kwargs)
+
+        monkeypatch.setattr(anonymizer, 'anonymize_file', counted_anonymize_file)
+        anonymize(dicom_folder_tree, output_folder, manifest=manifest_path)
+        assert anonymized_files == []
+        # Other settings: all files are processed again
+        anonymize(dicom_folder_tree, output_folder, config_profile='data_sharing', manifest=manifest_path)
+        assert len(anonymized_files) == 9
+        anonymized_files.clear()
+
+        # Changed input file, and input file which is now removed
+        ds = pydicom.read_file(osp.join(dicom_folder_tree, 'series1', 'IM00'))
+        ds.SeriesDescription = 'changed'
+        ds.save_as(osp.join(dicom_folder_tree, 'series1', 'IM00'))
+        ds.Modality = 'ANN'
+        ds.save_as(osp.join(dicom_folder_tree, 'series1', 'IM01'))
+        anonymize(dicom_folder_tree, output_folder, config_profile='data_sharing', manifest=manifest_path)
+        assert sorted(anonymized_files) == [osp.join('series1', 'IM00'), osp.join('series1', 'IM01')]
+        assert osp.exists(osp.join(output_folder, 'series1', 'IM00'))
+        assert not osp.exists(osp.join(output_folder, 'series1', 'IM01'))
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_anonymize_manifest_resume(dicom_folder_tree, monkeypatch, workers):
+    tmp_folder = tempfile.mkdtemp()
+    output_folder = osp.join(tmp_folder, 'out')
+    manifest_path = osp.join(tmp_folder, 'manifest.sqlite')
+    anonymize_file = anonymizer.anonymize_file
+
+    def failing_anonymize_file(dicom_file_in, *args, **kwargs):
+        if dicom_file_in.endswith(osp.join('series2', 'IM02')):
+            raise OSError('Interrupted')
+        return anonymize_file(dicom_file_in, *args, **kwargs)
+
+    try:
+        monkeypatch.setattr(anonymizer, 'anonymize_file', failing_anonymize_file)
+        with pytest.raises(OSError, match='Interrupted'):
+            anonymize(dicom_folder_tree, output_folder, manifest=manifest_path, workers=workers)
+        # The files deidentified before the error are kept and recorded
+        assert os.listdir(output_folder)
+        with Manifest(manifest_path) as manifest:
+            assert manifest.get('series1/IM00')['status'] == 'done'
+            assert manifest.get('series2/IM02') is None
+        monkeypatch.setattr(anonymizer, 'anonymize_file', anonymize_file)
+        anonymize(dicom_folder_tree, output_folder, manifest=manifest_path)
+        assert sorted(os.listdir(osp.join(output_folder, 'series2'))) == ['IM00', 'IM01', 'IM02', 'IM03']
+        with pytest.raises(DeidentificationError, match='folder output'):
+            anonymize(dicom_folder_tree, osp.join(tmp_folder, 'out.zip'), manifest=manifest_path)
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_anonymize_dedupe(dicom_folder_tree, monkeypatch, workers):
+    tmp_folder = tempfile.mkdtemp()
+    output_folder = osp.join(tmp_folder, 'out')
+    # series files are all the same instance, series3/IM00 is a copy of annotations/IM00
+    ds = pydicom.read_file(osp.join(dicom_folder_tree, 'annotations', 'IM00'))
+    ds.SOPInstanceUID = pydicom.uid.generate_uid()
+    ds.save_as(osp.join(dicom_folder_tree, 'annotations', 'IM00'))
+    os.makedirs(osp.join(dicom_folder_tree, 'series3'))
+    shutil.copy2(osp.join(dicom_folder_tree, 'annotations', 'IM00'), osp.join(dicom_folder_tree, 'series3', 'IM00'))
+    try:
+        anonymize(dicom_folder_tree, output_folder, workers=workers, dedupe=('content', 'instance'))
+        outputs = {osp.relpath(osp.join(root, f), output_folder): os.stat(osp.join(root, f))
+                   for root, dirs, files in os.walk(output_folder) for f in files}
+        assert sorted(outputs) == ['deidentification_report.csv'] + [
+            osp.join(series, f'IM{i:02d}') for series in ('series1', 'series2') for i in range(4)]
+        assert outputs[osp.join('series2', 'IM03')].st_ino == outputs[osp.join('series1', 'IM00')].st_ino
+        with open(osp.join(output_folder, 'deidentification_report.csv')) as report:
+            states = [line.split(',')[1] for line in report.readlines()[1:]]
+        assert sorted(states) == ['duplicate of annotations/IM00'] + ['duplicate of series1/IM00'] * 7 + ['removed']
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+def test_anonymize_dedupe_keys(dicom_path):
+    with pytest.raises(DeidentificationError, match='Unknown dedupe keys: uid'):
+        anonymize(dicom_path, OUTPUT_DIR, dedupe=('uid',))
+
+
+@pytest.mark.parametrize('params', [{'dedupe': ('content',)}, {'workers': 2}, {'io_threads': 2}])
+def test_anonymize_streaming_options(dicom_archives_path, params):
+    with pytest.raises(DeidentificationError, match='cannot be used with streaming'):
+        anonymize(dicom_archives_path, path_ano(dicom_archives_path), streaming=True, **params)
+    assert not osp.exists(path_ano(dicom_archives_path))
+
+
+def test_anonymize_io_threads(dicom_folder_tree):
+    shutil.copy2(osp.join(DATA_DIR, 'captures', 'sop_class_uid_SecondCapture_dicom'),
+                 osp.join(dicom_folder_tree, 'series1'))
+    output_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+    try:
+        for output_dir, io_threads in zip(output_dirs, (0, 2)):
+            anonymize(dicom_folder_tree, output_dir, keep_capture=True,
+                      io_threads=io_threads, queue_depth=2)
+        outputs = [{osp.relpath(osp.join(root, f), output_dir): open(osp.join(root, f), 'rb').read()
+                    for root, dirs, files in os.walk(output_dir) for f in files}
+                   for output_dir in output_dirs]
+        assert osp.join('captures', 'sop_class_uid_SecondCapture_dicom') in outputs[1]
+        assert outputs[0] == outputs[1]
+        with pytest.raises(DeidentificationError, match='cannot be used together'):
+            anonymize(dicom_folder_tree, output_dirs[1], io_threads=2, workers=2)
+    finally:
+        for output_dir in output_dirs:
+            shutil.rmtree(output_dir)
+
+
+@pytest.mark.parametrize('error_no_dicom', [True, False])
+def test_anonymize_io_threads_non_dicom(dicom_with_other, error_no_dicom):
+    dicom_folder, tmp_folder = dicom_with_other
+    if error_no_dicom:
+        with pytest.raises(anonymizer.AnonymizerError, match=".*not a DICOM file.*"):
+            anonymize(dicom_folder, tmp_folder, error_no_dicom=True, io_threads=2)
+        assert not os.listdir(tmp_folder)
+    else:
+        anonymize(dicom_folder, tmp_folder, error_no_dicom=False, io_threads=2)
+        assert os.listdir(tmp_folder)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_audit_folder(dicom_folder_tree, workers):
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        anonymize(dicom_folder_tree, tmp_folder)
+        summary = AuditSummary()
+        verdicts = list(anonymizer.audit_folder(tmp_folder, workers=workers, shard_size=3, summary=summary))
+        assert sorted(osp.relpath(v.filepath, tmp_folder) for v in verdicts) == [
+            osp.join(series, f'IM{i:02d}') for series in ('series1', 'series2') for i in range(4)]
+        assert all(v.passed for v in verdicts)
+        assert summary.files == 8 and summary.complete and summary.throughput > 0
+
+        # Not deidentified files, and a non DICOM file
+        shutil.copy2(osp.join(dicom_folder_tree, 'series1', 'IM00'), osp.join(tmp_folder, 'series1', 'IM04'))
+        with open(osp.join(tmp_folder, 'series2', 'IM04'), 'w') as f:
+            f.write('not a DICOM file')
+        summary = AuditSummary()
+        verdicts = {osp.relpath(v.filepath, tmp_folder): v
+                    for v in anonymizer.audit_folder(tmp_folder, workers=workers, summary=summary)}
+        assert len(verdicts) == 10 and summary.failed == 1 and summary.errors == 1
+        failures = verdicts[osp.join('series1', 'IM04')].failures
+        assert failures[pydicom.tag.Tag(0x0010, 0x0010)] == "should be ''"
+        patient_name = str(pydicom.read_file(osp.join(dicom_folder_tree, 'series1', 'IM00')).PatientName)
+        assert patient_name and patient_name not in str(verdicts[osp.join('series1', 'IM04')])
+        assert isinstance(verdicts[osp.join('series2', 'IM04')].error, AnonymizerError)
+
+        verdicts = list(anonymizer.audit_folder(tmp_folder, workers=workers, shard_size=2,
+                                                stop_on_failure=True))
+        assert not verdicts[-1].passed and all(v.passed for v in verdicts[:-1])
+        assert not anonymizer.check_folder_anonymize(osp.join(tmp_folder, 'series1'), workers=workers)
+        with pytest.raises(AnonymizerError):
+            anonymizer.check_folder_anonymize(osp.join(tmp_folder, 'series2'), workers=workers)
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+def test_check_anonymize_sample(dicom_path):
+    input_folder, output_folder = tempfile.mkdtemp(), tempfile.mkdtemp()
+    ds = pydicom.read_file(dicom_path)
+    for series, files in (('series1', 8), ('series2', 3)):
+        os.makedirs(osp.join(input_folder, series))
+        ds.SeriesInstanceUID = pydicom.uid.generate_uid()
+        for i in range(files):
+            ds.SOPInstanceUID = pydicom.uid.generate_uid()
+            ds.save_as(osp.join(input_folder, series, f'IM{i:02d}'))
+    try:
+        anonymize(input_folder, output_folder)
+        audit = anonymizer.check_anonymize_sample(output_folder, files_per_series=3, seed=0)
+        assert audit.files == 11 and audit.sampled == 6 and audit.passed
+        assert sorted(audit.series_files.values()) == [3, 8]
+        # 1 - C(4, 3) / C(8, 3) for series1, series2 being fully checked
+        assert audit.confidence == pytest.approx(1 - 4 / 56)
+        sampled = sorted(osp.relpath(v.filepath, output_folder) for vs in audit.verdicts.values() for v in vs)
+
+        archive_path = osp.join(input_folder, 'output.zip')
+        with open(osp.join(output_folder, 'deidentification_report.csv'), 'w') as f:
+            f.write('input DICOM filename,state\n')
+        shutil.make_archive(archive_path[:-4], 'zip', output_folder)
+        archive_audit = anonymizer.check_anonymize_sample(archive_path, files_per_series=3, seed=0)
+        assert archive_audit.passed and archive_audit.confidence == audit.confidence
+        assert sorted(v.filepath for vs in archive_audit.verdicts.values() for v in vs) == sampled
+
+        # A not deidentified series is detected
+        shutil.copy2(osp.join(input_folder, 'series1', 'IM00'), osp.join(output_folder, 'series1', 'IM08'))
+        audit = anonymizer.check_anonymize_sample(output_folder, files_per_series=2, tolerance=0.1)
+        assert not audit.passed and audit.failed == 1
+        # 1 - C(7, 2) / C(8, 2) for series1, a single file failing
+        assert audit.confidence == pytest.approx(1 - 21 / 28)
+        assert anonymizer.check_anonymize_sample(dicom_path).confidence == 1.
+
+        with pytest.raises(DeidentificationError, match='tolerance'):
+            anonymizer.check_anonymize_sample(output_folder, tolerance=0)
+    finally:
+        shutil.rmtree(input_folder)
+        shutil.rmtree(output_folder)
+
+
+def test_sample_audit_confidence():
+    audit = SampleAudit({'1.2': 100}, {'1.2': [None] * 5}, 0.5)
+    assert audit.confidence == pytest.approx(1 - 0.5 ** 5, abs=0.01)
+    audit = SampleAudit({'1.2': 100, '1.3': 10}, {'1.2': [None] * 5, '1.3': [None] * 10}, 0.5)
+    assert audit.confidence == pytest.approx(1 - 0.5 ** 5, abs=0.01)
+
+
+@pytest.mark.parametrize('archive_format', ['zip', 'tar', 'gztar'])
+def test_check_anonymize_archive(archive_format, monkeypatch):
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        os.makedirs(osp.join(tmp_folder, 'input'))
+        shutil.copy2(osp.join(DICOM_DATA_DIR, 'IM04'), osp.join(tmp_folder, 'input'))
+        anonymize(osp.join(tmp_folder, 'input'), osp.join(tmp_folder, 'output'))
+        archives = {folder: shutil.make_archive(osp.join(tmp_folder, folder), archive_format,
+                                                osp.join(tmp_folder, folder))
+                    for folder in ('input', 'output')}
+        # Archive members are read in memory, without extraction
+        monkeypatch.setattr(anonymizer, 'mkdtemp', None)
+        assert anonymizer.check_anonymize(archives['output'])
+        assert anonymizer.check_anonymize_fast(archives['output'])
+        assert not anonymizer.check_anonymize(archives['input'])
+        assert not anonymizer.check_anonymize_fast(archives['input'])
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+@pytest.mark.parametrize('ext', ['.zip', '.tar.gz'])
+@pytest.mark.parametrize('params', [{}, {'workers': 2}, {'io_threads': 2}])
+def test_anonymize_folder_to_archive(dicom_folder_tree, ext, params):
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        output_folder = osp.join(tmp_folder, 'output')
+        anonymize(dicom_folder_tree, output_folder, dedupe=('content',))
+        expected = {osp.relpath(osp.join(root, f), output_folder): open(osp.join(root, f), 'rb').read()
+                    for root, dirs, files in os.walk(output_folder) for f in files}
+        expected.pop('deidentification_report.csv')
+        output_archive = osp.join(tmp_folder, 'output' + ext)
+        anonymize(dicom_folder_tree, output_archive, dedupe=('content',), **params)
+        members = {}
+        for name, member_file, _ in iter_archive_files(output_archive):
+            members[name] = member_file.read()
+        report = members.pop('deidentification_report.csv').decode()
+        assert 'duplicate of series1/IM00' in report
+        assert members == expected
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+def test_anonymize_archive_output_error(dicom_with_other):
+    dicom_folder, tmp_folder = dicom_with_other
+    output_archive = osp.join(tmp_folder, 'output.zip')
+    with pytest.raises(AnonymizerError):
+        anonymize(dicom_folder, output_archive, error_no_dicom=True)
+    assert not osp.exists(output_archive)
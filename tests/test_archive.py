@@ -1,4 +1,7 @@
 import glob
+import io
+import json
+import os
 
 import pytest
 
@@ -60,3 +63,153 @@ def test_is_archive_ext_for_files_paths(non_archive_path):
     # Test if is_archive_ext returns False if the path has no archive extension
     from deidentification.archive import is_archive_ext
     assert not is_archive_ext(non_archive_path)
+
+
+@pytest.mark.parametrize('ext', ['.zip', '.tar', '.tar.gz', '.tar.bz2'])
+def test_archive_writer(ext, tmp_path):
+    from deidentification.archive import ArchiveWriter, iter_archive_files
+    output_filename = str(tmp_path / ('output' + ext))
+    files = {'a.txt': b'a', 'folder/b.txt': b'b' * 1000}
+    with ArchiveWriter(output_filename) as archive_writer:
+        for name, data in files.items():
+            archive_writer.add(name, data, mtime=0)
+    read_files = {name: member_file.read()
+                  for name, member_file, mtime in iter_archive_files(output_filename)}
+    assert read_files == files
+
+
+@pytest.mark.parametrize('ext', ['.zip', '.tar.gz'])
+def test_read_archive_members(ext, tmp_path):
+    from deidentification.archive import ArchiveWriter, read_archive_members
+    output_filename = str(tmp_path / ('output' + ext))
+    files = {'a.txt': b'a', 'folder/b.txt': b'b' * 1000, 'folder/c.txt': b'c'}
+    with ArchiveWriter(output_filename) as archive_writer:
+        for name, data in files.items():
+            archive_writer.add(name, data, mtime=0)
+    assert list(read_archive_members(output_filename, ['folder/c.txt', 'a.txt', 'missing.txt'])) == [
+        ('a.txt', b'a'), ('folder/c.txt', b'c')]
+
+
+@pytest.mark.parametrize('ext, random_access', [('.zip', True), ('.tar', True), ('.tar.gz', False)])
+def test_archive_index(ext, random_access, tmp_path):
+    from deidentification.archive import ArchiveIndex, ArchiveWriter
+    output_filename = str(tmp_path / ('output' + ext))
+    files = {'a.txt': b'a' * 10, 'folder/b.txt': bytes(range(256)) * 100, 'folder/c.txt': b'c'}
+    with ArchiveWriter(output_filename) as archive_writer:
+        for name, data in files.items():
+            archive_writer.add(name, data, mtime=0)
+    index_path = str(tmp_path / 'index.json')
+    with ArchiveIndex(output_filename, index_path=index_path) as archive_index:
+        assert archive_index.random_access is random_access
+        assert archive_index.names() == list(files)
+        assert archive_index.read('folder/b.txt') == files['folder/b.txt']
+        assert {name: member_file.read() for name, member_file in archive_index.iter_members()} == files
+        if random_access:
+            with archive_index.open('folder/b.txt') as member_file:
+                assert member_file.read(3) == bytes(range(3))
+                member_file.seek(256)
+                assert member_file.read(2) == bytes(range(2))
+    # Sidecar index of uncompressed TAR archives
+    assert os.path.exists(index_path) is (ext == '.tar')
+    if ext == '.tar':
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        index['members'] = index['members'][:1]
+        with open(index_path, 'w') as index_file:
+            json.dump(index, index_file)
+        with ArchiveIndex(output_filename, index_path=index_path) as archive_index:
+            assert archive_index.names() == ['a.txt']
+        # An index of another version of the archive is rebuilt
+        os.utime(output_filename, ns=(0, 0))
+        with ArchiveIndex(output_filename, index_path=index_path) as archive_index:
+            assert archive_index.names() == list(files)
+
+
+@pytest.mark.parametrize('ext', ['.zip', '.tar', '.tar.gz'])
+def test_archive_members_outside_root(ext, tmp_path):
+    import tarfile
+    import zipfile
+    from deidentification.archive import ArchiveIndex, iter_archive_files
+    output_filename = str(tmp_path / ('output' + ext))
+    names = ['a.txt', '../evil', 'folder/../../evil', '/b.txt']
+    if ext == '.zip':
+        with zipfile.ZipFile(output_filename, 'w') as zip_file:
+            for name in names:
+                zip_file.writestr(name, b'data')
+    else:
+        with tarfile.open(output_filename, 'w:gz' if ext == '.tar.gz' else 'w') as tar_file:
+            for name in names:
+                tar_info = tarfile.TarInfo(name)
+                tar_info.size = 4
+                tar_file.addfile(tar_info, io.BytesIO(b'data'))
+    assert [name for name, _, _ in iter_archive_files(output_filename)] == ['a.txt', 'b.txt']
+    with ArchiveIndex(output_filename) as archive_index:
+        assert archive_index.names() == ['a.txt', 'b.txt']
+
+
+@pytest.fixture
+def pack_sources(tmp_path):
+    import pydicom
+    from pydicom.encaps import encapsulate
+    from pydicom.uid import JPEG2000Lossless
+    source = tmp_path / 'source'
+    (source / 'series').mkdir(parents=True)
+    ds = pydicom.dcmread('tests/data/dicoms/IM04')
+    ds.save_as(str(source / 'series' / 'IM00'))
+    ds.file_meta.TransferSyntaxUID = JPEG2000Lossless
+    ds.PixelData = encapsulate([b'\xff\x4f\xff\x51' + b'\0' * 1000])
+    ds['PixelData'].is_undefined_length = True
+    ds.save_as(str(source / 'series' / 'IM01'))
+    (source / 'notes.txt').write_bytes(b'notes ' * 1000)
+    return source
+
+
+def test_pack_zip_compression(pack_sources, tmp_path):
+    import zipfile
+    from deidentification.archive import pack
+    cwd = os.getcwd()
+    output_filename = str(tmp_path / 'out' / 'output.zip')
+    pack(output_filename, [str(pack_sources / 'series'), str(pack_sources / 'notes.txt')], compresslevel=1)
+    assert os.getcwd() == cwd
+    with zipfile.ZipFile(output_filename) as zip_file:
+        compress_types = {zip_info.filename: zip_info.compress_type for zip_info in zip_file.infolist()}
+        assert zip_file.read('series/IM00') == (pack_sources / 'series' / 'IM00').read_bytes()
+    # Compressed transfer syntax is stored
+    assert compress_types == {'series/IM00': zipfile.ZIP_DEFLATED, 'series/IM01': zipfile.ZIP_STORED,
+                              'notes.txt': zipfile.ZIP_DEFLATED}
+    pack(output_filename, [str(pack_sources / 'series')], compresslevel=0)
+    with zipfile.ZipFile(output_filename) as zip_file:
+        assert {zip_info.compress_type for zip_info in zip_file.infolist()} == {zipfile.ZIP_STORED}
+
+
+@pytest.mark.parametrize('ext', ['.tar.gz', '.tar.bz2', '.tar'])
+@pytest.mark.parametrize('compresslevel', [None, 0, 1])
+def test_pack_tar_threads(ext, compresslevel, pack_sources, tmp_path, monkeypatch):
+    import gzip
+    import tarfile
+    from deidentification import archive
+    monkeypatch.setattr(archive, 'PARALLEL_BLOCK_SIZE', 4096)
+    archives = []
+    for threads in (1, 4):
+        output_filename = str(tmp_path / f'output{threads}{ext}')
+        archive.pack(output_filename, [str(pack_sources)], compresslevel=compresslevel, threads=threads)
+        with tarfile.open(output_filename) as tar_file:
+            archives.append({tar_info.name: tar_file.extractfile(tar_info).read()
+                             for tar_info in tar_file if tar_info.isfile()})
+    assert archives[0] == archives[1]
+    assert archives[1]['source/notes.txt'] == b'notes ' * 1000
+    if ext == '.tar.gz':
+        # Compressed blocks are gzip members
+        with gzip.open(output_filename) as gzip_file:
+            assert len(gzip_file.read()) % tarfile.RECORDSIZE == 0
+
+
+@pytest.mark.parametrize('ext', ['.zip', '.tar.gz'])
+def test_archive_writer_compression(ext, pack_sources, tmp_path):
+    from deidentification.archive import ArchiveWriter, iter_archive_files
+    output_filename = str(tmp_path / ('output' + ext))
+    files = {'IM01': (pack_sources / 'series' / 'IM01').read_bytes(), 'notes.txt': b'notes ' * 1000}
+    with ArchiveWriter(output_filename, compresslevel=9, threads=2) as archive_writer:
+        for name, data in files.items():
+            archive_writer.add(name, data, mtime=0)
+    assert {name: member_file.read() for name, member_file, _ in iter_archive_files(output_filename)} == files
@@ -0,0 +1,22 @@
+import pydicom
+
+from benchmarks import synthetic
+from benchmarks.run import iter_benchmarks, run_benchmark
+
+
+def test_synthetic_datasets(tmp_path):
+    paths = synthetic.mr_series(str(tmp_path / 'series'), slices=2, rows=8, columns=8,
+                                siemens_csa_size=64)
+    ds = pydicom.dcmread(paths[1])
+    assert ds.StudyInstanceUID == pydicom.dcmread(paths[0]).StudyInstanceUID
+    assert ds[0x0029, 0x0010].value == 'SIEMENS CSA HEADER'
+    ds = pydicom.dcmread(synthetic.enhanced_mr(str(tmp_path / 'enhanced'), frames=3, rows=8, columns=8))
+    assert len(ds.PerFrameFunctionalGroupsSequence) == 3
+    assert len(ds.PixelData) == 3 * 8 * 8 * 2
+
+
+def test_run_benchmark():
+    names = [name for name, *_ in iter_benchmarks()]
+    assert 'bench_anonymization.RunAno.time_run_ano(mr)' in names
+    for name, benchmark_class, method_name, param in iter_benchmarks(r'RunAno.*\(mr\)'):
+        assert run_benchmark(benchmark_class, method_name, param, repeat=1) > 0
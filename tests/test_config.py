@@ -54,3 +54,60 @@ def test_multiple_private_creator_name():
 
     config = load_config_profile(tmp_config)
     assert len(config[(0x2005, 0x0010)]['private_creator']) == 2
+
+
+def test_load_config_profile_copy():
+    from deidentification.config import load_config_profile
+    config = load_config_profile('cati_collector')
+    for rule in config.values():
+        rule['action'] = 'X'
+        rule.get('private_creator', []).append('Name')
+    assert load_config_profile('cati_collector') != config
+
+
+def test_load_cached(tmp_path, monkeypatch):
+    from deidentification import config
+    calls = []
+
+    def parser(content):
+        calls.append(content)
+        return content.split()
+
+    tsv_path = tmp_path / 'test.tsv'
+    tsv_path.write_text('a b')
+    assert config.load_cached(str(tsv_path), parser) == ['a', 'b']
+    assert config.load_cached(str(tsv_path), parser) == ['a', 'b']
+    assert len(calls) == 1
+    tsv_path.write_text('a b c')
+    assert config.load_cached(str(tsv_path), parser) == ['a', 'b', 'c']
+    assert len(calls) == 2
+
+    # Cache shared between processes
+    monkeypatch.setenv(config.CACHE_DIR_ENV, str(tmp_path / 'cache'))
+    monkeypatch.setattr(config, '_parsed_files', {})
+    assert config.load_cached(str(tsv_path), parser) == ['a', 'b', 'c']
+    assert len(calls) == 3
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
+    monkeypatch.setattr(config, '_parsed_files', {})
+    assert config.load_cached(str(tsv_path), parser) == ['a', 'b', 'c']
+    assert len(calls) == 3
+
+    # Corrupted or outdated cached files are parsed again
+    cache_file, = (tmp_path / 'cache').iterdir()
+    for cached in ('not JSON', '{"version": 0, "parsed": ["x"]}', '{"version": 1}'):
+        cache_file.write_text(cached)
+        monkeypatch.setattr(config, '_parsed_files', {})
+        assert config.load_cached(str(tsv_path), parser) == ['a', 'b', 'c']
+    assert len(calls) == 6
+
+
+def test_load_cached_tag_lists(tmp_path, monkeypatch):
+    from deidentification import config, tag_lists
+    monkeypatch.setenv(config.CACHE_DIR_ENV, str(tmp_path / 'cache'))
+    for path, parser in ((tag_lists.conf_profile_path, tag_lists._parse_conf_profile),
+                         (tag_lists.safe_private_path, tag_lists._parse_safe_private)):
+        monkeypatch.setattr(config, '_parsed_files', {})
+        parsed = config.load_cached(path, parser)
+        monkeypatch.setattr(config, '_parsed_files', {})
+        assert config.load_cached(path, parser) == parsed
+    assert len(list((tmp_path / 'cache').iterdir())) == 2
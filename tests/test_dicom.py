@@ -0,0 +1,107 @@
+import io
+import os.path as osp
+import shutil
+
+import pydicom
+import pytest
+
+from deidentification.dicom import (MMAP_ENV, SERIES_HEADER_SIZE, FileClassification, MappedFile, classify_file,
+                                    detect_spectro, is_capture, is_spectro, read_series_instance_uid)
+
+DATA_DIR = 'tests/data/'
+
+
+@pytest.mark.parametrize('filepath, kind', [
+    (osp.join(DATA_DIR, 'dicoms', 'IM04'), FileClassification.DICOM),
+    (osp.join(DATA_DIR, 'captures', 'sop_class_uid_SecondCapture_dicom'), FileClassification.CAPTURE),
+    (osp.join(DATA_DIR, 'captures', 'cati.png'), FileClassification.IMAGE),
+    (osp.join(DATA_DIR, 'captures', 'cati.jpg'), FileClassification.IMAGE),
+    (osp.join(DATA_DIR, 'files', 'test_file.txt'), FileClassification.NON_DICOM),
+    (osp.join(DATA_DIR, 'dicoms', 'IM.tar.gz'), FileClassification.NON_DICOM),
+    (osp.join(DATA_DIR, 'spectro', '10-001-M03_ws_6_1_raw_act.SDAT'), FileClassification.NON_DICOM),
+])
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_classify_file(filepath, kind, use_mmap):
+    classification = classify_file(filepath, use_mmap=use_mmap)
+    assert classification.kind == kind
+    assert (classification.dataset is not None) == classification.is_dicom
+
+
+def test_mapped_file(tmp_path, monkeypatch):
+    dicom_path = osp.join(DATA_DIR, 'dicoms', 'IM04')
+    with MappedFile(dicom_path) as fp, open(dicom_path, 'rb') as f:
+        assert fp.read(132) == f.read(132)
+        assert fp.seek(-4, io.SEEK_END) == fp.tell()
+        f.seek(-4, io.SEEK_END)
+        assert fp.read() == f.read()
+    empty_path = tmp_path / 'empty'
+    empty_path.write_bytes(b'')
+    with MappedFile(str(empty_path)) as fp:
+        assert fp.read() == b''
+    with pytest.raises(ValueError):
+        MappedFile(dicom_path, 'r+b')
+
+    # Deferred values are read back through a memory map
+    monkeypatch.setenv(MMAP_ENV, '1')
+    ds = classify_file(dicom_path, defer_size=16).dataset
+    assert ds.fileobj_type is MappedFile
+    assert ds.PatientName == pydicom.dcmread(dicom_path).PatientName
+
+
+def test_is_capture():
+    assert is_capture(osp.join(DATA_DIR, 'captures', 'cati.png')) == 'image'
+    assert is_capture(osp.join(DATA_DIR, 'captures', 'cati_dicom')) == 'dicom'
+    assert is_capture(osp.join(DATA_DIR, 'dicoms', 'IM04')) == ''
+
+
+@pytest.mark.parametrize('filepath, spectro', [
+    (osp.join(DATA_DIR, 'spectro', '10-001-M03_ws_6_1_raw_act.SDAT'), True),
+    (osp.join(DATA_DIR, 'spectro', '10-001-M03_ws_6_1_raw_act.SPAR'), True),
+    (osp.join(DATA_DIR, 'files', 'test_file.txt'), False),
+    (osp.join(DATA_DIR, 'files', 'test_file.json'), False),
+    (osp.join(DATA_DIR, 'captures', 'cati.png'), False),
+])
+def test_detect_spectro(filepath, spectro):
+    assert detect_spectro(filepath) is spectro
+
+
+def test_is_spectro_fallback(tmp_path, monkeypatch):
+    from deidentification import dicom
+    calls = []
+    monkeypatch.setattr(dicom, '_run_spec2nii', lambda filepath: calls.append(filepath) or False)
+    twix_path = tmp_path / 'meas.dat'
+    twix_path.write_bytes(b'\0' * 64)
+    assert detect_spectro(twix_path) is None
+    assert not is_spectro(str(twix_path))
+    assert not is_spectro(str(twix_path))
+    assert calls == [str(twix_path)]
+    assert is_spectro(osp.join(DATA_DIR, 'spectro', '10-001-M03_ws_6_1_raw_act.SDAT'))
+    assert len(calls) == 1
+
+
+def test_is_spectro_pair(tmp_path):
+    # The result for a SPAR/SDAT file depends on the other file of the pair
+    for ext in ('.SDAT', '.SPAR'):
+        shutil.copy2(osp.join(DATA_DIR, 'spectro', '10-001-M03_ws_6_1_raw_act' + ext), tmp_path / ('raw' + ext))
+    assert is_spectro(str(tmp_path / 'raw.SDAT'))
+    (tmp_path / 'raw.SPAR').unlink()
+    assert not is_spectro(str(tmp_path / 'raw.SDAT'))
+
+
+def test_read_series_instance_uid():
+    filepath = osp.join(DATA_DIR, 'dicoms', 'IM04')
+    series_instance_uid = pydicom.dcmread(filepath).SeriesInstanceUID
+    with open(filepath, 'rb') as fp:
+        assert read_series_instance_uid(fp) == series_instance_uid
+        # Only the beginning of the file is read
+        assert fp.tell() == SERIES_HEADER_SIZE
+    with open(osp.join(DATA_DIR, 'files', 'test_file.txt'), 'rb') as fp:
+        assert read_series_instance_uid(fp) is None
+
+    # Header larger than the first bytes read
+    ds = pydicom.dcmread(filepath)
+    ds.private_block(0x0019, 'TEST', create=True).add_new(0x00, 'OB', b'x' * SERIES_HEADER_SIZE)
+    data = io.BytesIO()
+    ds.save_as(data)
+    data.seek(0)
+    assert read_series_instance_uid(data) == series_instance_uid
@@ -0,0 +1,31 @@
+import os
+
+from deidentification.manifest import FILE_DONE, Manifest, file_digest
+
+
+def test_manifest(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.sqlite')
+    file_path = tmp_path / 'IM01'
+    file_path.write_bytes(b'DICOM')
+
+    with Manifest(manifest_path, 'settings') as manifest:
+        assert not manifest.is_up_to_date('IM01', str(file_path))
+        manifest.record('IM01', str(file_path), 'IM01', FILE_DONE)
+        assert manifest.is_up_to_date('IM01', str(file_path))
+
+    with Manifest(manifest_path, 'settings') as manifest:
+        record = manifest.get('IM01')
+        assert record['sha256'] == file_digest(str(file_path))
+        assert record['status'] == FILE_DONE and record['output'] == 'IM01'
+        # Same content, other modification time
+        os.utime(file_path, ns=(0, 0))
+        assert manifest.is_up_to_date('IM01', str(file_path))
+        assert manifest.get('IM01')['mtime_ns'] == 0
+        # Modified content
+        file_path.write_bytes(b'DICAM')
+        os.utime(file_path, ns=(0, 1))
+        assert not manifest.is_up_to_date('IM01', str(file_path))
+
+    # Records are dropped when settings change
+    with Manifest(manifest_path, 'other settings') as manifest:
+        assert len(manifest) == 0
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from deidentification.pipeline import run_pipeline
+
+
+def test_run_pipeline():
+    def read(item, _):
+        time.sleep(0.001)
+        return item * 2
+
+    def process(item, value):
+        if item == 5:
+            raise ValueError(item)
+        return value + 1
+
+    results = list(run_pipeline(range(50), [(read, 4), (process, 1), (lambda item, value: value, 2)],
+                                queue_depth=2))
+    assert sorted(item for item, value, error in results) == list(range(50))
+    for item, value, error in results:
+        if item == 5:
+            assert isinstance(error, ValueError) and value is None
+        else:
+            assert error is None and value == item * 2 + 1
+
+
+def test_run_pipeline_backpressure():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def read(item, _):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        return item
+
+    def process(item, value):
+        time.sleep(0.002)
+        with lock:
+            in_flight[0] -= 1
+        return value
+
+    results = run_pipeline(range(100), [(read, 4), (process, 1)], queue_depth=3)
+    assert len(list(results)) == 100
+    # Items in the queue, being processed, or read and waiting for a queue slot
+    assert in_flight[1] <= 3 + 1 + 4
+
+
+def test_run_pipeline_close():
+    threads = threading.active_count()
+    results = run_pipeline(range(1000), [(lambda item, _: item, 2), (lambda item, value: value, 1)],
+                           queue_depth=2)
+    next(results)
+    results.close()
+    assert threading.active_count() == threads
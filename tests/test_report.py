@@ -0,0 +1,95 @@
+import csv
+import json
+import os.path as osp
+import threading
+
+import pytest
+
+from deidentification import DeidentificationError
+from deidentification.report import REPORT_HEADER, DeidentificationReport, append_report_rows
+
+
+def _row(i):
+    return [f'IM{i:04d}', 'removed', 'OT', '1.2.840.10008.5.1.4.1.1.7', 'capture', ['DERIVED', 'SECONDARY']]
+
+
+def _read_csv(report_path):
+    with open(report_path) as report_file:
+        return list(csv.reader(report_file))
+
+
+def test_report_batches(tmp_path):
+    report_path = str(tmp_path / 'deidentification_report.csv')
+    report = DeidentificationReport(report_path, batch_size=3)
+    report.add(_row(0))
+    report.add(_row(1))
+    assert not osp.exists(report_path)
+    report.add(_row(2))
+    assert len(_read_csv(report_path)) == 4
+    report.add(_row(3))
+    report.close()
+    lines = _read_csv(report_path)
+    assert lines[0] == REPORT_HEADER
+    assert [line[0] for line in lines[1:]] == ['IM0000', 'IM0001', 'IM0002', 'IM0003']
+
+
+def test_report_discard(tmp_path):
+    report_path = str(tmp_path / 'deidentification_report.csv')
+    with DeidentificationReport(report_path) as report:
+        report.add(_row(0))
+        report.discard()
+    assert not osp.exists(report_path)
+
+
+def test_report_append(tmp_path):
+    report_path = str(tmp_path / 'deidentification_report.csv')
+    append_report_rows(report_path, [_row(0)])
+    append_report_rows(report_path, [_row(1)])
+    lines = _read_csv(report_path)
+    assert len(lines) == 3 and lines[0] == REPORT_HEADER
+
+
+def test_report_jsonl(tmp_path):
+    report = DeidentificationReport(str(tmp_path / 'deidentification_report.csv'),
+                                    formats=('jsonl',))
+    report.add(_row(0))
+    report.close()
+    assert not (tmp_path / 'deidentification_report.csv').exists()
+    with open(report.path('jsonl')) as report_file:
+        rows = [json.loads(line) for line in report_file]
+    assert rows == [dict(zip(REPORT_HEADER, _row(0)))]
+
+
+def test_report_threads(tmp_path):
+    report_path = str(tmp_path / 'deidentification_report.csv')
+    report = DeidentificationReport(report_path, batch_size=7)
+
+    def add_rows(start):
+        for i in range(start, start + 100):
+            report.add(_row(i))
+
+    threads = [threading.Thread(target=add_rows, args=(i * 100,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.close()
+    lines = _read_csv(report_path)
+    assert lines[0] == REPORT_HEADER
+    assert sorted(line[0] for line in lines[1:]) == [f'IM{i:04d}' for i in range(400)]
+
+
+def test_report_formats(tmp_path):
+    with pytest.raises(DeidentificationError, match='xml'):
+        DeidentificationReport(str(tmp_path / 'report.csv'), formats=('csv', 'xml'))
+
+
+def test_report_parquet(tmp_path):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    report = DeidentificationReport(str(tmp_path / 'deidentification_report.csv'),
+                                    formats=('parquet',))
+    report.add(_row(0))
+    report.close()
+    table = pyarrow_parquet.read_table(report.path('parquet'))
+    assert table.column_names == REPORT_HEADER
+    assert table.num_rows == 1
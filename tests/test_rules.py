@@ -0,0 +1,88 @@
+import pickle
+
+from deidentification import tag_lists
+from deidentification.rules import FORCE, REMOVE, RuleTable, _compile_ranges
+
+
+def _legacy_conf_profile_action(group, element):
+    if (group, element) in tag_lists.conf_profile:
+        return tag_lists.conf_profile[(group, element)]['profile'][0]
+    for tag_range in tag_lists.conf_profile_range:
+        (group_min, element_min), (group_max, element_max) = tag_range
+        if group_min <= group <= group_max and element_min <= element <= element_max:
+            return tag_lists.conf_profile_range[tag_range]['profile'][0]
+    return ''
+
+
+def test_profile_action():
+    rules = RuleTable()
+    assert rules.profile_action(0x0010, 0x0010) == 'Z'
+    assert rules.profile_action(0x5010, 0x1234) == 'X'
+    assert rules.profile_action(0x6002, 0x3000) == 'X'
+    assert rules.profile_action(0x6002, 0x3001) == ''
+    assert rules.profile_action(0x0008, 0x0008) == ''
+
+    tags = list(tag_lists.conf_profile)
+    tags += [(group, element) for group in range(0x4FFE, 0x6102)
+             for element in (0x0000, 0x2FFF, 0x3000, 0x3001, 0x4000, 0xFFFF)]
+    for group, element in tags:
+        assert rules.profile_action(group, element) == _legacy_conf_profile_action(group, element)
+
+
+def test_compile_overlapping_ranges():
+    index = _compile_ranges([
+        ((0x0009, 0x1000), (0x0009, 0x10FF), 'K'),
+        ((0x0009, 0x0000), (0x0009, 0xFFFF), 'X'),
+    ])
+    rules = RuleTable()
+    rules._profile_ranges = index
+    assert rules.profile_action(0x0009, 0x0010) == 'X'
+    assert rules.profile_action(0x0009, 0x1010) == 'K'
+    assert rules.profile_action(0x0009, 0x1100) == 'X'
+    assert rules.profile_action(0x0011, 0x1010) == ''
+
+
+def test_config_rules():
+    rules = RuleTable({
+        (0x2005, 0x101d): {'action': 'K', 'private_creator': 'Philips MR Imaging DD 001'},
+        (0x0008, 0x0032): {'action': 'K'},
+    }, {(0x0010, 0x0010): 'Name'})
+    assert rules.config[(0x2005, 0x101d)] == ('K', frozenset(['Philips MR Imaging DD 001']))
+    assert rules.config[(0x0008, 0x0032)] == ('K', None)
+    assert rules.forced_values == {(0x0010, 0x0010): 'Name'}
+    assert isinstance(rules.safe_private['SIEMENS MR HEADER'], frozenset)
+
+
+def test_rule_table_pickle():
+    rules = RuleTable({(0x0010, 0x0010): {'action': 'K'}}, {(0x0010, 0x0020): 'ID'})
+    state = rules.__getstate__()
+    assert '_profile' not in state and '_profile_ranges' not in state
+    unpickled = pickle.loads(pickle.dumps(rules))
+    assert unpickled.config == rules.config
+    assert unpickled.forced_values == rules.forced_values
+    assert unpickled._profile is rules._profile
+
+
+def test_element_action():
+    rules = RuleTable({
+        (0x2005, 0x101d): {'action': 'K', 'private_creator': 'Philips MR Imaging DD 001'},
+        (0x0029, 0x0010): {'action': 'K', 'private_creator': 'ACME'},
+        (0x0008, 0x0032): {'action': 'K'},
+    }, {(0x0010, 0x0010): 'Name'})
+    assert rules.element_action(0x0010, 0x0010) == FORCE
+    assert rules.element_action(0x0010, 0x0020) == 'Z'
+    assert rules.element_action(0x0008, 0x0032) == 'K'
+    assert rules.element_action(0x0008, 0x0060) == ''
+    # Private creators are tracked, private elements without one are removed untracked
+    assert rules.element_action(0x0019, 0x0010) == 'K'
+    assert rules.element_action(0x0019, 0x100c) == REMOVE
+    assert rules.element_action(0x0019, 0x100c, 'SIEMENS MR HEADER') == ''
+    assert rules.element_action(0x0019, 0x10ff, 'SIEMENS MR HEADER') == 'X'
+    assert rules.element_action(0x0019, 0x100c, 'UNKNOWN') == 'X'
+    assert rules.element_action(0x2005, 0x101d, 'Philips MR Imaging DD 001') == 'K'
+    assert rules.element_action(0x2005, 0x101d, 'TOTO') == 'X'
+    # Configured private creators keep their block
+    assert rules.element_action(0x0029, 0x1042, 'ACME') == 'K'
+    assert rules.element_action(0x0029, 0x1142, 'ACME') == 'X'
+    assert (0x0029, 0x1042, 'ACME') in rules._actions
+    assert pickle.loads(pickle.dumps(rules))._actions == {}
@@ -0,0 +1,42 @@
+import pytest
+from pydicom.multival import MultiValue
+from pydicom.sequence import Sequence
+from pydicom.valuerep import DSfloat, PersonName
+
+from deidentification import DeidentificationError
+from deidentification.tracking import TRACK_DIGEST, TRACK_FULL, TRACK_NONE, ValueTracker, value_digest
+
+
+def test_value_digest():
+    assert value_digest(PersonName('0001XXXX')) == value_digest('0001XXXX')
+    assert value_digest(DSfloat('0')) == value_digest(0)
+    assert value_digest(MultiValue(str, ['ORIGINAL', 'PRIMARY'])) == value_digest(['ORIGINAL', 'PRIMARY'])
+    assert value_digest('0') != value_digest(0)
+    assert value_digest(b'abc') != value_digest('abc')
+    assert value_digest(['a,b']) != value_digest(['a', 'b'])
+
+
+@pytest.mark.parametrize('mode', [TRACK_DIGEST, TRACK_FULL])
+def test_value_tracker(mode):
+    tracker = ValueTracker(mode)
+    sequence = Sequence()
+    tracker.replaced(0x00100010, PersonName('Name'), '')
+    tracker.replaced(0x00100020, '', '')
+    tracker.replaced(0x00082112, sequence, sequence)
+    tracker.removed(0x00081030, 'Study')
+    assert not tracker.passed
+    assert tracker.failures() == {0x00100010: "should be ''", 0x00081030: 'should be removed'}
+    if mode == TRACK_DIGEST:
+        assert all(isinstance(value, bytes) for value in tracker.original.values())
+    else:
+        assert tracker.original[0x00081030] == 'Study'
+
+
+def test_value_tracker_none():
+    tracker = ValueTracker(TRACK_NONE)
+    tracker.replaced(0x00100010, 'Name', '')
+    tracker.removed(0x00081030, 'Study')
+    assert not tracker.enabled
+    assert tracker.original == tracker.output == {}
+    with pytest.raises(DeidentificationError):
+        ValueTracker('partial')
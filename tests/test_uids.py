@@ -0,0 +1,36 @@
+from deidentification.uids import UIDCache, _generate_dicom_uid
+
+
+def test_uid_cache():
+    uid_cache = UIDCache()
+    uid = uid_cache(b'1.2.3')
+    assert uid == _generate_dicom_uid(b'1.2.3')
+    assert uid_cache(b'1.2.3') == uid
+    assert uid_cache('1.2.3') == _generate_dicom_uid('1.2.3')
+    assert uid_cache.stats == {'hits': 1, 'misses': 2, 'size': 2, 'maxsize': uid_cache.maxsize}
+
+
+def test_uid_cache_lru():
+    uid_cache = UIDCache(maxsize=2)
+    uid_cache('1')
+    uid_cache('2')
+    uid_cache('1')
+    uid_cache('3')
+    assert [key for key, uid in uid_cache.items()] == ['1', '3']
+
+
+def test_uid_cache_updates():
+    worker_cache = UIDCache(track_updates=True)
+    worker_cache('1')
+    worker_cache('1')
+    uid_cache = UIDCache()
+    uid_cache.merge_updates(*worker_cache.take_updates())
+    assert uid_cache.stats['hits'] == 1 and uid_cache.stats['misses'] == 1
+    assert uid_cache.items() == [('1', _generate_dicom_uid('1'))]
+    assert worker_cache.take_updates() == (0, 0, {})
+
+
+def test_uid_cache_consistency():
+    # UIDs are the same across runs without persisting the cache
+    assert UIDCache()('1.2.3') == UIDCache()('1.2.3') == _generate_dicom_uid('1.2.3')
+    assert not hasattr(UIDCache(), 'save')
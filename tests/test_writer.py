@@ -0,0 +1,154 @@
+import os
+import os.path as osp
+import tempfile
+
+import pydicom
+import pytest
+from pydicom.encaps import encapsulate
+
+from deidentification.anonymizer import Anonymizer, anonymize, check_anonymize
+from deidentification.dicom import PASSTHROUGH_DEFER_SIZE
+from deidentification.writer import (ElementRange, copy_range, dcmwrite_passthrough, detach_bulk_elements,
+                                     detach_deferred_element)
+
+DICOM_PATH = 'tests/data/dicoms/IM04'
+
+
+@pytest.fixture(params=['native', 'encapsulated'])
+def large_dicom_path(request):
+    # DICOM file whose pixel data is deferred, followed by a trailing padding element
+    ds = pydicom.dcmread(DICOM_PATH)
+    pixel_data = os.urandom(2 * PASSTHROUGH_DEFER_SIZE)
+    if request.param == 'native':
+        ds.PixelData = pixel_data
+    else:
+        ds.file_meta.TransferSyntaxUID = pydicom.uid.JPEGBaseline8Bit
+        ds.PixelData = encapsulate([pixel_data[:PASSTHROUGH_DEFER_SIZE],
+                                    pixel_data[PASSTHROUGH_DEFER_SIZE:]])
+        ds['PixelData'].is_undefined_length = True
+    ds.add_new((0xFFFC, 0xFFFC), 'OB', b'\0' * 16)
+    tmp_folder = tempfile.mkdtemp()
+    dicom_path = osp.join(tmp_folder, 'IM_large')
+    ds.save_as(dicom_path)
+    yield dicom_path
+    for filename in os.listdir(tmp_folder):
+        os.remove(osp.join(tmp_folder, filename))
+    os.rmdir(tmp_folder)
+
+
+def test_detach_deferred_element(large_dicom_path):
+    ds = pydicom.dcmread(large_dicom_path, defer_size=PASSTHROUGH_DEFER_SIZE)
+    element_range = detach_deferred_element(ds, (0x7FE0, 0x0010))
+    assert isinstance(element_range, ElementRange)
+    assert 'PixelData' not in ds
+    # Not deferred elements are not detached
+    assert detach_deferred_element(ds, (0x0010, 0x0010)) is None
+
+
+def test_anonymizer_pixel_passthrough(large_dicom_path):
+    tags_config = {(0xFFFC, 0xFFFC): {'action': 'K'}}
+    output_passthrough = large_dicom_path + '_passthrough'
+    output_loaded = large_dicom_path + '_loaded'
+    Anonymizer(large_dicom_path, output_passthrough, tags_config).run_ano()
+    Anonymizer(large_dicom_path, output_loaded, tags_config,
+               dataset=pydicom.dcmread(large_dicom_path)).run_ano()
+    with open(output_passthrough, 'rb') as f1, open(output_loaded, 'rb') as f2:
+        assert f1.read() == f2.read()
+    ds = pydicom.dcmread(output_passthrough)
+    assert ds.PixelData == pydicom.dcmread(large_dicom_path).PixelData
+    assert ds.get((0xFFFC, 0xFFFC))
+
+
+@pytest.fixture
+def bulk_dicom_path(large_dicom_path):
+    # Large DICOM file with a large private OB element before its pixel data
+    ds = pydicom.dcmread(large_dicom_path)
+    block = ds.private_block(0x0029, 'SIEMENS CSA HEADER', create=True)
+    block.add_new(0x10, 'OB', os.urandom(PASSTHROUGH_DEFER_SIZE + 1))
+    ds.add_new((0x0029, 0x0100), 'LO', 'Between bulk data')
+    ds.save_as(large_dicom_path)
+    return large_dicom_path
+
+
+def test_detach_bulk_elements(bulk_dicom_path):
+    ds = pydicom.dcmread(bulk_dicom_path, defer_size=PASSTHROUGH_DEFER_SIZE)
+    element_ranges = detach_bulk_elements(ds)
+    assert [element_range.tag for element_range in element_ranges] == [0x00291010, 0x7FE00010]
+    assert 0x00291010 not in ds and 'PixelData' not in ds
+
+    output = bulk_dicom_path + '_out'
+    dcmwrite_passthrough(output, ds, element_ranges)
+    with open(bulk_dicom_path, 'rb') as f1, open(output, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_anonymizer_bulk_passthrough(bulk_dicom_path, use_mmap):
+    tags_config = {
+        (0x0029, 0x0010): {'action': 'K', 'private_creator': 'SIEMENS CSA HEADER'},
+        (0xFFFC, 0xFFFC): {'action': 'K'},
+    }
+    output_passthrough = bulk_dicom_path + '_passthrough'
+    output_loaded = bulk_dicom_path + '_loaded'
+    Anonymizer(bulk_dicom_path, output_passthrough, tags_config, use_mmap=use_mmap).run_ano()
+    Anonymizer(bulk_dicom_path, output_loaded, tags_config,
+               dataset=pydicom.dcmread(bulk_dicom_path)).run_ano()
+    with open(output_passthrough, 'rb') as f1, open(output_loaded, 'rb') as f2:
+        assert f1.read() == f2.read()
+    ds = pydicom.dcmread(output_passthrough)
+    assert ds[0x00291010].value == pydicom.dcmread(bulk_dicom_path)[0x00291010].value
+
+
+def test_anonymizer_passthrough_in_place(large_dicom_path):
+    # The output replaces the input, whose pixel data is copied
+    pixel_data = pydicom.dcmread(large_dicom_path).PixelData
+    Anonymizer(large_dicom_path, large_dicom_path).run_ano()
+    ds = pydicom.dcmread(large_dicom_path)
+    assert ds.PixelData == pixel_data
+    assert ds.PatientIdentityRemoved == 'YES'
+    assert os.listdir(osp.dirname(large_dicom_path)) == [osp.basename(large_dicom_path)]
+
+
+@pytest.mark.parametrize('transfer_syntax', [pydicom.uid.ExplicitVRLittleEndian,
+                                             pydicom.uid.ImplicitVRLittleEndian])
+def test_anonymize_deferred_sequence(tmp_path, transfer_syntax):
+    # A defined-length sequence larger than the defer size is deferred by pydicom
+    ds = pydicom.dcmread(DICOM_PATH)
+    items = []
+    for _ in range(2 * PASSTHROUGH_DEFER_SIZE // 1000):
+        item = pydicom.Dataset()
+        item.PatientName = 'SECRET^NAME'
+        item.StudyDate = '20200101'
+        item.add_new((0x0018, 0x9073), 'FD', 1.5)
+        item.add_new((0x0020, 0x4000), 'LT', 'x' * 900)
+        items.append(item)
+    ds.PerFrameFunctionalGroupsSequence = items
+    ds.file_meta.TransferSyntaxUID = transfer_syntax
+    ds.is_implicit_VR = transfer_syntax.is_implicit_VR
+    ds.is_little_endian = True
+    input_folder = tmp_path / 'in'
+    input_folder.mkdir()
+    ds.save_as(str(input_folder / 'IM_sequence'), write_like_original=False)
+
+    deferred = pydicom.dcmread(str(input_folder / 'IM_sequence'), defer_size=PASSTHROUGH_DEFER_SIZE)
+    assert deferred._dict[0x52009230].value is None
+    assert [element_range.tag for element_range in detach_bulk_elements(deferred)] == [0x7FE00010]
+
+    output_folder = str(tmp_path / 'out')
+    anonymize(str(input_folder), output_folder)
+    output = pydicom.dcmread(osp.join(output_folder, 'IM_sequence'))
+    for item in output.PerFrameFunctionalGroupsSequence:
+        assert item.PatientName != 'SECRET^NAME'
+        assert item.get('StudyDate') != '20200101'
+    assert check_anonymize(output_folder)
+
+
+def test_copy_range():
+    data = os.urandom(1000)
+    with tempfile.TemporaryFile() as source, tempfile.TemporaryFile() as destination:
+        source.write(data)
+        source.flush()
+        destination.write(b'head')
+        copy_range(source, destination, 100, 500, chunk_size=64)
+        destination.seek(0)
+        assert destination.read() == b'head' + data[100:600]